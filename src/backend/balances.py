@@ -0,0 +1,235 @@
+# Persisted fund balances.
+#
+# fund_balances holds one running total per (user, fund, source, native currency).
+# It is kept current by triggers on transactions and investment_transactions, so
+# every write (API, import, fixed item generation, scripts) updates it inside the
+# same database transaction. calculate_stats only reads these few rows.
+#
+# compute_balances() replays the full history in Python with the original
+# branching rules; verify() compares that against the table to detect drift.
+#
+# Functions here never commit: the caller owns the transaction.
+
+FUNDS = ['total', 'saving', 'support', 'investment', 'together']
+FUND_CATEGORIES = ['Saving', 'Support', 'Investment', 'Together']
+
+# Differences below this are float rounding, not drift
+DRIFT_TOLERANCE = 0.005
+
+_FUND_LIST = ", ".join(f"'{c}'" for c in FUND_CATEGORIES)
+
+# Balance effects of one transactions row, as (user_id, fund, source, currency, amount)
+# rows. {row} is NEW or OLD and {sign} is 1 or -1. Mirrors _transaction_effects below:
+# leg 1 is the source side, leg 2 the destination of an allocation (or the fund
+# credited by a legacy expense-to-fund allocation).
+_TRANSACTION_EFFECTS = f"""
+    SELECT {{row}}.user_id AS user_id,
+        CASE
+            WHEN {{row}}.type IN ('income', 'allocation') THEN
+                CASE WHEN {{row}}.category IN ({_FUND_LIST}) THEN lower({{row}}.category) ELSE 'total' END
+            WHEN {{row}}.type = 'expense' AND COALESCE({{row}}.fund, '') != '' THEN
+                CASE WHEN {{row}}.fund IN ({_FUND_LIST}) THEN lower({{row}}.fund) END
+            WHEN {{row}}.type = 'expense' THEN 'total'
+        END AS fund,
+        CASE WHEN {{row}}.source = 'bank' THEN 'bank' ELSE 'cash' END AS source,
+        COALESCE({{row}}.currency, '') AS currency,
+        CASE WHEN {{row}}.type = 'income' THEN 1 ELSE -1 END * {{row}}.amount * {{sign}} AS amount
+    UNION ALL
+    SELECT {{row}}.user_id,
+        CASE
+            WHEN {{row}}.type = 'allocation' THEN
+                CASE WHEN {{row}}.destination_category IN ({_FUND_LIST}) THEN lower({{row}}.destination_category) ELSE 'total' END
+            WHEN {{row}}.type = 'expense' AND COALESCE({{row}}.fund, '') = '' AND {{row}}.category IN ({_FUND_LIST}) THEN
+                lower({{row}}.category)
+        END,
+        CASE
+            WHEN {{row}}.type = 'allocation' THEN CASE WHEN {{row}}.destination = 'bank' THEN 'bank' ELSE 'cash' END
+            ELSE CASE WHEN {{row}}.source = 'bank' THEN 'bank' ELSE 'cash' END
+        END,
+        COALESCE({{row}}.currency, ''),
+        {{row}}.amount * {{sign}}
+"""
+
+# Investment activity always moves the Investment fund's bank balance, in VND
+_INVESTMENT_EFFECTS = """
+    SELECT {row}.user_id AS user_id,
+        CASE WHEN {row}.type IN ('buy', 'sell', 'dividend') THEN 'investment' END AS fund,
+        'bank' AS source,
+        'VND' AS currency,
+        CASE {row}.type
+            WHEN 'buy' THEN -({row}.quantity * {row}.price + {row}.fee)
+            WHEN 'sell' THEN {row}.quantity * {row}.price - {row}.fee - {row}.tax
+            WHEN 'dividend' THEN {row}.quantity * {row}.price - {row}.tax
+        END * {sign} AS amount
+"""
+
+# Net change of the grand total (the sum over all funds) caused by one row, in its
+# native currency. Same rules as the effects above: allocations move money between
+# funds and net to zero, and so does a legacy expense-to-fund allocation.
+GRAND_TOTAL_DELTA = f"""
+    CASE
+        WHEN type = 'income' THEN amount
+        WHEN type = 'expense' AND COALESCE(fund, '') != '' THEN
+            CASE WHEN fund IN ({_FUND_LIST}) THEN -amount ELSE 0 END
+        WHEN type = 'expense' AND category IN ({_FUND_LIST}) THEN 0
+        WHEN type = 'expense' THEN -amount
+        ELSE 0
+    END
+"""
+INVESTMENT_DELTA = """
+    CASE type
+        WHEN 'buy' THEN -(quantity * price + fee)
+        WHEN 'sell' THEN quantity * price - fee - tax
+        WHEN 'dividend' THEN quantity * price - tax
+        ELSE 0
+    END
+"""
+
+def _upsert(effects):
+    # "WHERE fund IS NOT NULL" also resolves the INSERT ... SELECT / ON CONFLICT parsing ambiguity
+    return f"""
+        INSERT INTO fund_balances (user_id, fund, source, currency, amount)
+        SELECT user_id, fund, source, currency, amount FROM ({effects}) WHERE fund IS NOT NULL
+        ON CONFLICT (user_id, fund, source, currency) DO UPDATE SET amount = amount + excluded.amount;
+    """
+
+def _triggers(table, effects, columns):
+    insert = effects.format(row='NEW', sign=1)
+    delete = effects.format(row='OLD', sign=-1)
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_balances_insert AFTER INSERT ON {table}
+            BEGIN {_upsert(insert)} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_balances_delete AFTER DELETE ON {table}
+            BEGIN {_upsert(delete)} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_balances_update AFTER UPDATE OF {columns} ON {table}
+            BEGIN {_upsert(delete)} {_upsert(insert)} END""",
+    ]
+
+def create_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fund_balances (
+            user_id INTEGER NOT NULL,
+            fund TEXT NOT NULL, -- 'total', 'saving', 'support', 'investment', 'together'
+            source TEXT NOT NULL, -- 'cash' or 'bank'
+            currency TEXT NOT NULL, -- native currency of the underlying transactions
+            amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, fund, source, currency)
+        ) WITHOUT ROWID
+    ''')
+    for sql in _triggers('transactions', _TRANSACTION_EFFECTS,
+                         'user_id, amount, currency, type, category, source, destination, destination_category, fund'):
+        c.execute(sql)
+    for sql in _triggers('investment_transactions', _INVESTMENT_EFFECTS,
+                         'user_id, type, quantity, price, fee, tax'):
+        c.execute(sql)
+
+def _get_source(s):
+    return 'bank' if s == 'bank' else 'cash'
+
+def _transaction_effects(t):
+    # The original calculate_stats branching, yielding (fund, source, amount) in native currency
+    amount = t['amount']
+    source = _get_source(t['source'])
+    cat = t['category']
+    typ = t['type']
+    fund = t['fund']
+
+    if typ == 'income':
+        if cat in FUND_CATEGORIES:
+            yield cat.lower(), source, amount
+        else:
+            yield 'total', source, amount
+
+    elif typ == 'expense':
+        if fund:
+            # If t.fund, we subtract from that fund's balance
+            if fund in FUND_CATEGORIES:
+                yield fund.lower(), source, -amount
+        else:
+            yield 'total', source, -amount
+            # Legacy allocation via expense logic from JS
+            if cat in FUND_CATEGORIES:
+                yield cat.lower(), source, amount
+
+    elif typ == 'allocation':
+        # Allocation subtracts from source
+        if cat in FUND_CATEGORIES:
+            yield cat.lower(), source, -amount
+        else:
+            yield 'total', source, -amount
+
+        # And adds to destination
+        dest_source = _get_source(t['destination'])
+        dest_cat = t['destination_category']
+        if dest_cat in FUND_CATEGORIES:
+            yield dest_cat.lower(), dest_source, amount
+        else:
+            yield 'total', dest_source, amount
+
+def _investment_effects(inv):
+    qty = inv['quantity']
+    if inv['type'] == 'buy':
+        yield 'investment', 'bank', -1 * ((qty * inv['price']) + inv['fee'])
+    elif inv['type'] == 'sell':
+        yield 'investment', 'bank', (qty * inv['price']) - inv['fee'] - inv['tax']
+    elif inv['type'] == 'dividend':
+        yield 'investment', 'bank', (qty * inv['price']) - inv['tax']
+
+def compute_balances(conn, user_id=None):
+    # Full-history replay: {(user_id, fund, source, currency): amount}
+    where, args = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    balances = {}
+
+    rows = conn.execute(f'''
+        SELECT user_id, amount, currency, type, category, source, destination, destination_category, fund
+        FROM transactions {where}
+    ''', args)
+    for t in rows:
+        for fund, source, amount in _transaction_effects(t):
+            key = (t['user_id'], fund, source, t['currency'] or '')
+            balances[key] = balances.get(key, 0.0) + amount
+
+    rows = conn.execute(f'''
+        SELECT user_id, type, quantity, price, fee, tax FROM investment_transactions {where}
+    ''', args)
+    for inv in rows:
+        for fund, source, amount in _investment_effects(inv):
+            key = (inv['user_id'], fund, source, 'VND')
+            balances[key] = balances.get(key, 0.0) + amount
+
+    return balances
+
+def stored_balances(conn, user_id=None):
+    where, args = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    rows = conn.execute(f'SELECT user_id, fund, source, currency, amount FROM fund_balances {where}', args)
+    return {(r[0], r[1], r[2], r[3]): r[4] for r in rows}
+
+def get_balances(conn, user_id):
+    # [(fund, source, currency, amount)] for one user; at most a few dozen rows
+    return conn.execute(
+        'SELECT fund, source, currency, amount FROM fund_balances WHERE user_id = ?', (user_id,)
+    ).fetchall()
+
+def verify(conn, user_id=None):
+    # Returns [(key, stored, expected)] for every balance that has drifted
+    expected = compute_balances(conn, user_id)
+    stored = stored_balances(conn, user_id)
+    drift = []
+    for key in sorted(set(expected) | set(stored), key=str):
+        have = stored.get(key, 0.0)
+        want = expected.get(key, 0.0)
+        if abs(have - want) > DRIFT_TOLERANCE:
+            drift.append((key, have, want))
+    return drift
+
+def rebuild(conn, user_id=None):
+    expected = compute_balances(conn, user_id)
+    if user_id is not None:
+        conn.execute('DELETE FROM fund_balances WHERE user_id = ?', (user_id,))
+    else:
+        conn.execute('DELETE FROM fund_balances')
+    conn.executemany(
+        'INSERT INTO fund_balances (user_id, fund, source, currency, amount) VALUES (?, ?, ?, ?, ?)',
+        [key + (amount,) for key, amount in expected.items()]
+    )
+    return len(expected)
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+import zlib
+
+# Response compression.
+#
+# ParFinHandler._send and _send_stream gzip every response whose content type is
+# compressible when the client's Accept-Encoding allows it. Buffered bodies below
+# COMPRESS_MIN_SIZE are sent as they are; streamed bodies are compressed chunk by
+# chunk. STATS records bytes in and out and the CPU time spent, so the ratio can
+# be weighed against the cost (see /api/debug/compression).
+
+COMPRESS_ENABLED = os.environ.get('PARFIN_COMPRESS', '1').lower() not in ('0', 'false', 'no')
+COMPRESS_MIN_SIZE = int(os.environ.get('PARFIN_COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('PARFIN_COMPRESS_LEVEL', 6))
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+def compressible(content_type):
+    return (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+def accepts_gzip(accept_encoding):
+    # True unless the client did not list gzip (or *) or gave it q=0
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+class CompressionStats:
+    """Running totals of compressed responses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.responses = 0
+            self.streams = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.cpu_seconds = 0.0
+            self.skipped_small = 0
+            self.skipped_client = 0
+
+    def record(self, bytes_in, bytes_out, cpu_seconds, streamed=False):
+        with self._lock:
+            if streamed:
+                self.streams += 1
+            else:
+                self.responses += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu_seconds
+
+    def skip(self, reason):
+        # reason: 'small' (under COMPRESS_MIN_SIZE) or 'client' (no gzip in Accept-Encoding)
+        with self._lock:
+            if reason == 'small':
+                self.skipped_small += 1
+            else:
+                self.skipped_client += 1
+
+    def snapshot(self):
+        with self._lock:
+            megabytes = self.bytes_in / (1024 * 1024)
+            return {
+                "enabled": COMPRESS_ENABLED,
+                "level": COMPRESS_LEVEL,
+                "min_size": COMPRESS_MIN_SIZE,
+                "responses": self.responses,
+                "streams": self.streams,
+                "skipped_small": self.skipped_small,
+                "skipped_client": self.skipped_client,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+                "cpu_ms": round(self.cpu_seconds * 1000, 3),
+                "cpu_ms_per_mb": round(self.cpu_seconds * 1000 / megabytes, 3) if megabytes else None,
+            }
+
+STATS = CompressionStats()
+
+def gzip_body(body, level=COMPRESS_LEVEL, stats=STATS):
+    # Returns the gzip-compressed body, or None when compressing does not shrink it
+    start = time.thread_time()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    out = compressor.compress(body) + compressor.flush()
+    if stats is not None:
+        stats.record(len(body), min(len(out), len(body)), time.thread_time() - start)
+    return out if len(out) < len(body) else None
+
+def gzip_stream(chunks, level=COMPRESS_LEVEL, stats=STATS):
+    # Compresses an iterable of bytes incrementally into a single gzip member.
+    # CPU time is measured around the compressor only, not the chunk producer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    bytes_in = bytes_out = 0
+    cpu = 0.0
+    try:
+        for data in chunks:
+            start = time.thread_time()
+            out = compressor.compress(data)
+            cpu += time.thread_time() - start
+            bytes_in += len(data)
+            if out:
+                bytes_out += len(out)
+                yield out
+        start = time.thread_time()
+        out = compressor.flush()
+        cpu += time.thread_time() - start
+        bytes_out += len(out)
+        yield out
+    finally:
+        if stats is not None:
+            stats.record(bytes_in, bytes_out, cpu, streamed=True)
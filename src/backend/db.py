@@ -1,183 +1,202 @@
 import sqlite3
 import os
-import hashlib
 import json
+import threading
+import time
+import contextlib
 from datetime import datetime
+from backend.migrations import migrate
 
 DB_PATH = os.path.join('data', 'parfin.db')
 
+# Connection pool sizing. Pooled connections are tuned once when opened and keep
+# their page cache and prepared statement cache between checkouts.
+DB_POOL_SIZE = int(os.environ.get('PARFIN_DB_POOL_SIZE', 16))
+DB_POOL_TIMEOUT = float(os.environ.get('PARFIN_DB_POOL_TIMEOUT', 30))
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to every connection right after it is opened
+CONNECTION_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000', # ~16 MB page cache
+    'PRAGMA mmap_size = 268435456', # 256 MB
+    'PRAGMA temp_store = MEMORY',
+]
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    # Connections may be checked out by one thread and returned by another, so
+    # sqlite's same-thread check is disabled; the pool guarantees exclusive use.
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Create Users Table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create Transactions Table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            currency TEXT DEFAULT 'VND',
-            type TEXT NOT NULL, -- 'income' or 'expense'
-            category TEXT NOT NULL,
-            description TEXT,
-            source TEXT DEFAULT 'cash', -- 'cash' or 'bank'
-            destination TEXT DEFAULT NULL, -- 'cash' or 'bank' (for transfers)
-            fund TEXT, -- 'Saving', 'Support', 'Investment', 'Together'
-            date TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Check if admin exists, if not create default admin
-    c.execute('SELECT * FROM users WHERE role = ?', ('admin',))
-    if not c.fetchone():
-        # Default admin: admin / admin123
-        # In a real app, use a proper salt and hashing library like bcrypt. 
-        # For "No frameworks" constraint, we'll use sha256.
-        pw_hash = hashlib.sha256('admin123'.encode()).hexdigest()
-        c.execute('INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)', 
-                  ('admin', pw_hash, 'admin'))
-        print("Default admin user created (admin/admin123)")
-        
-    # Migration: Add source column if it doesn't exist (for existing databases)
-    try:
-        c.execute('SELECT source FROM transactions LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding source column to transactions table...")
-        c.execute("ALTER TABLE transactions ADD COLUMN source TEXT DEFAULT 'cash'")
-
-    # Migration: Add destination column to transactions if it doesn't exist
-    try:
-        c.execute('SELECT destination FROM transactions LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding destination column to transactions table...")
-        c.execute("ALTER TABLE transactions ADD COLUMN destination TEXT DEFAULT NULL")
-
-    # Migration: Add destination_category column to transactions if it doesn't exist
-    try:
-        c.execute('SELECT destination_category FROM transactions LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding destination_category column to transactions table...")
-        c.execute("ALTER TABLE transactions ADD COLUMN destination_category TEXT DEFAULT NULL")
-
-    # Migration: Add fund column if it doesn't exist
-    try:
-        c.execute('SELECT fund FROM transactions LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding fund column to transactions table...")
-        c.execute("ALTER TABLE transactions ADD COLUMN fund TEXT DEFAULT NULL")
-
-    # Migration: Add currency column if it doesn't exist
-    try:
-        c.execute('SELECT currency FROM transactions LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding currency column to transactions table...")
-        c.execute("ALTER TABLE transactions ADD COLUMN currency TEXT DEFAULT 'VND'")
-
-    # Create Fixed Items Table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS fixed_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            type TEXT NOT NULL, -- 'income' or 'expense'
-            category TEXT NOT NULL,
-            description TEXT,
-            source TEXT DEFAULT 'cash', -- 'cash' or 'bank'
-            destination TEXT DEFAULT NULL, -- 'cash' or 'bank' (for transfers)
-            destination_category TEXT DEFAULT NULL, -- 'Saving', etc.
-            fund TEXT, -- 'Saving', 'Support', 'Investment', 'Together'
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
-    # Migration: Add fund column to fixed_items if it doesn't exist
-    try:
-        c.execute('SELECT fund FROM fixed_items LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding fund column to fixed_items table...")
-        c.execute("ALTER TABLE fixed_items ADD COLUMN fund TEXT DEFAULT NULL")
-
-    # Migration: Add destination column to fixed_items if it doesn't exist
-    try:
-        c.execute('SELECT destination FROM fixed_items LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding destination column to fixed_items table...")
-        c.execute("ALTER TABLE fixed_items ADD COLUMN destination TEXT DEFAULT NULL")
-
-    # Migration: Add destination_category column to fixed_items if it doesn't exist
-    try:
-        c.execute('SELECT destination_category FROM fixed_items LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding destination_category column to fixed_items table...")
-        c.execute("ALTER TABLE fixed_items ADD COLUMN destination_category TEXT DEFAULT NULL")
-
-    # Create Settings Table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL
-        )
-    ''')
-
-    # Create Investment Transactions Table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS investment_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            symbol TEXT NOT NULL,
-            asset_type TEXT DEFAULT 'stock', -- 'stock', 'bond', 'crypto', 'fund'
-            type TEXT NOT NULL, -- 'buy', 'sell', 'dividend'
-            quantity REAL DEFAULT 0,
-            price REAL DEFAULT 0,
-            fee REAL DEFAULT 0,
-            tax REAL DEFAULT 0, -- TNCN for dividends/selling
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
-    # Migration: Add asset_type column to investment_transactions if it doesn't exist
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    """Checkout/return pool of tuned sqlite connections for a single database file."""
+
+    def __init__(self, path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._created = 0
+
+    def acquire(self):
+        start = time.perf_counter()
+        waited = False
+        with self._cond:
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                # Reserve the slot before opening so other threads see the pool as full
+                self._size += 1
+                conn = None
+
+            elapsed = time.perf_counter() - start
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+
+        if conn is None:
+            try:
+                conn = get_db_connection()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                # The connection is unusable; drop it rather than hand it out again
+                discard = True
+        with self._cond:
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if discard:
+            conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            # release() rolls back anything left uncommitted by an exception
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "created": self._created,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": self._wait_time,
+                "wait_time_max": self._max_wait,
+                "wait_time_avg": (self._wait_time / self._waits) if self._waits else 0.0,
+                "timeouts": self._timeouts
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    # DB_PATH may be repointed (e.g. by tests); connections to the old file are dropped
+    if _pool is None or _pool.path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.path != DB_PATH:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+_bound = threading.local()
+
+def connection():
+    # Usage: with connection() as conn: ...
+    # Commits on success, rolls back on error, and returns the connection to the pool.
+    # Inside shared_connection() the thread's shared connection is returned as is,
+    # and committing is left to its owner.
+    conn = getattr(_bound, 'conn', None)
+    if conn is not None:
+        return contextlib.nullcontext(conn)
+    return get_pool().connection()
+
+@contextlib.contextmanager
+def shared_connection():
+    # Binds one pooled connection to the calling thread for the duration of the
+    # block, so every connection() in it (handlers, logic, query_db) runs on it.
+    # The caller commits or rolls back; whatever is left is rolled back.
+    pool = get_pool()
+    conn = pool.acquire()
+    _bound.conn = conn
     try:
-        c.execute('SELECT asset_type FROM investment_transactions LIMIT 1')
-    except sqlite3.OperationalError:
-        print("Migrating database: Adding asset_type column to investment_transactions table...")
-        c.execute("ALTER TABLE investment_transactions ADD COLUMN asset_type TEXT DEFAULT 'stock'")
-
-    # Initialize default exchange rate if not exists
-    c.execute('SELECT value FROM settings WHERE key = ?', ('exchange_rate_usd_vnd',))
-    if not c.fetchone():
-        c.execute("INSERT INTO settings (key, value) VALUES (?, ?)", ('exchange_rate_usd_vnd', '25000'))
-        print("Initialized default exchange rate: 1 USD = 25000 VND")
+        yield conn
+    finally:
+        _bound.conn = None
+        pool.release(conn)
 
-    conn.commit()
-    conn.close()
+def pool_stats():
+    return get_pool().stats()
 
-def query_db(query, args=(), one=False):
+def init_db():
+    # Brings the schema up to date; see backend.migrations
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(query, args)
-    rv = cur.fetchall()
-    conn.commit()
-    conn.close()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+def query_db(query, args=(), one=False, conn=None):
+    # Pass conn to run several queries on one checked-out connection
+    if conn is not None:
+        rv = conn.execute(query, args).fetchall()
+    else:
+        with connection() as pooled:
+            rv = pooled.execute(query, args).fetchall()
     return (rv[0] if rv else None) if one else rv
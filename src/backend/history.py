@@ -0,0 +1,181 @@
+import bisect
+import datetime
+from itertools import accumulate, groupby
+from operator import itemgetter
+from backend import balances
+from backend import portfolio
+from backend import prices
+
+# Net-worth history.
+#
+# net_worth() returns a time series of cash (the sum of all fund balances),
+# investment cost basis, holdings value and net worth, sampled at the end of each
+# day, week or month of a range. It is computed in one pass rather than per date:
+# the changes are summed per date in SQL, accumulated into running totals, and
+# each sample date is a bisect into those.
+#
+# Cash is worked backwards from fund_balances (today's totals) by undoing the
+# changes dated after the start of the range, so rows before the range are never
+# read. Cost basis comes from the portfolio checkpoints, which the caller must
+# have synced for the currency (see portfolio.sync).
+#
+# Holdings are valued the same way: each symbol's value only changes on a trade
+# or a close, so those dates are merged per symbol into value changes. Weekly and
+# monthly series read only the close in effect on each sample date (an as-of
+# join, see prices.as_of); daily ones read every close in the range.
+
+INTERVALS = ('day', 'week', 'month')
+MAX_POINTS = 10000
+
+class HistoryError(ValueError):
+    pass
+
+def sample_dates(start_date, end_date, interval):
+    # The last day of each period that overlaps [start_date, end_date], clipped to end_date
+    if interval not in INTERVALS:
+        raise HistoryError(f"interval must be one of {', '.join(INTERVALS)}")
+    try:
+        start = datetime.date.fromisoformat(start_date)
+        end = datetime.date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        raise HistoryError("start_date and end_date must be YYYY-MM-DD")
+    if start > end:
+        raise HistoryError("start_date is after end_date")
+
+    dates = []
+    day = start
+    while day <= end:
+        if interval == 'day':
+            period_end = day
+        elif interval == 'week':
+            period_end = day + datetime.timedelta(days=6 - day.weekday()) # Sunday
+        else:
+            period_end = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+        dates.append(min(period_end, end).isoformat())
+        if len(dates) > MAX_POINTS:
+            raise HistoryError(f"More than {MAX_POINTS} points; use a longer interval")
+        day = period_end + datetime.timedelta(days=1)
+    return dates
+
+def _running_totals(rows):
+    # rows of (date, key, amount) ordered by date -> {key: ([dates], [running totals])}
+    grouped = {}
+    for date, key, amount in rows:
+        dates, amounts = grouped.setdefault(key, ([], []))
+        dates.append(date)
+        amounts.append(amount)
+    return {key: (dates, list(accumulate(amounts))) for key, (dates, amounts) in grouped.items()}
+
+# Sorts after any date
+_END = '9999-99-99'
+
+def _add(changes, date, amount):
+    if amount:
+        changes[date] = changes.get(date, 0.0) + amount
+
+def _accumulated(changes):
+    # {date: change} -> ([dates], [running totals])
+    dates = sorted(changes)
+    return dates, list(accumulate(changes[date] for date in dates))
+
+def _total_at(running, date):
+    # Running total of everything dated on or before date
+    dates, totals = running
+    i = bisect.bisect_right(dates, date)
+    return totals[i - 1] if i else 0.0
+
+def _holdings(conn, user_id, samples, interval, currency):
+    # Running totals of holdings value: (priced, unpriced). Priced holdings are at
+    # their close in NATIVE_CURRENCY; those with no close yet at their cost in currency.
+    trades = {}
+    for symbol, date, quantity, cost in conn.execute('''
+            SELECT symbol, date, quantity, total_cost FROM portfolio_checkpoints
+            WHERE user_id = ? AND currency = ? AND date <= ? ORDER BY symbol, date, trade_id
+            ''', (user_id, currency, samples[-1])):
+        trades.setdefault(symbol, []).append((date, quantity, cost))
+
+    # Daily samples need every close; coarser ones only the close in effect on each
+    # sample date, looked up with an as-of join
+    if interval == 'day':
+        rows = prices.closes(conn, trades, samples[0], samples[-1])
+    else:
+        rows = prices.as_of(conn, trades, samples)
+    closes = {}
+    for symbol, group in groupby(rows, key=itemgetter(0)):
+        closes.setdefault(symbol, []).extend(group)
+
+    priced, unpriced = {}, {} # date -> change
+    for symbol, points in trades.items():
+        series = sorted(closes.get(symbol, ()))
+        series.append((symbol, _END, None))
+        quantity = cost = 0.0 # of the position while held, else 0
+        close = None
+        i = 0
+        for _, date, new_close in series:
+            # Trades up to and including the close's date, at the close before it
+            while i < len(points) and points[i][0] <= date:
+                trade_date, held_quantity, held_cost = points[i]
+                i += 1
+                if held_quantity <= portfolio.MIN_QUANTITY:
+                    held_quantity = held_cost = 0.0
+                if close is None:
+                    _add(unpriced, trade_date, held_cost - cost)
+                else:
+                    _add(priced, trade_date, (held_quantity - quantity) * close)
+                quantity, cost = held_quantity, held_cost
+            if new_close is None:
+                continue
+            if close is None:
+                _add(unpriced, date, -cost)
+                _add(priced, date, quantity * new_close)
+            else:
+                _add(priced, date, quantity * (new_close - close))
+            close = new_close
+    return _accumulated(priced), _accumulated(unpriced)
+
+def net_worth(conn, user_id, start_date, end_date, interval, target_currency, matrix):
+    # {"dates", "cash", "cost_basis", "holdings_value", "net_worth"} as parallel lists.
+    # Each currency converts at the rate in effect on the sample date.
+    samples = sample_dates(start_date, end_date, interval)
+
+    current = dict(conn.execute(
+        'SELECT currency, SUM(amount) FROM fund_balances WHERE user_id = ? GROUP BY currency', (user_id,)))
+    later = _running_totals(conn.execute(f'''
+        SELECT date, currency, SUM(delta) FROM (
+            SELECT date, COALESCE(currency, '') AS currency, {balances.GRAND_TOTAL_DELTA} AS delta
+            FROM transactions WHERE user_id = ? AND date > ?
+            UNION ALL
+            SELECT date, ?, {balances.INVESTMENT_DELTA}
+            FROM investment_transactions WHERE user_id = ? AND date > ?
+        )
+        GROUP BY date, currency ORDER BY date
+    ''', (user_id, start_date, portfolio.NATIVE_CURRENCY, user_id, start_date)))
+    # Balance on the start date, per currency: today's minus everything after it
+    opening = {currency: current.get(currency, 0.0) - (later[currency][1][-1] if currency in later else 0.0)
+               for currency in current.keys() | later.keys()}
+
+    # Cost basis changes by the difference between consecutive checkpoints of a symbol
+    cost = _running_totals((date, None, delta) for date, delta in conn.execute('''
+        SELECT date, SUM(delta) FROM (
+            SELECT date, total_cost - LAG(total_cost, 1, 0) OVER (PARTITION BY symbol ORDER BY date, trade_id) AS delta
+            FROM portfolio_checkpoints WHERE user_id = ? AND currency = ?
+        )
+        GROUP BY date ORDER BY date
+    ''', (user_id, target_currency)))
+    cost = cost.get(None, ([], []))
+    priced, unpriced = _holdings(conn, user_id, samples, interval, target_currency)
+
+    result = {"dates": samples, "cash": [], "cost_basis": [], "holdings_value": [], "net_worth": []}
+    for date in samples:
+        cash = 0.0
+        for currency in sorted(opening):
+            amount = opening[currency] + (_total_at(later[currency], date) if currency in later else 0.0)
+            cash += amount * matrix.factor(currency, target_currency, date)
+        cost_basis = _total_at(cost, date)
+        holdings_value = (_total_at(priced, date) * matrix.factor(portfolio.NATIVE_CURRENCY, target_currency, date)
+                          + _total_at(unpriced, date))
+        result["cash"].append(cash)
+        result["cost_basis"].append(cost_basis)
+        result["holdings_value"].append(holdings_value)
+        result["net_worth"].append(cash + holdings_value)
+    return result
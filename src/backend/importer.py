@@ -0,0 +1,269 @@
+import csv
+import datetime
+import hashlib
+import json
+import math
+import re
+
+# Bulk transaction import.
+#
+# Uploads are parsed incrementally from a text stream (the request socket for raw
+# uploads), validated row by row and inserted with executemany() in batches of
+# IMPORT_BATCH_SIZE, so memory stays bounded no matter how large the file is.
+# Invalid rows are rejected and reported; the valid ones are still imported.
+#
+# Duplicates are detected through transactions.content_hash, a digest of the
+# imported columns indexed per user. Matching counts copies: a file that holds two
+# identical rows inserts both the first time and neither when imported again.
+# content_hash is filled in here; a trigger clears it when a row's content is
+# edited, and backfill_hashes() recomputes the missing ones before each import.
+#
+# Functions here never commit: the caller owns the transaction.
+
+IMPORT_BATCH_SIZE = 1000
+
+# Per-row errors listed in the summary; the rejected count is always exact
+MAX_REPORTED_ERRORS = 100
+
+# A single JSON value larger than this is treated as malformed
+MAX_RECORD_CHARS = 1024 * 1024
+
+TYPES = ('income', 'expense', 'allocation')
+SOURCES = ('cash', 'bank')
+
+# Hashed and inserted columns, in order
+IMPORT_FIELDS = ['date', 'type', 'category', 'amount', 'currency', 'source',
+                 'destination', 'destination_category', 'fund', 'description']
+
+# Columns whose edits make the stored hash stale
+_HASHED_COLUMNS = ', '.join(IMPORT_FIELDS)
+
+class UploadError(ValueError):
+    # The upload as a whole cannot be parsed; the import is rolled back
+    pass
+
+def create_schema(c):
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_user_content_hash
+        ON transactions (user_id, content_hash)''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_content_hash_update
+        AFTER UPDATE OF {_HASHED_COLUMNS} ON transactions
+        WHEN NEW.content_hash IS NOT NULL
+        BEGIN UPDATE transactions SET content_hash = NULL WHERE id = NEW.id; END''')
+
+def content_hash(values):
+    # values: IMPORT_FIELDS in order; NULL and '' hash the same
+    parts = []
+    for name, value in zip(IMPORT_FIELDS, values):
+        if value is None:
+            value = ''
+        elif name == 'amount':
+            value = repr(float(value))
+        parts.append(str(value))
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+def backfill_hashes(conn, user_id=None, batch_size=IMPORT_BATCH_SIZE):
+    # Hashes rows written outside the importer (API, scripts) or edited since
+    where, args = ('user_id = ? AND ', (user_id,)) if user_id is not None else ('', ())
+    cur = conn.execute(f'''
+        SELECT id, {_HASHED_COLUMNS} FROM transactions WHERE {where}content_hash IS NULL
+    ''', args)
+    updated = 0
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return updated
+        conn.executemany('UPDATE transactions SET content_hash = ? WHERE id = ?',
+                         [(content_hash(row[1:]), row[0]) for row in rows])
+        updated += len(rows)
+
+# Parsers yield (row number, record). A row that cannot be decoded on its own is
+# yielded as a ValueError and rejected like any other invalid row.
+
+def parse_csv(stream):
+    reader = csv.DictReader(stream)
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except csv.Error as e:
+        raise UploadError(f"CSV line {reader.line_num}: {e}")
+
+def parse_ndjson(stream):
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"invalid JSON: {e}")
+
+_WHITESPACE = re.compile(r'\s*')
+
+def parse_json_array(stream, chunk_size=64 * 1024):
+    # A top-level JSON array, decoded one element at a time with raw_decode() as
+    # text arrives, so the document is never held in memory as a whole.
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+    expect = '['  # '[', 'value', 'value or ]', ', or ]' or 'end'
+    index = 0
+
+    def read_more():
+        # Drops the consumed text, so the buffer only holds the unparsed tail
+        nonlocal buf, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if not eof:
+                read_more()
+                continue
+            if expect == 'end':
+                return
+            raise UploadError(f"Unexpected end of JSON input, expecting {expect}")
+
+        char = buf[pos]
+        if expect == '[':
+            if char != '[':
+                raise UploadError("JSON upload must be an array of objects")
+            pos += 1
+            expect = 'value or ]'
+        elif expect in ('value or ]', ', or ]') and char == ']':
+            pos += 1
+            expect = 'end'
+        elif expect == ', or ]':
+            if char != ',':
+                raise UploadError(f"Expected ',' or ']' after element {index}")
+            pos += 1
+            expect = 'value'
+        elif expect == 'end':
+            raise UploadError("Unexpected data after the JSON array")
+        else:
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except ValueError as e:
+                if eof or len(buf) - pos > MAX_RECORD_CHARS:
+                    raise UploadError(f"Element {index + 1}: {e}")
+                # Probably cut off at the chunk boundary
+                read_more()
+                continue
+            if end == len(buf) and not eof:
+                # A bare number may continue in the next chunk
+                read_more()
+                continue
+            index += 1
+            pos = end
+            expect = ', or ]'
+            yield index, record
+
+PARSERS = {
+    'csv': parse_csv,
+    'json': parse_json_array,
+    'ndjson': parse_ndjson,
+}
+
+def _text(record, name, default=None):
+    value = record.get(name)
+    if value is None:
+        return default
+    value = str(value).strip()
+    return value or default
+
+def validate(record):
+    # Returns the IMPORT_FIELDS values for one record, or raises ValueError
+    if isinstance(record, ValueError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+
+    try:
+        amount = float(_text(record, 'amount'))
+    except (TypeError, ValueError):
+        raise ValueError("amount must be a number")
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("amount must be positive")
+
+    trans_type = _text(record, 'type')
+    if trans_type not in TYPES:
+        raise ValueError(f"type must be one of {', '.join(TYPES)}")
+
+    category = _text(record, 'category')
+    if not category:
+        raise ValueError("category is required")
+
+    try:
+        date = datetime.date.fromisoformat(_text(record, 'date', '')).isoformat()
+    except ValueError:
+        raise ValueError("date must be YYYY-MM-DD")
+
+    currency = _text(record, 'currency', 'VND').upper()
+    if not (len(currency) == 3 and currency.isalpha()):
+        raise ValueError("currency must be a 3-letter code")
+
+    source = _text(record, 'source', 'cash')
+    destination = _text(record, 'destination')
+    if source not in SOURCES or destination not in SOURCES + (None,):
+        raise ValueError("source and destination must be cash or bank")
+
+    return (date, trans_type, category, amount, currency, source, destination,
+            _text(record, 'destination_category'), _text(record, 'fund'), _text(record, 'description', ''))
+
+_INSERT = f'''
+    INSERT INTO transactions (user_id, {_HASHED_COLUMNS}, content_hash)
+    VALUES (?, {', '.join('?' for _ in IMPORT_FIELDS)}, ?)
+'''
+
+def _existing_counts(conn, user_id, hashes, last_id):
+    placeholders = ', '.join('?' for _ in hashes)
+    return dict(conn.execute(f'''
+        SELECT content_hash, COUNT(*) FROM transactions
+        WHERE user_id = ? AND content_hash IN ({placeholders}) AND id <= ?
+        GROUP BY content_hash
+    ''', [user_id] + list(hashes) + [last_id]))
+
+def _insert_batch(conn, user_id, batch, dedupe, available, last_id, summary):
+    if dedupe:
+        unseen = {h for _, h in batch if h not in available}
+        if unseen:
+            counts = _existing_counts(conn, user_id, unseen, last_id)
+            # Only hashes that already existed are remembered; for the rest a
+            # repeated lookup returns 0 again, so the dict stays small
+            available.update(counts)
+        rows = []
+        for values, h in batch:
+            if available.get(h, 0) > 0:
+                available[h] -= 1
+                summary["skipped"] += 1
+            else:
+                rows.append((values, h))
+        batch = rows
+    conn.executemany(_INSERT, [(user_id,) + values + (h,) for values, h in batch])
+    summary["inserted"] += len(batch)
+
+def import_records(conn, user_id, records, dedupe=True, batch_size=IMPORT_BATCH_SIZE):
+    # records: (row number, record) pairs from one of PARSERS.
+    # Returns {"inserted", "skipped", "rejected", "errors": [{"row", "error"}]}
+    summary = {"inserted": 0, "skipped": 0, "rejected": 0, "errors": []}
+    if dedupe:
+        backfill_hashes(conn, user_id)
+    # Rows this import inserts get higher ids, so they never count as pre-existing
+    last_id = conn.execute('SELECT MAX(id) FROM transactions').fetchone()[0] or 0
+    available = {}
+
+    batch = []
+    for row, record in records:
+        try:
+            values = validate(record)
+        except ValueError as e:
+            summary["rejected"] += 1
+            if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                summary["errors"].append({"row": row, "error": str(e)})
+            continue
+        batch.append((values, content_hash(values)))
+        if len(batch) >= batch_size:
+            _insert_batch(conn, user_id, batch, dedupe, available, last_id, summary)
+            batch = []
+    if batch:
+        _insert_batch(conn, user_id, batch, dedupe, available, last_id, summary)
+    return summary
@@ -0,0 +1,455 @@
+import datetime
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from backend import db
+from backend import balances
+from backend import rollups
+from backend import portfolio
+from backend import recurring
+import backend.export as export
+import backend.importer as importer
+import backend.logic as logic
+
+# Background jobs.
+#
+# Long-running work (imports, exports, fixed item generation, rebuilds) is recorded
+# in the jobs table and executed by a small pool of worker threads, so the request
+# that submits it returns at once. Clients poll /api/jobs/<id>, may cancel a job,
+# and download the artifact it leaves in its directory under the jobs folder.
+#
+# Progress is kept in memory while a job runs: an import holds the write lock for
+# its whole transaction, so the job cannot also write progress rows. The table is
+# written on every state change. Queued jobs survive a restart; jobs that were
+# running when the process stopped are marked failed.
+
+JOB_WORKERS = int(os.environ.get('PARFIN_JOB_WORKERS', 2))
+# Finished jobs and their files are deleted after this many days
+JOB_RETENTION_DAYS = float(os.environ.get('PARFIN_JOB_RETENTION_DAYS', 7))
+# Defaults to a 'jobs' folder next to the database
+JOBS_DIR = os.environ.get('PARFIN_JOBS_DIR')
+
+# Optional thread generating every user's fixed items when a month starts
+FIXED_ITEMS_SCHEDULER = os.environ.get('PARFIN_FIXED_ITEMS_SCHEDULER', '').lower() in ('1', 'true', 'yes')
+# Day of the month scheduled fixed items are dated on (the last day in shorter months)
+FIXED_ITEMS_DAY = int(os.environ.get('PARFIN_FIXED_ITEMS_DAY', 1))
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+# Cancellation is checked (and progress sampled) every this many rows
+CHECK_EVERY = 1000
+
+class JobError(ValueError):
+    # Bad job request; the handler answers 400
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """What a job function sees: its parameters, progress reporting and cancellation."""
+
+    def __init__(self, row, directory, cancel_event):
+        self.id = row['id']
+        self.user_id = row['user_id']
+        self.kind = row['kind']
+        self.params = json.loads(row['params'])
+        self.directory = directory
+        self.done = 0
+        self.total = None
+        self.artifact = None # (file name, content type)
+        self._cancel_event = cancel_event
+
+    def progress(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def check(self):
+        # Raises JobCancelled once a cancel was requested
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+def run_export(job):
+    # params: format, compress, plus the /api/export filters
+    query_params = {key: [str(value)] for key, value in job.params.items()}
+    export_format = job.params.get('format', 'json')
+    content_type, extension = export.FORMATS[export_format]
+    name = f"transactions_{job.params.get('month') or 'all'}.{extension}"
+    opener = open
+    if job.params.get('compress') == 'gzip':
+        content_type = 'application/gzip'
+        name += '.gz'
+        opener = gzip.open
+
+    def counted(batches):
+        for batch in batches:
+            job.check()
+            yield batch
+            job.progress(job.done + len(batch))
+
+    with db.connection() as conn:
+        sql, args = export.build_query(query_params, job.user_id)
+        job.progress(0, conn.execute(f'SELECT COUNT(*) FROM ({sql})', args).fetchone()[0])
+        batches = counted(export.iter_batches(conn, query_params, job.user_id))
+        with opener(job.path(name), 'wt', encoding='utf-8', newline='') as f:
+            for text in export.ENCODERS[export_format](batches):
+                f.write(text)
+    job.artifact = (name, content_type)
+    return {"rows": job.done}
+
+def run_import(job):
+    # params: format, dedupe; the uploaded file is the job's 'upload'.
+    # Progress is counted in bytes of the upload.
+    path = job.path('upload')
+    size = os.path.getsize(path)
+    job.progress(0, size)
+
+    with open(path, 'rb') as raw, db.connection() as conn:
+        stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+        def tracked(records):
+            for n, record in enumerate(records, 1):
+                if n % CHECK_EVERY == 0:
+                    job.check()
+                    job.progress(raw.tell())
+                yield record
+
+        records = tracked(importer.PARSERS[job.params['format']](stream))
+        # A cancel raises out of the transaction, so nothing is imported
+        summary = importer.import_records(conn, job.user_id, records, dedupe=job.params.get('dedupe', True))
+    job.progress(size)
+    os.remove(path)
+    return summary
+
+def run_generate_fixed(job):
+    # params: date, or start_month[, end_month, day]
+    with db.connection() as conn:
+        count = logic.generate_fixed_transactions(conn, job.user_id, recurring.parse_request(job.params))
+    return {"count": count}
+
+def run_rebuild(job):
+    # Regenerates the user's derived tables from the transaction history
+    job.progress(0, 3)
+    with db.connection() as conn:
+        result = {"hashes": importer.backfill_hashes(conn, job.user_id)}
+        job.progress(1)
+        job.check()
+        result["balances"] = balances.rebuild(conn, job.user_id)
+        job.progress(2)
+        job.check()
+        result["rollups"] = rollups.rebuild(conn, job.user_id)
+        # Portfolio checkpoints are rebuilt from the history on the next read
+        portfolio.reset(conn, job.user_id)
+        job.progress(3)
+    # The ledger is unchanged, so data versions do not move, but results computed
+    # from drifted balances or rollups must not be served again
+    logic.RESULT_CACHE.clear()
+    return result
+
+# kind: (function, progress unit)
+KINDS = {
+    'export': (run_export, 'rows'),
+    'import': (run_import, 'bytes'),
+    'generate_fixed': (run_generate_fixed, 'steps'),
+    'rebuild': (run_rebuild, 'steps'),
+}
+
+def validate(kind, params):
+    if kind not in KINDS:
+        raise JobError(f"Unknown job kind: {kind}")
+    if not isinstance(params, dict):
+        raise JobError("params must be an object")
+    if kind == 'export' and params.get('format', 'json') not in export.FORMATS:
+        raise JobError(f"Unsupported format: {params.get('format')}")
+    if kind == 'import' and params.get('format') not in importer.PARSERS:
+        raise JobError(f"Unsupported import format: {params.get('format')}")
+    if kind == 'generate_fixed':
+        try:
+            recurring.parse_request(params)
+        except recurring.RecurringError as e:
+            raise JobError(str(e))
+
+def to_dict(row, live=None):
+    # API representation; live is the running Job, whose progress is newer than the row
+    done, total = (live.done, live.total) if live else (row['progress_done'], row['progress_total'])
+    artifact = None
+    if row['artifact']:
+        artifact = {"name": row['artifact'], "type": row['artifact_type'],
+                    "url": f"/api/jobs/{row['id']}/artifact"}
+    return {
+        "id": row['id'],
+        "kind": row['kind'],
+        "status": row['status'],
+        "progress": {"done": done, "total": total, "unit": KINDS.get(row['kind'], (None, None))[1]},
+        "result": json.loads(row['result']) if row['result'] else None,
+        "error": row['error'],
+        "artifact": artifact,
+        "created_at": row['created_at'],
+        "started_at": row['started_at'],
+        "finished_at": row['finished_at'],
+    }
+
+class JobManager:
+    """Worker threads draining a queue of job ids."""
+
+    def __init__(self, db_path, directory, workers=JOB_WORKERS):
+        self.db_path = db_path
+        self.directory = directory
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._cancel_events = {} # job id -> Event, for jobs a worker has picked up
+        self._running = {} # job id -> Job
+        self._threads = []
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with db.connection() as conn:
+            # A job cut short by a restart cannot resume halfway; queued ones can still run
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart',
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE status = 'running'
+            ''')
+            queued = [r[0] for r in conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id")]
+        self.purge()
+        for job_id in queued:
+            self._queue.put(job_id)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"parfin-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=None):
+        # Running jobs are asked to cancel; queued ones stay queued for the next start
+        with self._lock:
+            for event in self._cancel_events.values():
+                event.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, str(job_id))
+
+    def save_upload(self, fileobj):
+        # Spools an upload to a temporary file in the jobs folder; pass it to submit()
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, 64 * 1024)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    def submit(self, kind, user_id, params=None, upload=None):
+        params = params or {}
+        validate(kind, params)
+        with db.connection() as conn:
+            job_id = conn.execute('INSERT INTO jobs (user_id, kind, params) VALUES (?, ?, ?)',
+                                  (user_id, kind, json.dumps(params))).lastrowid
+            os.makedirs(self.job_dir(job_id), exist_ok=True)
+            if upload:
+                os.replace(upload, os.path.join(self.job_dir(job_id), 'upload'))
+        self._queue.put(job_id)
+        return self.get(job_id, user_id)
+
+    def get(self, job_id, user_id):
+        row = db.query_db('SELECT * FROM jobs WHERE id = ? AND user_id = ?', (job_id, user_id), one=True)
+        if row is None:
+            return None
+        with self._lock:
+            live = self._running.get(job_id)
+        return to_dict(row, live)
+
+    def list(self, user_id, limit=50):
+        rows = db.query_db('SELECT * FROM jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?', (user_id, limit))
+        with self._lock:
+            running = dict(self._running)
+        return [to_dict(row, running.get(row['id'])) for row in rows]
+
+    def cancel(self, job_id, user_id):
+        # Returns the job, or None when it does not exist
+        job = self.get(job_id, user_id)
+        if job is None or job['status'] in FINISHED:
+            return job
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+            if event:
+                event.set()
+        with db.connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            ''', (job_id,))
+        return self.get(job_id, user_id)
+
+    def artifact(self, job_id, user_id):
+        # (path, name, content type) of a finished job's download, or None
+        row = db.query_db("SELECT artifact, artifact_type FROM jobs WHERE id = ? AND user_id = ? AND status = 'succeeded'",
+                          (job_id, user_id), one=True)
+        if row is None or not row['artifact']:
+            return None
+        path = os.path.join(self.job_dir(job_id), row['artifact'])
+        if not os.path.exists(path):
+            return None
+        return path, row['artifact'], row['artifact_type']
+
+    def purge(self, days=JOB_RETENTION_DAYS):
+        with db.connection() as conn:
+            ids = [r[0] for r in conn.execute(f'''
+                SELECT id FROM jobs WHERE status IN ({', '.join('?' for _ in FINISHED)})
+                AND finished_at < datetime('now', ?)
+            ''', FINISHED + (f'-{days} days',))]
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(i,) for i in ids])
+        for job_id in ids:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return len(ids)
+
+    def _worker_loop(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            try:
+                self._run(job_id)
+            except Exception as e:
+                print(f"Job {job_id} error: {e}")
+
+    def _run(self, job_id):
+        # The cancel event exists before the job is marked running, so a cancel
+        # arriving in between is never lost
+        event = threading.Event()
+        with self._lock:
+            self._cancel_events[job_id] = event
+        try:
+            with db.connection() as conn:
+                started = conn.execute('''
+                    UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = 'queued'
+                ''', (job_id,)).rowcount
+                row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            if not started or event.is_set():
+                # Cancelled while queued
+                self._finish(job_id, None, 'cancelled')
+                return
+
+            job = Job(row, self.job_dir(job_id), event)
+            with self._lock:
+                self._running[job_id] = job
+            result, error = None, None
+            try:
+                result = KINDS[job.kind][0](job)
+                status = 'succeeded'
+            except JobCancelled:
+                status = 'cancelled'
+            except Exception as e:
+                print(f"Job {job_id} ({job.kind}) failed: {e}")
+                status, error = 'failed', str(e)
+            self._finish(job_id, job, status, result, error)
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._running.pop(job_id, None)
+
+    def _finish(self, job_id, job, status, result=None, error=None):
+        if status != 'succeeded':
+            # Partial output is of no use
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        name, content_type = (job.artifact if job and job.artifact else (None, None))
+        with db.connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = ?, result = ?, error = ?, artifact = ?, artifact_type = ?,
+                    progress_done = ?, progress_total = ?, finished_at = COALESCE(finished_at, CURRENT_TIMESTAMP)
+                WHERE id = ?
+            ''', (status, json.dumps(result) if result is not None else None, error, name, content_type,
+                  job.done if job else 0, job.total if job else None, job_id))
+
+class FixedItemScheduler:
+    """A thread generating every user's fixed items for the current month, on start and at each rollover."""
+
+    # Longest sleep, so a failed run is retried and a changed clock is noticed
+    POLL_SECONDS = 3600
+
+    def __init__(self, day=FIXED_ITEMS_DAY, today=datetime.date.today):
+        self.day = day
+        self._today = today
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_month = None # last month generated
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="parfin-fixed-items", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        # Generates the current month unless already done; idempotent either way.
+        # Returns the number of transactions created.
+        month = self._today().isoformat()[:7]
+        if month == self.last_month:
+            return 0
+        with db.connection() as conn:
+            count = recurring.materialize(conn, recurring.month_dates(month, day=self.day))
+        self.last_month = month
+        print(f"Fixed items for {month}: {count} transactions created")
+        return count
+
+    def _seconds_to_rollover(self):
+        now = datetime.datetime.now()
+        first = (now.date().replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        remaining = (datetime.datetime.combine(first, datetime.time()) - now).total_seconds()
+        return max(1.0, min(remaining, self.POLL_SECONDS))
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                # e.g. the database is busy; last_month is unchanged, so the next wake retries
+                print(f"Fixed item scheduler: {e}")
+            if self._stop.wait(self._seconds_to_rollover()):
+                return
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    # Started on first use; like the connection pool, follows db.DB_PATH
+    global _manager
+    if _manager is None or _manager.db_path != db.DB_PATH:
+        with _manager_lock:
+            if _manager is None or _manager.db_path != db.DB_PATH:
+                if _manager is not None:
+                    _manager.stop(timeout=5)
+                directory = JOBS_DIR or os.path.join(os.path.dirname(db.DB_PATH) or '.', 'jobs')
+                manager = JobManager(db.DB_PATH, directory)
+                manager.start()
+                _manager = manager
+    return _manager
+
+def shutdown(timeout=5):
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.stop(timeout)
+            _manager = None
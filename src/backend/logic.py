@@ -1,12 +1,48 @@
 import datetime
-from backend.db import query_db
+from backend.db import query_db, connection, get_pool
+from backend.balances import get_balances, FUNDS
+from backend import rollups
+from backend import rates
+from backend import portfolio
+from backend import prices
+from backend import history
+from backend import recurring
+from backend import versions
+from backend.result_cache import ResultCache
 
-def get_exchange_rate():
-    # Fetch rate from DB, default to 25000 if not found
-    row = query_db("SELECT value FROM settings WHERE key = ?", ('exchange_rate_usd_vnd',), one=True)
-    if row:
-        return float(row['value'])
-    return 25000.0
+# Stats and portfolios are cached by everything they are computed from: the user,
+# the arguments, the date and the data versions of the tables below (see
+# backend.result_cache). Cached results are shared and must not be mutated.
+RESULT_CACHE = ResultCache()
+STATS_TABLES = ('transactions', 'investment_transactions', 'exchange_rates')
+PORTFOLIO_TABLES = ('investment_transactions', 'exchange_rates', 'prices')
+HISTORY_TABLES = ('transactions', 'investment_transactions', 'exchange_rates', 'prices')
+
+def _cache_key(conn, kind, user_id, tables, *args):
+    # Versions are read before the data, so a cached result is never older than its key.
+    # The database path keeps results apart when DB_PATH is repointed (e.g. by tests).
+    data_versions = versions.get_versions(conn, user_id, tables)
+    return (kind, get_pool().path, user_id) + args + (tuple(sorted(data_versions.items())),)
+
+_rate_matrix = (None, None) # (database path, exchange_rates version), RateMatrix
+
+def get_rate_matrix(conn):
+    # The cached RateMatrix, reloaded only after exchange_rates has changed
+    global _rate_matrix
+    version = versions.get_versions(conn, versions.GLOBAL_USER, ('exchange_rates',))['exchange_rates']
+    key = (get_pool().path, version)
+    cached_key, matrix = _rate_matrix
+    if cached_key != key:
+        matrix = rates.RateMatrix.load(conn)
+        _rate_matrix = (key, matrix)
+    return matrix
+
+def get_exchange_rate(conn=None):
+    # Today's USD -> VND rate
+    if conn is None:
+        with connection() as conn:
+            return get_exchange_rate(conn)
+    return get_rate_matrix(conn).factor('USD', 'VND', datetime.date.today().isoformat())
 
 def convert_amount(amount, from_currency, target_currency, rate):
     if from_currency == target_currency:
@@ -51,103 +87,30 @@ def calculate_date_range(period, custom_start=None, custom_end=None):
     return start_date, end_date
 
 def calculate_stats(user_id, start_date, end_date, target_currency='VND'):
-    rate = get_exchange_rate()
-    
-    # 1. Fetch EVERYTHING for GLOBAL Balances
-    all_transactions = query_db("SELECT * FROM transactions WHERE user_id = ?", (user_id,))
-    # Investment transactions also affect Investment Balance (Cash/Bank)
-    inv_transactions = query_db("SELECT * FROM investment_transactions WHERE user_id = ?", (user_id,))
-    
+    # All queries for one stats request share a single pooled connection
+    with connection() as conn:
+        # Balances are valued at the rates in effect today
+        today = datetime.date.today().isoformat()
+        key = _cache_key(conn, 'stats', user_id, STATS_TABLES, start_date, end_date, target_currency, today)
+        return RESULT_CACHE.get_or_compute(
+            key, lambda: _calculate_stats(conn, user_id, start_date, end_date, target_currency, today))
+
+def _calculate_stats(conn, user_id, start_date, end_date, target_currency, today):
+    matrix = get_rate_matrix(conn)
+
     # Initialize Balances
-    total = {'cash': 0.0, 'bank': 0.0}
-    saving = {'cash': 0.0, 'bank': 0.0}
-    support = {'cash': 0.0, 'bank': 0.0}
-    investment = {'cash': 0.0, 'bank': 0.0}
-    together = {'cash': 0.0, 'bank': 0.0}
-    
-    # Helper to map source string to key
-    def get_source(s):
-        return 'bank' if s == 'bank' else 'cash'
-    
-    fund_categories = ['Saving', 'Support', 'Investment', 'Together']
+    balances = {fund: {'cash': 0.0, 'bank': 0.0} for fund in FUNDS}
 
-    # --- Calculate Global Balances ---
-    for t in all_transactions:
-        amount = convert_amount(t['amount'], t['currency'], target_currency, rate)
-        source = get_source(t['source'])
-        cat = t['category']
-        typ = t['type']
-        fund = t['fund']
-        
-        if typ == 'income':
-            if cat in fund_categories:
-                if cat == 'Saving': saving[source] += amount
-                elif cat == 'Support': support[source] += amount
-                elif cat == 'Investment': investment[source] += amount
-                elif cat == 'Together': together[source] += amount
-            else:
-                total[source] += amount
-                
-        elif typ == 'expense':
-            if fund:
-                fund_source = source # Funds have their own source tracking?
-                # Based on JS: if t.fund, we subtract from that fund's balance
-                if fund == 'Saving': saving[fund_source] -= amount
-                elif fund == 'Support': support[fund_source] -= amount
-                elif fund == 'Investment': investment[fund_source] -= amount
-                elif fund == 'Together': together[fund_source] -= amount
-            else:
-                total[source] -= amount
-                # Legacy allocation via expense logic from JS
-                if cat == 'Saving': saving[source] += amount
-                elif cat == 'Support': support[source] += amount
-                elif cat == 'Investment': investment[source] += amount
-                elif cat == 'Together': together[source] += amount
-                
-        elif typ == 'allocation':
-            # Allocation subtracts from source
-            if cat in fund_categories:
-                 if cat == 'Saving': saving[source] -= amount
-                 elif cat == 'Support': support[source] -= amount
-                 elif cat == 'Investment': investment[source] -= amount
-                 elif cat == 'Together': together[source] -= amount
-            else:
-                 total[source] -= amount
-            
-            # And adds to destination
-            dest_source = get_source(t['destination'])
-            dest_cat = t['destination_category']
-            
-            if dest_cat == 'Saving': saving[dest_source] += amount
-            elif dest_cat == 'Support': support[dest_source] += amount
-            elif dest_cat == 'Investment': investment[dest_source] += amount
-            elif dest_cat == 'Together': together[dest_source] += amount
-            else:
-                total[dest_source] += amount
+    # Global balances are kept per native currency in fund_balances (see backend.balances),
+    # so this is a handful of rows no matter how long the history is.
+    for fund, source, currency, amount in get_balances(conn, user_id):
+        balances[fund][source] += amount * matrix.factor(currency, target_currency, today)
 
-    # Investment Ledger Impact
-    for inv in inv_transactions:
-        # Assuming investment activity (buy/sell) happens via Bank usually, or we need source column in Inv table
-        # JS impl assumed 'bank' impact for investment transactions logic implicitly in 'calculate_stats' earlier?
-        # Actually in JS 'logic.py' previously: investment['bank'] += impact. 
-        # So we keep that assumption that investment operations hit the Investment Fund Bank Balance.
-        
-        i_price = convert_amount(inv['price'], 'VND', target_currency, rate)
-        i_fee = convert_amount(inv['fee'], 'VND', target_currency, rate)
-        i_tax = convert_amount(inv['tax'], 'VND', target_currency, rate)
-        qty = inv['quantity']
-        
-        impact = 0.0
-        if inv['type'] == 'buy':
-            impact = -1 * ((qty * i_price) + i_fee)
-        elif inv['type'] == 'sell':
-            impact = (qty * i_price) - i_fee - i_tax
-        elif inv['type'] == 'dividend':
-            # Dividend: Price treated as Total Amount usually in simple UI, or Price * Qty.
-            # Let's stick to (Price * Qty) - Tax for consistency.
-            impact = (qty * i_price) - i_tax
-            
-        investment['bank'] += impact
+    total = balances['total']
+    saving = balances['saving']
+    support = balances['support']
+    investment = balances['investment']
+    together = balances['together']
 
     # --- Period Stats (Income/Expense for selected period) ---
     monthly_income = 0.0
@@ -155,41 +118,36 @@ def calculate_stats(user_id, start_date, end_date, target_currency='VND'):
     monthly_expense = 0.0
     monthly_expense_stats = {'cash': 0.0, 'bank': 0.0}
     
-    # Fetch Filtered Transactions
-    sql = "SELECT * FROM transactions WHERE 1=1"
-    args = []
-    if start_date:
-        sql += " AND date >= ?"
-        args.append(start_date)
-    if end_date:
-        sql += " AND date <= ?"
-        args.append(end_date)
-    
-    filtered_transactions = query_db(sql, args)
-    
     # Chart Data Setup
     chart_data = {} # category -> {cash: 0, bank: 0}
 
     allocation_categories = ['Saving', 'Support', 'Investment', 'Together']
 
-    for t in filtered_transactions:
-        amount = convert_amount(t['amount'], t['currency'], target_currency, rate)
-        source = get_source(t['source'])
+    # One row per (type, category, source, currency) comes back: whole months are read from
+    # monthly_rollups and only the partial months at either edge from raw transactions
+    # (see backend.rollups). Currency conversion is applied to these grouped sums at the
+    # rate in effect on each group's date: currencies whose rate changes within the period
+    # come back one group per month, or per day in months where it changes mid-month;
+    # the rest need a single factor for the whole period.
+    # Chart categories keep the order of their first expense in the period.
+    dated = {c: matrix.split_months(c, target_currency, start_date, end_date) for c in sorted(matrix.currencies())
+             if c != target_currency and matrix.changes_within(c, target_currency, start_date, end_date)}
+    for t in rollups.period_totals(conn, user_id, start_date, end_date, dated=dated):
+        amount = t['amount'] * matrix.factor(t['currency'], target_currency, t['first_date'])
+        source = t['source']
         cat = t['category']
-        typ = t['type']
         
-        if typ == 'income':
+        if t['type'] == 'income':
             monthly_income += amount
             monthly_income_stats[source] += amount
-        elif typ == 'expense':
-            if cat not in allocation_categories:
-                monthly_expense += amount
-                monthly_expense_stats[source] += amount
-                
-                # Chart Data (Expenses only, excl allocations)
-                if cat not in chart_data:
-                    chart_data[cat] = {'cash': 0.0, 'bank': 0.0}
-                chart_data[cat][source] += amount
+        elif cat not in allocation_categories:
+            monthly_expense += amount
+            monthly_expense_stats[source] += amount
+            
+            # Chart Data (Expenses only, excl allocations)
+            if cat not in chart_data:
+                chart_data[cat] = {'cash': 0.0, 'bank': 0.0}
+            chart_data[cat][source] += amount
 
     # Format Chart Data for Frontend
     chart_cats = list(chart_data.keys())
@@ -234,68 +192,54 @@ def calculate_stats(user_id, start_date, end_date, target_currency='VND'):
     }
 
 def calculate_portfolio(user_id, target_currency='VND'):
-    rate = get_exchange_rate()
-    rows = query_db('SELECT * FROM investment_transactions WHERE user_id = ? ORDER BY date ASC', (user_id,))
-    
-    holdings = {} # symbol -> { quantity, total_cost, asset_type }
-    net_cash_flow = 0.0
-    
-    for row in rows:
-        price = convert_amount(row['price'], 'VND', target_currency, rate)
-        fee = convert_amount(row['fee'], 'VND', target_currency, rate)
-        tax = convert_amount(row['tax'], 'VND', target_currency, rate)
-        qty = row['quantity']
-        typ = row['type']
-        symbol = row['symbol']
-        # sqlite3.Row might not have .get(), use standard access or check keys
-        asset_type = row['asset_type'] if 'asset_type' in row.keys() else 'stock'
-        
-        if symbol not in holdings:
-            holdings[symbol] = {'quantity': 0.0, 'total_cost': 0.0, 'asset_type': asset_type}
-            
-        if typ == 'buy':
-            cost = (qty * price) + fee
-            holdings[symbol]['quantity'] += qty
-            holdings[symbol]['total_cost'] += cost
-            net_cash_flow -= cost
-        elif typ == 'sell':
-            # Average Cost logic
-            current_qty = holdings[symbol]['quantity']
-            current_cost = holdings[symbol]['total_cost']
-            avg_cost = (current_cost / current_qty) if current_qty > 0 else 0
-            
-            holdings[symbol]['quantity'] -= qty
-            holdings[symbol]['total_cost'] -= (avg_cost * qty)
-            
-            revenue = (qty * price) - fee - tax
-            net_cash_flow += revenue
-        elif typ == 'dividend':
-            income = (qty * price) - tax
-            net_cash_flow += income
-            
-    # Calculate Summary
+    with connection() as conn:
+        # Holdings are valued at the latest close as of today
+        today = datetime.date.today().isoformat()
+        key = _cache_key(conn, 'portfolio', user_id, PORTFOLIO_TABLES, target_currency, today)
+        return RESULT_CACHE.get_or_compute(
+            key, lambda: _calculate_portfolio(conn, user_id, target_currency, today))
+
+def _calculate_portfolio(conn, user_id, target_currency, today):
+    # Positions come from persisted checkpoints, so only trades written since the
+    # last call are replayed (see backend.portfolio)
+    matrix = get_rate_matrix(conn)
+    rates_version = versions.get_versions(conn, versions.GLOBAL_USER, ('exchange_rates',))['exchange_rates']
+    portfolio.sync(conn, user_id, target_currency, matrix, rates_version)
+
     active_holdings = []
     total_invested = 0.0
     total_current_value = 0.0
-    
-    for symbol, data in holdings.items():
-        if data['quantity'] > 0.0001:
-            avg_price = data['total_cost'] / data['quantity']
-            # MOCK: Market Price = Avg Price (since we don't have live API)
-            market_price = avg_price 
-            current_value = market_price * data['quantity']
+    net_cash_flow = 0.0
+    realized_pl = 0.0
+
+    held = portfolio.positions(conn, user_id, target_currency)
+    closes = prices.latest(conn, [p['symbol'] for p in held if p['quantity'] > portfolio.MIN_QUANTITY], today)
+    price_factor = matrix.factor(portfolio.NATIVE_CURRENCY, target_currency)
+
+    for position in held:
+        net_cash_flow += position['cash_flow']
+        realized_pl += position['realized_pl']
+        quantity = position['quantity']
+        if quantity > portfolio.MIN_QUANTITY:
+            avg_price = position['total_cost'] / quantity
+            # Without any close yet, the holding is valued at cost
+            price_date, close = closes.get(position['symbol'], (None, None))
+            market_price = close * price_factor if close is not None else avg_price
+            current_value = market_price * quantity
             
-            total_invested += data['total_cost']
+            total_invested += position['total_cost']
             total_current_value += current_value
             
             active_holdings.append({
-                "symbol": symbol,
-                "asset_type": data['asset_type'],
-                "quantity": round(data['quantity'], 4),
+                "symbol": position['symbol'],
+                "asset_type": position['asset_type'],
+                "quantity": round(quantity, 4),
                 "avg_price": avg_price,
                 "market_price": market_price,
+                "price_date": price_date,
                 "total_value": current_value,
-                "pl_percent": 0.0 # Mock
+                "pl_percent": ((current_value - position['total_cost']) / position['total_cost'] * 100
+                               if position['total_cost'] > 0 else 0.0)
             })
             
     total_pl = total_current_value - total_invested
@@ -307,6 +251,25 @@ def calculate_portfolio(user_id, target_currency='VND'):
             "total_invested": total_invested,
             "total_current_value": total_current_value,
             "total_pl_percent": total_pl_percent,
-            "net_cash_flow": net_cash_flow
+            "net_cash_flow": net_cash_flow,
+            "realized_pl": realized_pl
         }
     }
+
+def calculate_history(user_id, start_date, end_date, interval='month', target_currency='VND'):
+    # Net-worth time series over [start_date, end_date]; see backend.history
+    with connection() as conn:
+        key = _cache_key(conn, 'history', user_id, HISTORY_TABLES, start_date, end_date, interval, target_currency)
+        return RESULT_CACHE.get_or_compute(
+            key, lambda: _calculate_history(conn, user_id, start_date, end_date, interval, target_currency))
+
+def _calculate_history(conn, user_id, start_date, end_date, interval, target_currency):
+    matrix = get_rate_matrix(conn)
+    rates_version = versions.get_versions(conn, versions.GLOBAL_USER, ('exchange_rates',))['exchange_rates']
+    portfolio.sync(conn, user_id, target_currency, matrix, rates_version)
+    return history.net_worth(conn, user_id, start_date, end_date, interval, target_currency, matrix)
+
+def generate_fixed_transactions(conn, user_id, periods):
+    # Creates the user's fixed items for each (period, date) of recurring.parse_request
+    # that has not been generated yet. Returns the number of transactions created.
+    return recurring.materialize(conn, periods, user_id)
@@ -0,0 +1,110 @@
+import bisect
+import threading
+
+# Per-route request metrics, served by /api/metrics in the Prometheus text format.
+#
+# Requests are recorded under their route's pattern ('/api/jobs/<int:job_id>'),
+# never the raw path, so the number of series is bounded by the route table;
+# requests no route matched share the '<unmatched>' route. /api/batch sub-requests
+# count as requests to their own routes as well as to /api/batch.
+#
+# Recorded per method and route:
+#   parfin_http_requests_total            counter, by status code
+#   parfin_http_request_duration_seconds  histogram of the time to answer,
+#                                         streamed bodies included
+#   parfin_http_requests_in_flight        gauge of requests being answered
+#   parfin_http_response_bytes_total      counter of body bytes sent, after gzip
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Series:
+    """Counters of one method and route."""
+    __slots__ = ('labels', 'statuses', 'buckets', 'seconds', 'count', 'in_flight', 'bytes_sent')
+
+    def __init__(self, method, route):
+        self.labels = f'method="{_escape(method)}",route="{_escape(route)}"'
+        self.reset()
+
+    def reset(self):
+        self.statuses = {}
+        # Per bucket, not cumulative; the last one is +Inf
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.seconds = 0.0
+        self.count = 0
+        self.in_flight = 0
+        self.bytes_sent = 0
+
+class RequestMetrics:
+    """Request counts, latencies, in-flight requests and bytes sent, per route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def series(self, method, route):
+        # The Series of a method and route, created on first use
+        key = (method, route)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = Series(method, route)
+            return series
+
+    def start(self, series):
+        with self._lock:
+            series.in_flight += 1
+
+    def finish(self, series, status, seconds, bytes_sent):
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series.in_flight -= 1
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.buckets[bucket] += 1
+            series.seconds += seconds
+            series.count += 1
+            series.bytes_sent += bytes_sent
+
+    def reset(self):
+        # Zeroes every counter; requests in flight stay counted
+        with self._lock:
+            for series in self._series.values():
+                in_flight = series.in_flight
+                series.reset()
+                series.in_flight = in_flight
+
+    def render(self):
+        with self._lock:
+            series = sorted(self._series.items())
+            requests, durations, in_flight, sent = [], [], [], []
+            for _, s in series:
+                for status, count in sorted(s.statuses.items()):
+                    requests.append(f'parfin_http_requests_total{{{s.labels},status="{status}"}} {count}')
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), s.buckets):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else format(bound, 'g')
+                    durations.append(f'parfin_http_request_duration_seconds_bucket{{{s.labels},le="{le}"}} {cumulative}')
+                durations.append(f'parfin_http_request_duration_seconds_sum{{{s.labels}}} {s.seconds!r}')
+                durations.append(f'parfin_http_request_duration_seconds_count{{{s.labels}}} {s.count}')
+                in_flight.append(f'parfin_http_requests_in_flight{{{s.labels}}} {s.in_flight}')
+                sent.append(f'parfin_http_response_bytes_total{{{s.labels}}} {s.bytes_sent}')
+
+        lines = []
+        for name, kind, help_text, samples in (
+            ('parfin_http_requests_total', 'counter', 'API requests answered, by route and status.', requests),
+            ('parfin_http_request_duration_seconds', 'histogram', 'Time to answer an API request.', durations),
+            ('parfin_http_requests_in_flight', 'gauge', 'API requests being answered.', in_flight),
+            ('parfin_http_response_bytes_total', 'counter', 'Response body bytes sent, after compression.', sent),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+METRICS = RequestMetrics()
@@ -0,0 +1,279 @@
+import hashlib
+from backend import balances
+from backend import rollups
+from backend import importer
+from backend import versions
+from backend import rates
+from backend import portfolio
+from backend import prices
+from backend import recurring
+from backend import search
+
+# Versioned schema migrations.
+#
+# PRAGMA user_version stores the number of the last migration applied. Each step
+# runs exactly once, inside its own transaction, together with the version bump,
+# so a failed step leaves the database on the previous version. When the database
+# is already current, migrate() costs a single pragma read.
+#
+# To change the schema, append a new step to MIGRATIONS; never edit a step that
+# has already shipped.
+
+def _add_column(c, table, column, ddl):
+    # table_xinfo also lists generated columns, which table_info hides
+    columns = [row[1] for row in c.execute(f'PRAGMA table_xinfo({table})')]
+    if column not in columns:
+        print(f"Migrating database: Adding {column} column to {table} table...")
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {ddl}')
+
+def _baseline(c):
+    # Schema as it was before versioning. Databases created by older releases may
+    # be missing some of these columns, so they are added only when absent.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            currency TEXT DEFAULT 'VND',
+            type TEXT NOT NULL, -- 'income', 'expense' or 'allocation'
+            category TEXT NOT NULL,
+            description TEXT,
+            source TEXT DEFAULT 'cash', -- 'cash' or 'bank'
+            destination TEXT DEFAULT NULL, -- 'cash' or 'bank' (for transfers)
+            destination_category TEXT DEFAULT NULL, -- 'Saving', etc.
+            fund TEXT, -- 'Saving', 'Support', 'Investment', 'Together'
+            date TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    _add_column(c, 'transactions', 'source', "source TEXT DEFAULT 'cash'")
+    _add_column(c, 'transactions', 'destination', "destination TEXT DEFAULT NULL")
+    _add_column(c, 'transactions', 'destination_category', "destination_category TEXT DEFAULT NULL")
+    _add_column(c, 'transactions', 'fund', "fund TEXT DEFAULT NULL")
+    _add_column(c, 'transactions', 'currency', "currency TEXT DEFAULT 'VND'")
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fixed_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            type TEXT NOT NULL, -- 'income', 'expense' or 'allocation'
+            category TEXT NOT NULL,
+            description TEXT,
+            source TEXT DEFAULT 'cash', -- 'cash' or 'bank'
+            destination TEXT DEFAULT NULL, -- 'cash' or 'bank' (for transfers)
+            destination_category TEXT DEFAULT NULL, -- 'Saving', etc.
+            fund TEXT, -- 'Saving', 'Support', 'Investment', 'Together'
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    _add_column(c, 'fixed_items', 'fund', "fund TEXT DEFAULT NULL")
+    _add_column(c, 'fixed_items', 'destination', "destination TEXT DEFAULT NULL")
+    _add_column(c, 'fixed_items', 'destination_category', "destination_category TEXT DEFAULT NULL")
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS investment_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            asset_type TEXT DEFAULT 'stock', -- 'stock', 'bond', 'crypto', 'fund'
+            type TEXT NOT NULL, -- 'buy', 'sell', 'dividend'
+            quantity REAL DEFAULT 0,
+            price REAL DEFAULT 0,
+            fee REAL DEFAULT 0,
+            tax REAL DEFAULT 0, -- TNCN for dividends/selling
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    _add_column(c, 'investment_transactions', 'asset_type', "asset_type TEXT DEFAULT 'stock'")
+
+    # Check if admin exists, if not create default admin
+    c.execute('SELECT * FROM users WHERE role = ?', ('admin',))
+    if not c.fetchone():
+        # Default admin: admin / admin123
+        # In a real app, use a proper salt and hashing library like bcrypt.
+        # For "No frameworks" constraint, we'll use sha256.
+        pw_hash = hashlib.sha256('admin123'.encode()).hexdigest()
+        c.execute('INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
+                  ('admin', pw_hash, 'admin'))
+        print("Default admin user created (admin/admin123)")
+
+    # Initialize default exchange rate if not exists
+    c.execute('SELECT value FROM settings WHERE key = ?', ('exchange_rate_usd_vnd',))
+    if not c.fetchone():
+        c.execute("INSERT INTO settings (key, value) VALUES (?, ?)", ('exchange_rate_usd_vnd', '25000'))
+        print("Initialized default exchange rate: 1 USD = 25000 VND")
+
+# Secondary indexes, matched to the WHERE / ORDER BY shapes of the API and logic queries.
+# tests/test_query_plans.py fails if one of those queries falls back to a table scan.
+LEDGER_INDEXES = [
+    # /api/transactions date ranges (default ORDER BY date, id rides the implicit rowid)
+    ('idx_transactions_user_date', 'transactions (user_id, date)'),
+    ('idx_transactions_user_category_date', 'transactions (user_id, category, date)'),
+    ('idx_transactions_user_type_date', 'transactions (user_id, type, date)'),
+    ('idx_transactions_user_amount', 'transactions (user_id, amount)'),
+    # /api/export month / year filters on the generated columns
+    ('idx_transactions_user_year_month', 'transactions (user_id, year_month)'),
+    ('idx_transactions_user_year', 'transactions (user_id, year)'),
+    # Covers the period stats query in logic.calculate_stats
+    ('idx_transactions_user_date_cover', 'transactions (user_id, date, type, category, source, currency, amount)'),
+    ('idx_fixed_items_user', 'fixed_items (user_id)'),
+    ('idx_investment_user_date', 'investment_transactions (user_id, date)'),
+    ('idx_investment_user_symbol_date', 'investment_transactions (user_id, symbol, date)'),
+]
+
+def _ledger_indexes(c):
+    # VIRTUAL generated columns are computed on read, so adding them does not rewrite the table
+    _add_column(c, 'transactions', 'year', "year TEXT GENERATED ALWAYS AS (substr(date, 1, 4)) VIRTUAL")
+    _add_column(c, 'transactions', 'year_month', "year_month TEXT GENERATED ALWAYS AS (substr(date, 1, 7)) VIRTUAL")
+    for name, target in LEDGER_INDEXES:
+        c.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+
+def _fund_balances(c):
+    # Trigger-maintained balance table, seeded from the existing history
+    balances.create_schema(c)
+    balances.rebuild(c.connection)
+
+def _monthly_rollups(c):
+    # Trigger-maintained per-month totals, seeded from the existing history
+    rollups.create_schema(c)
+    rollups.rebuild(c.connection)
+
+def _import_hashes(c):
+    # Content hashes for import duplicate detection, computed for the existing history
+    _add_column(c, 'transactions', 'content_hash', "content_hash TEXT DEFAULT NULL")
+    importer.create_schema(c)
+    importer.backfill_hashes(c.connection)
+
+def _jobs(c):
+    # Background job records; see backend.jobs
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL, -- 'import', 'export', 'generate_fixed', 'rebuild'
+            params TEXT NOT NULL DEFAULT '{}', -- JSON
+            status TEXT NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+            progress_done INTEGER NOT NULL DEFAULT 0,
+            progress_total INTEGER, -- NULL when not known up front
+            result TEXT, -- JSON summary of a finished job
+            error TEXT,
+            artifact TEXT, -- file name inside the job's directory
+            artifact_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+
+def _data_versions(c):
+    # Trigger-maintained change counters behind the API's conditional GETs
+    versions.create_schema(c, ('transactions', 'fixed_items', 'investment_transactions', 'settings'))
+
+def _exchange_rates(c):
+    rates.create_schema(c)
+    # The single settings rate used so far keeps applying to all existing history
+    row = c.execute('SELECT value FROM settings WHERE key = ?', ('exchange_rate_usd_vnd',)).fetchone()
+    c.execute("INSERT OR IGNORE INTO exchange_rates (base, quote, date, rate) VALUES ('USD', 'VND', '1970-01-01', ?)",
+              (float(row[0]) if row else 25000.0,))
+
+def _portfolio_checkpoints(c):
+    # Built from the full history on each user's first portfolio read
+    portfolio.create_schema(c)
+
+def _prices(c):
+    prices.create_schema(c)
+
+def _fixed_item_periods(c):
+    # Idempotent fixed item generation; see backend.recurring
+    _add_column(c, 'transactions', 'fixed_item_id', "fixed_item_id INTEGER DEFAULT NULL")
+    _add_column(c, 'transactions', 'period', "period TEXT DEFAULT NULL")
+    recurring.link_existing(c)
+    recurring.create_schema(c)
+
+def _transaction_search(c):
+    # Indexes the existing history in one pass; triggers keep it in sync afterwards
+    search.create_schema(c)
+    search.rebuild(c)
+
+# (version, description, step). Versions are consecutive and start at 1.
+MIGRATIONS = [
+    (1, 'Baseline schema', _baseline),
+    (2, 'Generated date columns and ledger indexes', _ledger_indexes),
+    (3, 'Persisted fund balances', _fund_balances),
+    (4, 'Monthly rollups', _monthly_rollups),
+    (5, 'Import content hashes', _import_hashes),
+    (6, 'Background jobs', _jobs),
+    (7, 'Data versions', _data_versions),
+    (8, 'Dated exchange rates', _exchange_rates),
+    (9, 'Portfolio checkpoints', _portfolio_checkpoints),
+    (10, 'Market prices', _prices),
+    (11, 'Fixed item periods', _fixed_item_periods),
+    (12, 'Transaction full-text search', _transaction_search),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def pending_migrations(conn):
+    version = get_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+def migrate(conn, target=LATEST_VERSION):
+    # Fast path: an up-to-date database costs one pragma read
+    current = get_version(conn)
+    if current >= target:
+        return current
+
+    # Run DDL under explicit transaction control rather than sqlite3's implicit one
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, description, step in MIGRATIONS:
+            if version > target:
+                break
+            c = conn.cursor()
+            # IMMEDIATE takes the write lock up front, so two processes starting at
+            # once cannot both apply the same step; re-check the version under the lock.
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                if get_version(conn) >= version:
+                    c.execute('COMMIT')
+                    continue
+                print(f"Applying migration {version}: {description}...")
+                step(c)
+                c.execute(f'PRAGMA user_version = {int(version)}')
+                c.execute('COMMIT')
+            except Exception:
+                c.execute('ROLLBACK')
+                raise
+    finally:
+        conn.isolation_level = isolation_level
+    return get_version(conn)
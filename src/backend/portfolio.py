@@ -0,0 +1,207 @@
+# Checkpointed portfolio positions.
+#
+# Average-cost positions depend on the order of every trade before them, so they
+# are rebuilt by replaying trades. portfolio_checkpoints keeps the position of a
+# symbol after each trade, in each reporting currency, and portfolio_positions the
+# latest one. A read then costs one row per symbol.
+#
+# Triggers on investment_transactions record, per (user, symbol), the earliest
+# trade date touched by a write in portfolio_dirty. sync() replays each dirty
+# symbol from its last checkpoint before that date: a new trade replays only
+# itself, a back-dated insert or delete only the trades after it.
+#
+# Trades are recorded in NATIVE_CURRENCY. Checkpoints in other currencies convert
+# each trade at its date's rate, so they are rebuilt when the rates change.
+#
+# Functions here never commit: the caller owns the transaction, which sync()
+# opens with BEGIN IMMEDIATE when none is open.
+
+NATIVE_CURRENCY = 'VND'
+
+# Positions below this quantity are closed
+MIN_QUANTITY = 0.0001
+
+_MARK_DIRTY = """
+    INSERT INTO portfolio_dirty (user_id, symbol, from_date) VALUES ({row}.user_id, {row}.symbol, {row}.date)
+    ON CONFLICT (user_id, symbol) DO UPDATE SET from_date = MIN(from_date, excluded.from_date);
+"""
+
+def create_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_checkpoints (
+            user_id INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            trade_id INTEGER NOT NULL, -- investment_transactions.id
+            asset_type TEXT,
+            quantity REAL NOT NULL,
+            total_cost REAL NOT NULL, -- cost basis of the quantity held
+            realized_pl REAL NOT NULL, -- sale proceeds over cost, plus dividends
+            cash_flow REAL NOT NULL, -- net cash in (+) or out (-) of the symbol so far
+            PRIMARY KEY (user_id, currency, symbol, date, trade_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_positions (
+            user_id INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            asset_type TEXT,
+            quantity REAL NOT NULL,
+            total_cost REAL NOT NULL,
+            realized_pl REAL NOT NULL,
+            cash_flow REAL NOT NULL,
+            opened_date TEXT NOT NULL, -- first trade, for a stable order
+            opened_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, currency, symbol)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_currencies (
+            user_id INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            rates_version INTEGER NOT NULL, -- exchange_rates version the checkpoints were built with
+            PRIMARY KEY (user_id, currency)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_dirty (
+            user_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            from_date TEXT NOT NULL,
+            PRIMARY KEY (user_id, symbol)
+        ) WITHOUT ROWID
+    ''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_investment_portfolio_insert AFTER INSERT ON investment_transactions
+        BEGIN {_MARK_DIRTY.format(row='NEW')} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_investment_portfolio_delete AFTER DELETE ON investment_transactions
+        BEGIN {_MARK_DIRTY.format(row='OLD')} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_investment_portfolio_update AFTER UPDATE ON investment_transactions
+        BEGIN {_MARK_DIRTY.format(row='OLD')} {_MARK_DIRTY.format(row='NEW')} END''')
+
+def apply_trade(position, trade, factor):
+    # Applies one investment_transactions row to a position dict, converting its
+    # prices with factor. The rules are those calculate_portfolio always used.
+    price = trade['price'] * factor
+    fee = trade['fee'] * factor
+    tax = trade['tax'] * factor
+    qty = trade['quantity']
+    if trade['type'] == 'buy':
+        cost = (qty * price) + fee
+        position['quantity'] += qty
+        position['total_cost'] += cost
+        position['cash_flow'] -= cost
+    elif trade['type'] == 'sell':
+        # Average Cost logic
+        current_qty = position['quantity']
+        avg_cost = (position['total_cost'] / current_qty) if current_qty > 0 else 0
+        revenue = (qty * price) - fee - tax
+        position['quantity'] -= qty
+        position['total_cost'] -= avg_cost * qty
+        position['realized_pl'] += revenue - avg_cost * qty
+        position['cash_flow'] += revenue
+    elif trade['type'] == 'dividend':
+        income = (qty * price) - tax
+        position['realized_pl'] += income
+        position['cash_flow'] += income
+
+def _replay(conn, user_id, currency, symbol, from_date, matrix):
+    # Rebuilds the symbol's checkpoints from from_date ('' for all) and its position
+    conn.execute('''DELETE FROM portfolio_checkpoints
+                    WHERE user_id = ? AND currency = ? AND symbol = ? AND date >= ?''',
+                 (user_id, currency, symbol, from_date))
+    last = conn.execute('''
+        SELECT asset_type, quantity, total_cost, realized_pl, cash_flow FROM portfolio_checkpoints
+        WHERE user_id = ? AND currency = ? AND symbol = ? ORDER BY date DESC, trade_id DESC LIMIT 1
+    ''', (user_id, currency, symbol)).fetchone()
+    position = dict(zip(('asset_type', 'quantity', 'total_cost', 'realized_pl', 'cash_flow'), last)) if last else None
+
+    trades = conn.execute('''
+        SELECT id, date, type, quantity, price, fee, tax, asset_type FROM investment_transactions
+        WHERE user_id = ? AND symbol = ? AND date >= ? ORDER BY date, id
+    ''', (user_id, symbol, from_date)).fetchall()
+    checkpoints = []
+    for trade in trades:
+        if position is None:
+            position = {'asset_type': trade['asset_type'], 'quantity': 0.0, 'total_cost': 0.0,
+                        'realized_pl': 0.0, 'cash_flow': 0.0}
+        apply_trade(position, trade, matrix.factor(NATIVE_CURRENCY, currency, trade['date']))
+        checkpoints.append((user_id, currency, symbol, trade['date'], trade['id'], position['asset_type'],
+                            position['quantity'], position['total_cost'], position['realized_pl'], position['cash_flow']))
+    conn.executemany('INSERT INTO portfolio_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', checkpoints)
+
+    conn.execute('DELETE FROM portfolio_positions WHERE user_id = ? AND currency = ? AND symbol = ?',
+                 (user_id, currency, symbol))
+    if position is not None:
+        opened = conn.execute('''
+            SELECT date, trade_id FROM portfolio_checkpoints
+            WHERE user_id = ? AND currency = ? AND symbol = ? ORDER BY date, trade_id LIMIT 1
+        ''', (user_id, currency, symbol)).fetchone()
+        conn.execute('INSERT INTO portfolio_positions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (user_id, currency, symbol, position['asset_type'], position['quantity'], position['total_cost'],
+                      position['realized_pl'], position['cash_flow'], opened[0], opened[1]))
+    return len(checkpoints)
+
+def _build(conn, user_id, currency, matrix, rates_version):
+    # Replays the user's whole history in one currency
+    conn.execute('DELETE FROM portfolio_checkpoints WHERE user_id = ? AND currency = ?', (user_id, currency))
+    conn.execute('DELETE FROM portfolio_positions WHERE user_id = ? AND currency = ?', (user_id, currency))
+    symbols = conn.execute('SELECT DISTINCT symbol FROM investment_transactions WHERE user_id = ?', (user_id,))
+    replayed = sum(_replay(conn, user_id, currency, symbol, '', matrix) for (symbol,) in symbols.fetchall())
+    conn.execute('''
+        INSERT INTO portfolio_currencies (user_id, currency, rates_version) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, currency) DO UPDATE SET rates_version = excluded.rates_version
+    ''', (user_id, currency, rates_version))
+    return replayed
+
+def sync(conn, user_id, currency, matrix, rates_version):
+    # Brings the user's checkpoints up to date for currency. matrix is a
+    # rates.RateMatrix at rates_version. Returns the number of trades replayed.
+    if not _stale(conn, user_id, currency, rates_version):
+        return 0
+    if not conn.in_transaction:
+        # Reads and writes below are one write transaction. Otherwise a sync that
+        # built a currency and a write marking the same from_date again could both
+        # land between reading portfolio_dirty and deleting its rows here, and the
+        # write would never be replayed in that currency. Inside a transaction the
+        # caller already wrote in, the write lock is held.
+        conn.execute('BEGIN IMMEDIATE')
+    replayed = 0
+    dirty = conn.execute('SELECT symbol, from_date FROM portfolio_dirty WHERE user_id = ?', (user_id,)).fetchall()
+    if dirty:
+        built = [row[0] for row in conn.execute(
+            'SELECT currency FROM portfolio_currencies WHERE user_id = ?', (user_id,))]
+        for symbol, from_date in dirty:
+            for built_currency in built:
+                replayed += _replay(conn, user_id, built_currency, symbol, from_date, matrix)
+            # A write since the read above moved from_date back: leave it for the next sync
+            conn.execute('DELETE FROM portfolio_dirty WHERE user_id = ? AND symbol = ? AND from_date = ?',
+                         (user_id, symbol, from_date))
+
+    if _unbuilt(conn, user_id, currency, rates_version):
+        replayed += _build(conn, user_id, currency, matrix, rates_version)
+    return replayed
+
+def _unbuilt(conn, user_id, currency, rates_version):
+    row = conn.execute('SELECT rates_version FROM portfolio_currencies WHERE user_id = ? AND currency = ?',
+                       (user_id, currency)).fetchone()
+    return row is None or (currency != NATIVE_CURRENCY and row[0] != rates_version)
+
+def _stale(conn, user_id, currency, rates_version):
+    # Whether sync() has anything to do; when not, reads skip the write lock
+    return (conn.execute('SELECT 1 FROM portfolio_dirty WHERE user_id = ? LIMIT 1', (user_id,)).fetchone() is not None
+            or _unbuilt(conn, user_id, currency, rates_version))
+
+def positions(conn, user_id, currency):
+    # Every symbol the user has traded, in the order first traded
+    return conn.execute('''
+        SELECT symbol, asset_type, quantity, total_cost, realized_pl, cash_flow FROM portfolio_positions
+        WHERE user_id = ? AND currency = ? ORDER BY opened_date, opened_id
+    ''', (user_id, currency)).fetchall()
+
+def reset(conn, user_id=None):
+    # Drops the checkpoints; the next sync() rebuilds them from the full history
+    where, args = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    for table in ('portfolio_checkpoints', 'portfolio_positions', 'portfolio_currencies', 'portfolio_dirty'):
+        conn.execute(f'DELETE FROM {table} {where}', args)
@@ -0,0 +1,124 @@
+import datetime
+import json
+import math
+from backend import importer
+from backend import versions
+
+# Market prices.
+#
+# prices holds one closing price per symbol and date, in the currency trades are
+# recorded in (portfolio.NATIVE_CURRENCY). It is filled from local files, usually
+# by a cron job running src/scripts/load_prices.py; nothing here goes to the
+# network. A holding is valued at the latest close on or before the valuation
+# date; a symbol without any close yet is valued at cost.
+#
+# The primary key (symbol, date) is the only index: every lookup is a seek to a
+# symbol followed by a short range scan, and all the symbols of a portfolio are
+# passed to one query as a JSON array.
+#
+# Functions here never commit: the caller owns the transaction.
+
+PRICE_BATCH_SIZE = 5000
+
+class PriceError(ValueError):
+    pass
+
+def create_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS prices (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL, -- 'YYYY-MM-DD'
+            close REAL NOT NULL,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID
+    ''')
+    versions.create_triggers(c, 'prices')
+
+def validate(record):
+    # Returns (symbol, date, close) for one record, or raises ValueError
+    if isinstance(record, ValueError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+    symbol = importer._text(record, 'symbol')
+    if not symbol:
+        raise ValueError("symbol is required")
+    try:
+        date = datetime.date.fromisoformat(importer._text(record, 'date', '')).isoformat()
+    except ValueError:
+        raise ValueError("date must be YYYY-MM-DD")
+    try:
+        close = float(importer._text(record, 'close'))
+    except (TypeError, ValueError):
+        raise ValueError("close must be a number")
+    if not math.isfinite(close) or close <= 0:
+        raise ValueError("close must be positive")
+    return symbol, date, close
+
+_UPSERT = '''
+    INSERT INTO prices (symbol, date, close) VALUES (?, ?, ?)
+    ON CONFLICT (symbol, date) DO UPDATE SET close = excluded.close
+'''
+
+def load_records(conn, records, batch_size=PRICE_BATCH_SIZE):
+    # records: (row number, record) pairs from one of importer.PARSERS. A close
+    # already stored for the symbol and date is replaced.
+    # Returns {"loaded", "rejected", "errors": [{"row", "error"}]}
+    summary = {"loaded": 0, "rejected": 0, "errors": []}
+    batch = []
+    for row, record in records:
+        try:
+            batch.append(validate(record))
+        except ValueError as e:
+            summary["rejected"] += 1
+            if len(summary["errors"]) < importer.MAX_REPORTED_ERRORS:
+                summary["errors"].append({"row": row, "error": str(e)})
+            continue
+        if len(batch) >= batch_size:
+            conn.executemany(_UPSERT, batch)
+            summary["loaded"] += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(_UPSERT, batch)
+        summary["loaded"] += len(batch)
+    return summary
+
+def latest(conn, symbols, date):
+    # {symbol: (date, close)}: the latest close on or before date of each symbol
+    # that has one
+    rows = conn.execute('''
+        SELECT p.symbol, p.date, p.close FROM json_each(?) AS s
+        JOIN prices AS p ON p.symbol = s.value AND p.date = (
+            SELECT date FROM prices WHERE symbol = s.value AND date <= ? ORDER BY date DESC LIMIT 1)
+    ''', (json.dumps(sorted(set(symbols))), date))
+    return {symbol: (price_date, close) for symbol, price_date, close in rows}
+
+def _tuples(conn):
+    # A cursor returning plain tuples: the series below can run to hundreds of
+    # thousands of rows, and sqlite3.Row objects cost more than the query
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur
+
+def closes(conn, symbols, start_date, end_date):
+    # (symbol, date, close) tuples: for each symbol, the close in effect on start_date
+    # and every later one up to end_date, in no particular order
+    return _tuples(conn).execute('''
+        WITH wanted (symbol, since) AS (
+            SELECT value, COALESCE(
+                (SELECT date FROM prices WHERE symbol = value AND date <= :start ORDER BY date DESC LIMIT 1), :start)
+            FROM json_each(:symbols)
+        )
+        SELECT p.symbol, p.date, p.close FROM wanted AS w
+        JOIN prices AS p ON p.symbol = w.symbol AND p.date >= w.since AND p.date <= :end
+    ''', {"symbols": json.dumps(sorted(set(symbols))), "start": start_date, "end": end_date})
+
+def as_of(conn, symbols, dates):
+    # (symbol, date, close) tuples: the close in effect on each of dates, for each
+    # symbol; close is None before the symbol's first one. Filtering or sorting the
+    # rows in SQL would run the lookup twice, so they come in no particular order.
+    return _tuples(conn).execute('''
+        SELECT s.value, d.value, (
+            SELECT close FROM prices WHERE symbol = s.value AND date <= d.value ORDER BY date DESC LIMIT 1)
+        FROM json_each(:symbols) AS s, json_each(:dates) AS d
+    ''', {"symbols": json.dumps(sorted(set(symbols))), "dates": json.dumps(sorted(set(dates)))})
@@ -0,0 +1,246 @@
+import cProfile
+import collections
+import datetime
+import hmac
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+
+# Opt-in request profiling.
+#
+# A profiled request runs under cProfile, and with PARFIN_PROFILE_TRACEMALLOC also
+# under tracemalloc. Requests are picked at random (PARFIN_PROFILE_SAMPLE_PERCENT)
+# or by carrying the X-ParFin-Profile header set to PARFIN_PROFILE_TOKEN, which
+# only whoever runs the server knows; without a token the header is ignored. The
+# latest PARFIN_PROFILE_KEEP profiles are kept in memory for /api/debug/profiles,
+# which serves each as pstats text, as a marshalled pstats file (what
+# pstats.Stats.dump_stats writes) or as collapsed stacks for flamegraph tools.
+#
+# With neither a sample rate nor a token, profiling is off and the server does
+# not install its middleware at all, so requests pay nothing for it.
+#
+# One request is profiled at a time: a request picked while another is being
+# profiled runs unprofiled. cProfile sees only the request's own thread, so the
+# sub-requests a batch runs on its worker threads are not in the batch's profile.
+# tracemalloc is process-wide: its figures include what other threads allocated
+# meanwhile.
+
+SAMPLE_PERCENT = float(os.environ.get('PARFIN_PROFILE_SAMPLE_PERCENT', 0))
+TOKEN = os.environ.get('PARFIN_PROFILE_TOKEN', '')
+TRACE_MEMORY = os.environ.get('PARFIN_PROFILE_TRACEMALLOC', '').lower() in ('1', 'true', 'yes')
+KEEP = int(os.environ.get('PARFIN_PROFILE_KEEP', 50))
+
+HEADER = 'X-ParFin-Profile'
+
+# Allocation sites listed per profile when tracing memory
+TOP_ALLOCATIONS = 10
+
+FORMATS = ('text', 'pstats', 'collapsed')
+SORT_KEYS = ('cumulative', 'tottime', 'calls', 'ncalls', 'time', 'name', 'filename')
+
+class ProfileError(ValueError):
+    pass
+
+class Session:
+    """A profile being recorded."""
+
+    def __init__(self, reason, trace_memory):
+        self.reason = reason
+        self.started_at = datetime.datetime.now().isoformat(timespec='seconds')
+        self.memory_started = False
+        self.memory_before = None
+        if trace_memory:
+            if tracemalloc.is_tracing():
+                self.memory_before = tracemalloc.take_snapshot()
+            else:
+                tracemalloc.start()
+                self.memory_started = True
+            tracemalloc.reset_peak()
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. python -m cProfile run.py) owns the interpreter's hook
+            if self.memory_started:
+                tracemalloc.stop()
+            raise
+
+    def finish(self):
+        # (seconds, pstats dict, memory summary or None)
+        self.profiler.disable()
+        seconds = time.perf_counter() - self.started
+        memory = None
+        if self.memory_started or self.memory_before is not None:
+            # Before create_stats(), whose own allocations would top the list
+            memory = _memory_summary(self.memory_before)
+            if self.memory_started:
+                tracemalloc.stop()
+        self.profiler.create_stats()
+        return seconds, self.profiler.stats, memory
+
+class RequestProfiler:
+    """Picks requests to profile and keeps the latest profiles."""
+
+    def __init__(self, sample_percent=SAMPLE_PERCENT, token=TOKEN, trace_memory=TRACE_MEMORY, keep=KEEP):
+        self.sample_percent = max(0.0, min(100.0, sample_percent))
+        self.token = token
+        self.trace_memory = trace_memory
+        self.enabled = self.sample_percent > 0 or bool(token)
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self._profiles = collections.deque(maxlen=max(1, keep))
+        self._next_id = 1
+
+    def wanted(self, header):
+        # Why a request with this X-ParFin-Profile value is profiled: 'header',
+        # 'sample' or None
+        if header and self.token and hmac.compare_digest(header.encode(), self.token.encode()):
+            return 'header'
+        if self.sample_percent and random.random() * 100 < self.sample_percent:
+            return 'sample'
+        return None
+
+    def start(self, reason):
+        # A running Session, or None while another request (or another profiler
+        # altogether) is being profiled
+        if not self._active.acquire(blocking=False):
+            return None
+        try:
+            return Session(reason, self.trace_memory)
+        except ValueError:
+            self._active.release()
+            return None
+        except BaseException:
+            self._active.release()
+            raise
+
+    def stop(self, session, **request):
+        # Ends the session and keeps its profile, described by request (method,
+        # route, path, status)
+        try:
+            seconds, stats, memory = session.finish()
+        finally:
+            self._active.release()
+        with self._lock:
+            profile = dict(request, id=self._next_id, started_at=session.started_at, reason=session.reason,
+                           duration_ms=round(seconds * 1000, 3),
+                           calls=sum(nc for _, nc, _, _, _ in stats.values()),
+                           memory=memory, stats=stats)
+            self._next_id += 1
+            self._profiles.append(profile)
+        return profile
+
+    def list(self):
+        # Summaries of the kept profiles, newest first
+        with self._lock:
+            profiles = list(self._profiles)
+        return [{key: value for key, value in p.items() if key != 'stats'} for p in reversed(profiles)]
+
+    def get(self, profile_id):
+        with self._lock:
+            for profile in self._profiles:
+                if profile['id'] == profile_id:
+                    return profile
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+    def info(self):
+        return {"enabled": self.enabled, "sample_percent": self.sample_percent, "header": bool(self.token),
+                "tracemalloc": self.trace_memory, "keep": self._profiles.maxlen}
+
+def render(profile, output_format='text', sort='cumulative', limit=40):
+    # (body bytes, content type) of a profile in one of FORMATS
+    if output_format not in FORMATS:
+        raise ProfileError(f"format must be one of {', '.join(FORMATS)}")
+    if output_format == 'pstats':
+        return marshal.dumps(profile['stats']), 'application/octet-stream'
+    if output_format == 'collapsed':
+        return collapsed_stacks(profile['stats']).encode(), 'text/plain; charset=utf-8'
+
+    if sort not in SORT_KEYS:
+        raise ProfileError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    if not isinstance(limit, int) or limit < 1:
+        raise ProfileError("limit must be a positive integer")
+    out = io.StringIO()
+    out.write(f"{profile['method']} {profile['path']} -> {profile['status']} in {profile['duration_ms']} ms "
+              f"({profile['reason']}, {profile['started_at']})\n")
+    stats = pstats.Stats(stream=out)
+    stats.stats = profile['stats']
+    stats.get_top_level_stats()
+    stats.sort_stats(sort).print_stats(limit)
+    memory = profile['memory']
+    if memory:
+        out.write(f"Memory: peak {memory['peak_kb']} KiB traced; largest allocations still held:\n")
+        for site in memory['top']:
+            out.write(f"  {site['size_kb']:>10} KiB {site['count']:>8} blocks  {site['where']}\n")
+    return out.getvalue().encode(), 'text/plain; charset=utf-8'
+
+def collapsed_stacks(stats):
+    # Collapsed stack lines ('outer;inner;leaf microseconds') for flamegraph.pl,
+    # speedscope and the like. cProfile keeps only caller -> callee totals, not
+    # whole stacks, so a function's time is split between its callers in
+    # proportion to the time each call path spent in it.
+    callees = collections.defaultdict(list)
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, edge_ct) in callers.items():
+            callees[caller].append((func, edge_ct))
+
+    totals = collections.Counter()
+    def walk(func, stack, seconds):
+        _, _, tt, ct, _ = stats[func]
+        if ct <= 0 or seconds < 1e-7:
+            # Paths under a tenth of a microsecond would round away anyway
+            return
+        stack = stack + (_frame(func),)
+        share = seconds / ct
+        totals[stack] += tt * share
+        for callee, edge_ct in callees[func]:
+            # A recursive call's time is already inside its caller's
+            if _frame(callee) not in stack:
+                walk(callee, stack, edge_ct * share)
+
+    for root in roots:
+        walk(root, (), stats[root][3])
+    lines = [f"{';'.join(stack)} {round(seconds * 1e6)}" for stack, seconds in sorted(totals.items())
+             if round(seconds * 1e6) > 0]
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def _frame(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-ins, e.g. <method 'execute' of 'sqlite3.Cursor' objects>
+        label = name
+    else:
+        label = f"{name} ({os.path.basename(filename)}:{line})"
+    return label.replace(';', ',')
+
+def _memory_summary(before):
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    _, peak = tracemalloc.get_traced_memory()
+    if before is None:
+        top = [(s.traceback, s.size, s.count) for s in snapshot.statistics('lineno')]
+    else:
+        top = [(s.traceback, s.size_diff, s.count_diff) for s in snapshot.compare_to(before, 'lineno') if s.size_diff > 0]
+    return {
+        "peak_kb": round(peak / 1024, 1),
+        "top": [{"where": f"{tb[0].filename}:{tb[0].lineno}", "size_kb": round(size / 1024, 1), "count": count}
+                for tb, size, count in top[:TOP_ALLOCATIONS]],
+    }
+
+PROFILER = RequestProfiler()
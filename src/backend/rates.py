@@ -0,0 +1,183 @@
+import bisect
+import datetime
+from backend import versions
+
+# Exchange rates.
+#
+# exchange_rates holds dated rates for any currency pair: on `date` and until the
+# pair's next entry, 1 `base` is worth `rate` `quote`. Dates before a pair's first
+# entry use that first rate. Pairs that are not stored directly are derived through
+# other currencies (VND -> EUR via USD, say), and the inverse of a pair comes free.
+#
+# RateMatrix loads the whole table once and answers factor(source, target, date)
+# with a bisect, so conversion never goes back to the database. Callers keep one
+# matrix per data version of the table (see logic.get_rate_matrix).
+#
+# Functions here never commit: the caller owns the transaction.
+
+class RateError(ValueError):
+    pass
+
+def create_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            base TEXT NOT NULL,
+            quote TEXT NOT NULL,
+            date TEXT NOT NULL, -- 'YYYY-MM-DD' the rate takes effect
+            rate REAL NOT NULL, -- 1 base = rate quote
+            PRIMARY KEY (base, quote, date)
+        ) WITHOUT ROWID
+    ''')
+    versions.create_triggers(c, 'exchange_rates')
+
+def _validate(base, quote, date, rate=1.0):
+    if not base or not quote or not isinstance(base, str) or not isinstance(quote, str):
+        raise RateError("base and quote currencies are required")
+    if base == quote:
+        raise RateError("base and quote must differ")
+    try:
+        datetime.date.fromisoformat(date)
+    except (TypeError, ValueError):
+        raise RateError("date must be YYYY-MM-DD")
+    try:
+        rate = float(rate)
+    except (TypeError, ValueError):
+        raise RateError("rate must be a number")
+    if not rate > 0:
+        raise RateError("rate must be positive")
+    return base.upper(), quote.upper(), date, rate
+
+def set_rate(conn, base, quote, date, rate):
+    # Stores the rate for the pair from `date`; a pair is kept in one direction only
+    base, quote, date, rate = _validate(base, quote, date, rate)
+    conn.execute('DELETE FROM exchange_rates WHERE base = ? AND quote = ? AND date = ?', (quote, base, date))
+    conn.execute('''
+        INSERT INTO exchange_rates (base, quote, date, rate) VALUES (?, ?, ?, ?)
+        ON CONFLICT (base, quote, date) DO UPDATE SET rate = excluded.rate
+    ''', (base, quote, date, rate))
+
+def delete_rate(conn, base, quote, date):
+    base, quote, date, _ = _validate(base, quote, date)
+    cur = conn.execute('DELETE FROM exchange_rates WHERE base = ? AND quote = ? AND date = ?', (base, quote, date))
+    return cur.rowcount
+
+def list_rates(conn):
+    rows = conn.execute('SELECT base, quote, date, rate FROM exchange_rates ORDER BY base, quote, date').fetchall()
+    return [{"base": r[0], "quote": r[1], "date": r[2], "rate": r[3]} for r in rows]
+
+class RateMatrix:
+    """Every stored rate, with conversion factors between any two connected currencies."""
+
+    def __init__(self, rows):
+        # rows: (base, quote, date, rate)
+        self._pairs = {} # (base, quote) -> ([dates], [rates]) by date
+        for base, quote, date, rate in sorted(rows, key=lambda r: r[2]):
+            dates, values = self._pairs.setdefault((base, quote), ([], []))
+            dates.append(date)
+            values.append(rate)
+        self._neighbours = {}
+        for base, quote in self._pairs:
+            self._neighbours.setdefault(base, set()).add(quote)
+            self._neighbours.setdefault(quote, set()).add(base)
+        # Dates on which some rate changes; factors are constant between them
+        self._dates = sorted({d for dates, _ in self._pairs.values() for d in dates})
+        self._series = {}
+
+    @classmethod
+    def load(cls, conn):
+        return cls(conn.execute('SELECT base, quote, date, rate FROM exchange_rates').fetchall())
+
+    def currencies(self):
+        return set(self._neighbours)
+
+    def _rate(self, base, quote, date):
+        # Rate of a stored pair in effect on date, or its inverse
+        pair = self._pairs.get((base, quote))
+        inverse = pair is None
+        if inverse:
+            pair = self._pairs[(quote, base)]
+        dates, values = pair
+        rate = values[max(bisect.bisect_right(dates, date) - 1, 0)]
+        return 1 / rate if inverse else rate
+
+    def _path(self, source, target):
+        # Shortest chain of currencies from source to target, or None
+        previous = {source: None}
+        frontier = [source]
+        while frontier and target not in previous:
+            following = []
+            for currency in frontier:
+                for neighbour in sorted(self._neighbours.get(currency, ())):
+                    if neighbour not in previous:
+                        previous[neighbour] = currency
+                        following.append(neighbour)
+            frontier = following
+        if target not in previous:
+            return None
+        path = [target]
+        while previous[path[-1]] is not None:
+            path.append(previous[path[-1]])
+        return path[::-1]
+
+    def series(self, source, target):
+        # ([dates], [factors]): the factor from source to target from each date on,
+        # with consecutive equal factors merged. Empty when the two are not connected.
+        key = (source, target)
+        if key not in self._series:
+            dates, factors = [], []
+            path = self._path(source, target) if source != target else None
+            if path:
+                legs = list(zip(path, path[1:]))
+                for date in self._dates:
+                    factor = 1.0
+                    for base, quote in legs:
+                        factor *= self._rate(base, quote, date)
+                    if not factors or factor != factors[-1]:
+                        dates.append(date)
+                        factors.append(factor)
+            self._series[key] = (dates, factors)
+        return self._series[key]
+
+    def factor(self, source, target, date=None):
+        # Multiplier converting an amount in source into target at the rate in effect
+        # on date (the latest rate when date is None). Amounts in a currency with no
+        # known rate to target are left as they are.
+        if source == target:
+            return 1.0
+        dates, factors = self.series(source, target)
+        if not factors:
+            return 1.0
+        if date is None:
+            return factors[-1]
+        return factors[max(bisect.bisect_right(dates, date) - 1, 0)]
+
+    def changes_within(self, source, target, start_date=None, end_date=None):
+        # True when the factor from source to target is not constant over the range
+        dates, _ = self.series(source, target)
+        changes = dates[1:]
+        if start_date:
+            changes = changes[bisect.bisect_right(changes, start_date):]
+        if end_date:
+            changes = changes[:bisect.bisect_right(changes, end_date)]
+        return bool(changes)
+
+    def split_months(self, source, target, start_date=None, end_date=None):
+        # Date ranges covering the months of [start_date, end_date] in which the factor
+        # changes after the 1st, clipped to the range and merged when adjacent. Outside
+        # them a single factor holds for each whole month.
+        dates, _ = self.series(source, target)
+        months = sorted({d[:7] for d in dates[1:] if d[8:10] != '01'
+                         and (not start_date or d > start_date) and (not end_date or d <= end_date)})
+        ranges = []
+        for month in months:
+            first = datetime.date.fromisoformat(month + '-01')
+            last = (first.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+            first, last = first.isoformat(), last.isoformat()
+            first = max(first, start_date) if start_date else first
+            last = min(last, end_date) if end_date else last
+            if ranges and datetime.date.fromisoformat(ranges[-1][1]) + datetime.timedelta(days=1) == \
+                    datetime.date.fromisoformat(first):
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+        return ranges
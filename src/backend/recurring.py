@@ -0,0 +1,95 @@
+import calendar
+import datetime
+import json
+
+# Fixed item materialization.
+#
+# A fixed item (salary, rent) becomes one transaction per month. The transactions
+# it creates carry fixed_item_id and period ('YYYY-MM'), and a unique index on the
+# pair makes materialization idempotent: generating a month twice, or a range
+# overlapping months already generated, only adds what is missing. A generated
+# transaction the user deletes comes back only if its month is generated again.
+#
+# materialize() creates every item for every month of a range in one
+# INSERT ... SELECT, so backfilling years of recurring items is one statement.
+#
+# Functions here never commit: the caller owns the transaction.
+
+MAX_MONTHS = 120
+
+class RecurringError(ValueError):
+    pass
+
+def create_schema(c):
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_fixed_item_period
+        ON transactions (fixed_item_id, period) WHERE fixed_item_id IS NOT NULL''')
+
+def link_existing(c):
+    # Marks transactions generated before the key existed: per fixed item and month,
+    # the first transaction identical to the item. Returns the number linked.
+    cur = c.execute('''
+        UPDATE transactions SET fixed_item_id = m.fixed_item_id, period = m.period FROM (
+            SELECT f.id AS fixed_item_id, substr(t.date, 1, 7) AS period, MIN(t.id) AS transaction_id
+            FROM fixed_items AS f JOIN transactions AS t
+                ON t.user_id = f.user_id AND t.amount = f.amount AND t.type = f.type AND t.category = f.category
+                AND t.description IS f.description AND t.source IS f.source AND t.destination IS f.destination
+                AND t.destination_category IS f.destination_category AND t.fund IS f.fund
+            WHERE t.fixed_item_id IS NULL
+            GROUP BY f.id, substr(t.date, 1, 7)
+        ) AS m
+        WHERE transactions.id = m.transaction_id
+    ''')
+    return cur.rowcount
+
+def _month(value, name):
+    try:
+        return datetime.date.fromisoformat(f"{value}-01")
+    except (TypeError, ValueError):
+        raise RecurringError(f"{name} must be YYYY-MM")
+
+def month_dates(start_month, end_month=None, day=1):
+    # [(period, date)] for each month of the range, dated on `day` or the month's last day
+    start = _month(start_month, 'start_month')
+    end = _month(end_month, 'end_month') if end_month else start
+    if end < start:
+        raise RecurringError("start_month is after end_month")
+    if not isinstance(day, int) or not 1 <= day <= 31:
+        raise RecurringError("day must be an integer from 1 to 31")
+    count = (end.year - start.year) * 12 + end.month - start.month + 1
+    if count > MAX_MONTHS:
+        raise RecurringError(f"More than {MAX_MONTHS} months")
+
+    periods = []
+    year, month = start.year, start.month
+    for _ in range(count):
+        date = datetime.date(year, month, min(day, calendar.monthrange(year, month)[1]))
+        periods.append((date.isoformat()[:7], date.isoformat()))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+def parse_request(data):
+    # Periods for a generate request: {"date"} for the month of that date, or
+    # {"start_month"[, "end_month", "day"]} for a range
+    if data.get('start_month'):
+        return month_dates(data['start_month'], data.get('end_month'), data.get('day', 1))
+    try:
+        date = datetime.date.fromisoformat(data.get('date') or '').isoformat()
+    except (TypeError, ValueError):
+        raise RecurringError("Date is required" if not data.get('date') else "date must be YYYY-MM-DD")
+    return [(date[:7], date)]
+
+def materialize(conn, periods, user_id=None):
+    # Creates the transactions of every fixed item (of user_id, or of all users) for
+    # each (period, date) not generated yet. Returns the number created.
+    where, args = ('WHERE f.user_id = ?', [user_id]) if user_id is not None else ('WHERE TRUE', [])
+    cur = conn.execute(f'''
+        INSERT INTO transactions (user_id, amount, type, category, description, source, destination,
+                                  destination_category, fund, date, fixed_item_id, period)
+        SELECT f.user_id, f.amount, f.type, f.category, f.description, f.source, f.destination,
+               f.destination_category, f.fund, json_extract(p.value, '$[1]'), f.id, json_extract(p.value, '$[0]')
+        FROM json_each(?) AS p, fixed_items AS f
+        {where}
+        ORDER BY json_extract(p.value, '$[0]'), f.id
+        ON CONFLICT DO NOTHING
+    ''', [json.dumps(periods)] + args)
+    return cur.rowcount
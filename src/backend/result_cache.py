@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Result cache.
+#
+# A bounded LRU of computed results (see logic.calculate_stats and
+# logic.calculate_portfolio). Callers put everything a result depends on into the
+# key, including the data versions of the tables it reads (backend.versions), so
+# a write never has to find and drop entries: it moves the version, later lookups
+# use the new key, and the stale entries age out of the LRU.
+#
+# The cache is capped both by entry count and by an estimate of the memory its
+# values hold; the least recently used entries are evicted first.
+
+RESULT_CACHE_SIZE = int(os.environ.get('PARFIN_RESULT_CACHE_SIZE', 512))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('PARFIN_RESULT_CACHE_MB', 16)) * 1024 * 1024
+
+def sizeof(value):
+    # Approximate bytes held by a JSON-like value (dicts, lists, strings, numbers)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sizeof(item) for item in value)
+    return size
+
+class ResultCache:
+    """LRU of results by key, bounded by entry count and approximate size."""
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        # Drops every entry; the counters keep running
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get(self, key):
+        # The cached value, or None. Values are shared: callers must not mutate them.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = sizeof(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,222 @@
+import datetime
+
+# Monthly rollups.
+#
+# monthly_rollups keeps, per (user, month, type, category, source, currency), the
+# total amount, the number of transactions and the earliest date. Triggers on
+# transactions keep it current in the same database transaction as each write,
+# and rebuild() regenerates it from scratch.
+#
+# period_totals() answers a date range from whole-month rollups plus raw rows for
+# the partial months at either edge, so a multi-year range reads a few hundred
+# rows no matter how many transactions it spans.
+#
+# Functions here never commit: the caller owns the transaction.
+
+# Same normalization calculate_stats applies to the source and currency columns
+_SOURCE = "CASE WHEN {row}source = 'bank' THEN 'bank' ELSE 'cash' END"
+_CURRENCY = "COALESCE({row}currency, '')"
+
+def _group_match(row):
+    # WHERE clause selecting the transactions that belong to {row}'s rollup group
+    return f"""
+        user_id = {row}.user_id AND year_month = substr({row}.date, 1, 7)
+        AND type = {row}.type AND category = {row}.category
+        AND {_SOURCE.format(row='')} = {_SOURCE.format(row=row + '.')}
+        AND {_CURRENCY.format(row='')} = {_CURRENCY.format(row=row + '.')}
+    """
+
+_ADD = f"""
+    INSERT INTO monthly_rollups (user_id, year_month, type, category, source, currency, amount, count, first_date)
+    SELECT NEW.user_id, substr(NEW.date, 1, 7), NEW.type, NEW.category,
+           {_SOURCE.format(row='NEW.')}, {_CURRENCY.format(row='NEW.')}, NEW.amount, 1, NEW.date
+    WHERE true
+    ON CONFLICT (user_id, year_month, type, category, source, currency) DO UPDATE SET
+        amount = amount + excluded.amount,
+        count = count + 1,
+        first_date = MIN(first_date, excluded.first_date);
+"""
+
+_OLD_KEY = f"""
+    user_id = OLD.user_id AND year_month = substr(OLD.date, 1, 7)
+    AND type = OLD.type AND category = OLD.category
+    AND source = {_SOURCE.format(row='OLD.')} AND currency = {_CURRENCY.format(row='OLD.')}
+"""
+
+# Runs AFTER the row is gone (or moved), so the first_date subquery no longer sees it
+_REMOVE = f"""
+    UPDATE monthly_rollups SET
+        amount = amount - OLD.amount,
+        count = count - 1,
+        first_date = CASE WHEN first_date = OLD.date
+            THEN (SELECT MIN(date) FROM transactions WHERE {_group_match('OLD')})
+            ELSE first_date END
+    WHERE {_OLD_KEY};
+    DELETE FROM monthly_rollups WHERE {_OLD_KEY} AND count <= 0;
+"""
+
+def create_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_rollups (
+            user_id INTEGER NOT NULL,
+            year_month TEXT NOT NULL, -- 'YYYY-MM'
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            source TEXT NOT NULL, -- 'cash' or 'bank'
+            currency TEXT NOT NULL, -- native currency, '' when unset
+            amount REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            first_date TEXT, -- earliest transaction date in the group
+            PRIMARY KEY (user_id, year_month, type, category, source, currency)
+        ) WITHOUT ROWID
+    ''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_rollups_insert AFTER INSERT ON transactions
+        BEGIN {_ADD} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_rollups_delete AFTER DELETE ON transactions
+        BEGIN {_REMOVE} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_rollups_update
+        AFTER UPDATE OF user_id, amount, currency, type, category, source, date ON transactions
+        BEGIN {_REMOVE} {_ADD} END''')
+
+_REBUILD_SELECT = f"""
+    SELECT user_id, year_month, type, category, {_SOURCE.format(row='')}, {_CURRENCY.format(row='')},
+           SUM(amount), COUNT(*), MIN(date)
+    FROM transactions {{where}}
+    GROUP BY user_id, year_month, type, category, 5, 6
+"""
+
+def rebuild(conn, user_id=None):
+    where, args = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    conn.execute(f'DELETE FROM monthly_rollups {where}', args)
+    conn.execute(f'''
+        INSERT INTO monthly_rollups (user_id, year_month, type, category, source, currency, amount, count, first_date)
+        {_REBUILD_SELECT.format(where=where)}
+    ''', args)
+    return conn.execute(f'SELECT COUNT(*) FROM monthly_rollups {where}', args).fetchone()[0]
+
+def verify(conn, user_id=None, tolerance=0.005):
+    # Returns [(key, stored, expected)] for groups whose (amount, count, first_date) differ
+    where, args = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    expected = {tuple(r[:6]): (r[6], r[7], r[8]) for r in conn.execute(_REBUILD_SELECT.format(where=where), args)}
+    stored = {
+        tuple(r[:6]): (r[6], r[7], r[8]) for r in conn.execute(f'''
+            SELECT user_id, year_month, type, category, source, currency, amount, count, first_date
+            FROM monthly_rollups {where}
+        ''', args)
+    }
+    drift = []
+    for key in sorted(set(expected) | set(stored), key=str):
+        have = stored.get(key, (0.0, 0, None))
+        want = expected.get(key, (0.0, 0, None))
+        if abs(have[0] - want[0]) > tolerance or have[1:] != want[1:]:
+            drift.append((key, have, want))
+    return drift
+
+def _parse(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def _month_start(d):
+    return d.replace(day=1)
+
+def _next_month(d):
+    return (d.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+def split_range(start_date, end_date):
+    # Splits [start_date, end_date] into whole months served by rollups and the raw
+    # date ranges left over at the edges.
+    # Returns (first_month, last_month, raw_ranges); months are 'YYYY-MM' or None when
+    # unbounded, and first_month is False when no whole month falls inside the range.
+    start = _parse(start_date) if start_date else None
+    end = _parse(end_date) if end_date else None
+    if (start_date and start is None) or (end_date and end is None):
+        # Not an ISO date: leave the whole range to the raw query
+        return False, False, [(start_date, end_date)]
+
+    raw = []
+    first = None
+    if start is not None:
+        first = start if start.day == 1 else _next_month(start)
+    last = None
+    if end is not None:
+        following = end + datetime.timedelta(days=1)
+        last = end if following.day == 1 else _month_start(end) - datetime.timedelta(days=1)
+
+    if first is not None and last is not None and first > last:
+        return False, False, [(start_date, end_date)]
+
+    if start is not None and first != start:
+        raw.append((start_date, (first - datetime.timedelta(days=1)).isoformat()))
+    if end is not None and last != end:
+        raw.append((_month_start(end).isoformat(), end_date))
+
+    first_month = first.isoformat()[:7] if first is not None else None
+    last_month = last.isoformat()[:7] if last is not None else None
+    return first_month, last_month, raw
+
+def period_totals(conn, user_id, start_date, end_date, types=('income', 'expense'), dated=None):
+    # Rows of (type, category, source, currency, amount, first_date) for the range,
+    # one per group, ordered by first_date then category.
+    # dated maps currencies whose exchange rate varies over the range to the date
+    # ranges in which it changes mid-month. Their amounts are kept one row per month,
+    # and one row per day inside those ranges (read from raw transactions), so each
+    # row can be converted at a single rate.
+    dated = dated or {}
+    first_month, last_month, raw_ranges = split_range(start_date, end_date)
+    type_list = ", ".join("?" for _ in types)
+    currency_list = ", ".join("?" for _ in dated)
+    split = [(c, day_start, day_end) for c, ranges in dated.items() for day_start, day_end in ranges]
+    parts = []
+    args = []
+
+    def select(columns, table, currency, month, date):
+        # One part of the union; rows inside the split ranges are left out
+        sql = f"""
+            SELECT {columns}, {f"CASE WHEN {currency} IN ({currency_list}) THEN {month} END" if dated else "NULL"} AS day
+            FROM {table} WHERE user_id = ? AND type IN ({type_list})
+        """
+        args.extend(list(dated) + [user_id] + list(types))
+        for c, day_start, day_end in split:
+            sql += f" AND NOT ({currency} = ? AND {date} BETWEEN ? AND ?)"
+            args.extend([c, day_start, day_end] if date == 'date' else [c, day_start[:7], day_end[:7]])
+        return sql
+
+    if first_month is not False:
+        sql = select('type, category, source, currency, amount, first_date',
+                     'monthly_rollups', 'currency', 'year_month', 'year_month')
+        if first_month:
+            sql += " AND year_month >= ?"
+            args.append(first_month)
+        if last_month:
+            sql += " AND year_month <= ?"
+            args.append(last_month)
+        parts.append(sql)
+
+    source, currency = _SOURCE.format(row=''), _CURRENCY.format(row='')
+    raw_columns = f"type, category, {source} AS source, {currency} AS currency, amount, date AS first_date"
+    for raw_start, raw_end in raw_ranges:
+        sql = select(raw_columns, 'transactions', currency, 'substr(date, 1, 7)', 'date')
+        if raw_start:
+            sql += " AND date >= ?"
+            args.append(raw_start)
+        if raw_end:
+            sql += " AND date <= ?"
+            args.append(raw_end)
+        parts.append(sql)
+
+    for c, day_start, day_end in split:
+        parts.append(f"""
+            SELECT {raw_columns}, date AS day FROM transactions
+            WHERE user_id = ? AND type IN ({type_list}) AND {currency} = ? AND date BETWEEN ? AND ?
+        """)
+        args.extend([user_id] + list(types) + [c, day_start, day_end])
+
+    sql = f"""
+        SELECT type, category, source, currency, SUM(amount) AS amount, MIN(first_date) AS first_date
+        FROM ({' UNION ALL '.join(parts)})
+        GROUP BY type, category, source, currency, day
+        ORDER BY first_date, category
+    """
+    return conn.execute(sql, args).fetchall()
@@ -0,0 +1,184 @@
+# API routing.
+#
+# A Router maps a method and a path to an endpoint. Paths without parameters are
+# found with one dict lookup. Patterns with parameters ('/api/jobs/<int:job_id>')
+# sit in a tree keyed by path segment, so a lookup costs one dict probe per
+# segment however many routes there are. A literal segment wins over a parameter.
+# A path that exists only for other methods matches the "not allowed" fallback
+# (405 with an Allow header) rather than the "not found" one.
+#
+# An endpoint is called as endpoint(handler, arg, **params), where arg is the
+# parsed query string of a GET or the JSON body of a POST, and params are the
+# path parameters plus the route's defaults.
+#
+# Middleware wraps endpoints. A middleware is a function (route, call) -> call,
+# applied once when the route is added, so it can prepare whatever it needs per
+# route (or return call unchanged for routes it does not apply to); call is
+# call(handler, arg, params). The router's own middleware wraps every route,
+# including the fallbacks; a route's middleware runs inside it.
+
+# Pattern of the fallback routes, for requests no route matched
+UNMATCHED = '<unmatched>'
+
+def _int(segment):
+    return int(segment) if segment.isdigit() else None
+
+def _str(segment):
+    return segment or None
+
+CONVERTERS = {'int': _int, 'str': _str}
+
+class RouteError(ValueError):
+    pass
+
+class Route:
+    """An endpoint, the method and pattern it answers, and its options."""
+
+    def __init__(self, method, pattern, endpoint, middleware=(), defaults=None, **options):
+        self.method = method
+        self.pattern = pattern
+        self.endpoint = endpoint
+        self.middleware = tuple(middleware)
+        self.defaults = dict(defaults or {})
+        # Free-form flags read by the server, e.g. batch=False
+        self.options = options
+        self.call = None
+
+    def __repr__(self):
+        return f"<Route {self.method} {self.pattern}>"
+
+class _Node:
+    __slots__ = ('literals', 'params', 'routes')
+
+    def __init__(self):
+        self.literals = {}
+        # [(name, converter, node)] in the order added
+        self.params = []
+        self.routes = {}
+
+class Router:
+    """Routes requests to endpoints; see the module comment."""
+
+    def __init__(self, not_found, not_allowed, middleware=()):
+        self.middleware = list(middleware)
+        self.routes = []
+        self._static = {}
+        self._static_methods = {}
+        self._tree = _Node()
+        self._not_found = not_found
+        self._not_allowed = not_allowed
+        self._fallbacks = {}
+
+    def add(self, method, pattern, endpoint, **options):
+        route = Route(method, pattern, endpoint, **options)
+        segments = pattern.strip('/').split('/')
+        if not any(s.startswith('<') for s in segments):
+            if (method, pattern) in self._static:
+                raise RouteError(f"{method} {pattern} is already routed")
+            self._static[(method, pattern)] = route
+            self._static_methods.setdefault(pattern, []).append(method)
+        else:
+            node = self._tree
+            for segment in segments:
+                node = self._child(node, segment, pattern)
+            if method in node.routes:
+                raise RouteError(f"{method} {pattern} is already routed")
+            node.routes[method] = route
+        self._build(route)
+        self.routes.append(route)
+        return route
+
+    def route(self, method, pattern, **options):
+        # Decorator form of add(); the function is returned unchanged, so several
+        # routes can share one endpoint
+        def register(endpoint):
+            self.add(method, pattern, endpoint, **options)
+            return endpoint
+        return register
+
+    def get(self, pattern, **options):
+        return self.route('GET', pattern, **options)
+
+    def post(self, pattern, **options):
+        return self.route('POST', pattern, **options)
+
+    def use(self, middleware):
+        # Adds router-wide middleware, innermost of the router's own
+        self.middleware.append(middleware)
+        for route in self.routes + list(self._fallbacks.values()):
+            self._build(route)
+
+    def match(self, method, path):
+        # (route, path params), or (None, [methods the path takes]) when nothing matches
+        route = self._static.get((method, path))
+        if route is not None:
+            return route, {}
+        node, params = self._find(self._tree, path.strip('/').split('/'), 0)
+        if node is not None and method in node.routes:
+            return node.routes[method], params
+        allowed = list(self._static_methods.get(path, ()))
+        if node is not None:
+            allowed += node.routes
+        return None, sorted(allowed)
+
+    def dispatch(self, handler, method, path, arg):
+        route, params = self.match(method, path)
+        if route is None:
+            if params:
+                route, params = self._fallback(method, self._not_allowed), {'allow': params}
+            else:
+                route, params = self._fallback(method, self._not_found), {}
+        return route.call(handler, arg, params)
+
+    def _child(self, node, segment, pattern):
+        if not (segment.startswith('<') and segment.endswith('>')):
+            return node.literals.setdefault(segment, _Node())
+        kind, _, name = segment[1:-1].rpartition(':')
+        converter = CONVERTERS.get(kind or 'str')
+        if converter is None or not name.isidentifier():
+            raise RouteError(f"Bad parameter {segment} in {pattern}")
+        for existing, existing_converter, child in node.params:
+            if existing == name and existing_converter is converter:
+                return child
+        child = _Node()
+        node.params.append((name, converter, child))
+        return child
+
+    def _find(self, node, segments, i):
+        # (node, params) of the first route node matching segments[i:], literals first
+        if i == len(segments):
+            return (node, {}) if node.routes else (None, {})
+        child = node.literals.get(segments[i])
+        if child is not None:
+            found, params = self._find(child, segments, i + 1)
+            if found is not None:
+                return found, params
+        for name, converter, child in node.params:
+            value = converter(segments[i])
+            if value is None:
+                continue
+            found, params = self._find(child, segments, i + 1)
+            if found is not None:
+                params[name] = value
+                return found, params
+        return None, {}
+
+    def _fallback(self, method, endpoint):
+        route = self._fallbacks.get((method, endpoint))
+        if route is None:
+            route = Route(method, UNMATCHED, endpoint)
+            self._build(route)
+            route = self._fallbacks.setdefault((method, endpoint), route)
+        return route
+
+    def _build(self, route):
+        endpoint, defaults = route.endpoint, route.defaults
+        if defaults:
+            def call(handler, arg, params):
+                return endpoint(handler, arg, **defaults, **params)
+        else:
+            def call(handler, arg, params):
+                return endpoint(handler, arg, **params)
+        for middleware in reversed(self.middleware + list(route.middleware)):
+            call = middleware(route, call)
+        route.call = call
@@ -0,0 +1,88 @@
+import html
+import re
+
+# Full-text search over transactions.
+#
+# transactions_fts is an FTS5 index of each transaction's description, category
+# and fund. It is an external-content table: the text stays in transactions and
+# the index holds only tokens, kept in sync by triggers. The tokenizer folds case
+# and diacritics, so "dien" finds "điện" only in so far as Unicode decomposes the
+# letters ("đ" does not), while "điện" finds "Điện" and "ĐIỆN".
+#
+# A search query is a list of words and "quoted phrases", all of which must
+# match; a word or phrase ending in * matches as a prefix. Everything else is
+# taken literally, so user input can never be a malformed FTS5 expression.
+# Prefixes of 2 to 4 characters, the ones typed into a search box, have their own
+# index entries: otherwise every query merges the lists of all words sharing the
+# prefix, which makes even the snippets of one page cost as much as the search.
+#
+# Functions here never commit: the caller owns the transaction.
+
+# Relative weight of a match in description, category and fund for ranking
+WEIGHTS = (4.0, 2.0, 1.0)
+
+# Tokens of context around the first match shown in a snippet
+SNIPPET_TOKENS = 12
+
+# Marks a match inside a snippet; the snippet is HTML-escaped before these are
+# turned into <mark> tags
+_OPEN, _CLOSE = '\x02', '\x03'
+
+class SearchError(ValueError):
+    pass
+
+def create_schema(c):
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+            description, category, fund,
+            content='transactions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3 4'
+        )
+    ''')
+    add = "INSERT INTO transactions_fts (rowid, description, category, fund) VALUES (NEW.id, NEW.description, NEW.category, NEW.fund);"
+    remove = ("INSERT INTO transactions_fts (transactions_fts, rowid, description, category, fund) "
+              "VALUES ('delete', OLD.id, OLD.description, OLD.category, OLD.fund);")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_insert AFTER INSERT ON transactions BEGIN {add} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_delete AFTER DELETE ON transactions BEGIN {remove} END")
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_update
+        AFTER UPDATE OF description, category, fund ON transactions BEGIN {remove} {add} END''')
+
+def rebuild(conn):
+    # Reindexes every transaction from the content table
+    conn.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+_TERM = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+
+def match_expression(q):
+    # The FTS5 MATCH expression for a search box query
+    terms = []
+    for phrase, phrase_prefix, word in _TERM.findall(q or ''):
+        text, prefix = (phrase, phrase_prefix) if not word else (word.rstrip('*'), '*' if word.endswith('*') else '')
+        text = text.replace('"', ' ').strip()
+        # Punctuation alone has no tokens, and an empty phrase matches nothing
+        if any(ch.isalnum() for ch in text):
+            terms.append(f'"{text}"{prefix}')
+    if not terms:
+        raise SearchError("q must contain a word to search for")
+    return ' '.join(terms)
+
+def hits(ranked=True):
+    # A CTE "hits" of the rowids (hit_id) matching one MATCH parameter, with their
+    # bm25 "score" (lower is better) when ranked. MATERIALIZED makes the index drive
+    # a join with transactions: left to itself the planner may scan transactions
+    # and run the match once per row.
+    score = f", bm25(transactions_fts, {', '.join(map(str, WEIGHTS))}) AS score" if ranked else ''
+    return f"WITH hits AS MATERIALIZED (SELECT rowid AS hit_id{score} FROM transactions_fts WHERE transactions_fts MATCH ?)"
+
+def snippets(conn, expression, ids):
+    # {id: HTML snippet of the description with matches in <mark>} for ids that
+    # match expression
+    if not ids:
+        return {}
+    rows = conn.execute(f'''
+        SELECT rowid, snippet(transactions_fts, 0, ?, ?, '…', ?) FROM transactions_fts
+        WHERE transactions_fts MATCH ? AND rowid IN ({', '.join('?' for _ in ids)})
+    ''', [_OPEN, _CLOSE, SNIPPET_TOKENS, expression] + list(ids))
+    return {row_id: html.escape(text or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+            for row_id, text in rows}
@@ -1,26 +1,241 @@
 import http.server
 import socketserver
+import queue
+import threading
 import json
+import datetime
+import io
 import os
 import sys
-import mimetypes
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, parse_qs
-from backend.db import init_db, query_db, get_db_connection
+from backend.db import init_db, query_db, connection, shared_connection, pool_stats
 import hashlib
 import uuid
 import backend.logic as logic
+import backend.transactions as transactions
+import backend.export as export
+import backend.importer as importer
+import backend.jobs as jobs
+import backend.static as static
+import backend.compression as compression
+import backend.versions as versions
+import backend.rates as rates
+import backend.history as history
+import backend.prices as prices
+import backend.recurring as recurring
+import backend.metrics as metrics
+import backend.profiling as profiling
+from backend.router import Router
 
 # Helper to handle paths relative to the run.py
 PORT = 8000
 WEB_ROOT = os.path.join(os.getcwd(), 'src', 'frontend')
 
+# Concurrency settings: worker threads serving connections, connections allowed
+# to wait for a free worker, and seconds an idle keep-alive connection is held.
+# A keep-alive connection holds its worker while idle, so WORKER_THREADS idle
+# clients can keep everyone else waiting for up to KEEP_ALIVE_TIMEOUT. To bound
+# that, a response is sent with Connection: close whenever connections are
+# already waiting for a worker.
+WORKER_THREADS = int(os.environ.get('PARFIN_WORKER_THREADS', 16))
+REQUEST_QUEUE_SIZE = int(os.environ.get('PARFIN_REQUEST_QUEUE_SIZE', 64))
+KEEP_ALIVE_TIMEOUT = float(os.environ.get('PARFIN_KEEP_ALIVE_TIMEOUT', 5))
+
+# /api/batch: sub-requests allowed in one batch, and threads (shared by all
+# batches) running consecutive reads side by side
+BATCH_MAX_REQUESTS = int(os.environ.get('PARFIN_BATCH_MAX_REQUESTS', 50))
+BATCH_WORKERS = int(os.environ.get('PARFIN_BATCH_WORKERS', 4))
+
+def _not_found(handler, arg):
+    handler._send_json(404, {"error": "Endpoint not found"})
+
+def _not_allowed(handler, arg, allow):
+    handler._send_json(405, {"error": "Method not allowed"}, headers={'Allow': ', '.join(allow)})
+
+def observe(route, call):
+    # Router middleware recording each request in backend.metrics
+    series = metrics.METRICS.series(route.method, route.pattern)
+    def observed(handler, arg, params):
+        metrics.METRICS.start(series)
+        bytes_sent = handler.bytes_sent
+        started = time.perf_counter()
+        failed = False
+        try:
+            return call(handler, arg, params)
+        except Exception:
+            # Answered with a 500 by do_GET / do_POST
+            failed = True
+            raise
+        finally:
+            status = 500 if failed else handler.response_status
+            metrics.METRICS.finish(series, status, time.perf_counter() - started, handler.bytes_sent - bytes_sent)
+    return observed
+
+def profile(route, call):
+    # Router middleware running the requests backend.profiling picks under the
+    # profiler; routes with profile=False, and every route while profiling is
+    # off, are left unwrapped
+    profiler = profiling.PROFILER
+    if not profiler.enabled or not route.options.get('profile', True):
+        return call
+    def profiled(handler, arg, params):
+        reason = profiler.wanted(handler.headers.get(profiling.HEADER))
+        session = profiler.start(reason) if reason else None
+        if session is None:
+            return call(handler, arg, params)
+        try:
+            return call(handler, arg, params)
+        finally:
+            profiler.stop(session, method=route.method, route=route.pattern,
+                          path=getattr(handler, 'path', route.pattern), status=handler.response_status)
+    return profiled
+
+def conditional(*tables):
+    # Route middleware answering a GET conditionally: its response carries an ETag
+    # over the data versions of the tables it is built from (see backend.versions),
+    # and a client holding the current ETag gets a 304
+    def middleware(route, call):
+        def conditional_call(handler, query_params, params):
+            if handler._check_data_version(route.pattern, tables, query_params):
+                return
+            return call(handler, query_params, params)
+        return conditional_call
+    return middleware
+
+# Endpoints are registered on these with the ParFinHandler methods below. API
+# routes GETs and POSTs with JSON bodies. UPLOADS routes raw file uploads, which
+# are parsed straight off the socket instead of read whole: they are matched
+# before the body is read, and only when `when`, if given, accepts the query.
+# A route with batch=False cannot be part of an /api/batch.
+API = Router(not_found=_not_found, not_allowed=_not_allowed, middleware=[observe, profile])
+UPLOADS = Router(not_found=_not_found, not_allowed=_not_allowed, middleware=[observe, profile])
+
+class RequestBody(io.RawIOBase):
+    # Reads at most `length` bytes of a request body from the socket, so a parser can
+    # consume an upload incrementally without running into the next request
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.rfile.read(min(len(buffer), self.remaining))
+        if not data:
+            raise ConnectionError("Client closed the connection mid-upload")
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
 class ParFinHandler(http.server.BaseHTTPRequestHandler):
-    
-    def _set_headers(self, status=200, content_type='application/json'):
+    # HTTP/1.1 keeps connections open between requests, so every response
+    # must carry a Content-Length. Idle connections time out after KEEP_ALIVE_TIMEOUT.
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+    response_etag = None
+    response_status = None
+    bytes_sent = 0
+
+    def parse_request(self):
+        # Per-request state: the handler instance is reused across keep-alive requests
+        self.response_etag = None
+        self.response_status = None
+        self.bytes_sent = 0
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+        pending = getattr(self.server, 'pending', None)
+        if pending is not None and not pending.empty():
+            # Connections are waiting for a worker: give this one back after the
+            # response instead of holding it for the client's next request
+            self.send_header('Connection', 'close')
+
+    def _set_headers(self, status=200, content_type='application/json', content_length=0, headers=None):
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(content_length))
+        if self.response_etag and status == 200:
+            self.send_header('ETag', self.response_etag)
+            self.send_header('Cache-Control', 'no-cache')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def _negotiate_gzip(self, content_type, headers, size=None):
+        # Central compression decision; size is None for streamed bodies.
+        # Returns (use gzip, headers to send).
+        if (not compression.COMPRESS_ENABLED or not compression.compressible(content_type)
+                or 'Content-Encoding' in (headers or {})):
+            return False, headers
+        if size is not None and size < compression.COMPRESS_MIN_SIZE:
+            compression.STATS.skip('small')
+            return False, headers
+        # The response now depends on Accept-Encoding, whichever way it goes
+        headers = dict(headers or {}, Vary='Accept-Encoding')
+        if not compression.accepts_gzip(self.headers.get('Accept-Encoding')):
+            compression.STATS.skip('client')
+            return False, headers
+        return True, headers
+
+    def _send(self, status, body, content_type='application/json', headers=None, compress=True):
+        if compress:
+            use_gzip, headers = self._negotiate_gzip(content_type, headers, len(body))
+            compressed = compression.gzip_body(body) if use_gzip else None
+            if compressed is not None:
+                body = compressed
+                headers['Content-Encoding'] = 'gzip'
+        self._set_headers(status, content_type, len(body), headers)
+        self.wfile.write(body)
+        self.bytes_sent += len(body)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode(), headers=headers)
+
+    def _send_stream(self, status, chunks, content_type='application/json', headers=None):
+        # Streams an iterable of bytes using chunked transfer encoding, so the body never
+        # has to be held in memory. HTTP/1.0 clients get a body ended by closing the connection.
+        chunked = self.request_version != 'HTTP/1.0'
+        use_gzip, headers = self._negotiate_gzip(content_type, headers)
+        if use_gzip:
+            chunks = compression.gzip_stream(chunks)
+            headers['Content-Encoding'] = 'gzip'
         self.send_response(status)
         self.send_header('Content-type', content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
         self.end_headers()
 
+        try:
+            for data in chunks:
+                if not data:
+                    continue
+                if chunked:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                else:
+                    self.wfile.write(data)
+                self.bytes_sent += len(data)
+        except Exception as e:
+            # Headers are already out: drop the connection without the final chunk so the
+            # client sees a truncated body instead of a success
+            print(f"Stream Error: {e}")
+            self.close_connection = True
+            return
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
     def do_GET(self):
         parsed_path = urlparse(self.path)
         path = parsed_path.path
@@ -31,597 +246,964 @@ class ParFinHandler(http.server.BaseHTTPRequestHandler):
                 self.handle_api_get(path, parse_qs(parsed_path.query))
             except Exception as e:
                 print(f"API Error: {e}")
-                self._set_headers(500)
-                self.wfile.write(json.dumps({"error": str(e)}).encode())
+                self._send_json(500, {"error": str(e)})
             return
 
         # Static File Serving
         if path == '/':
             path = '/index.html'
-            
-        # Security: prevent traversing up directories
-        safe_path = os.path.normpath(path).lstrip(os.sep)
-        file_path = os.path.join(WEB_ROOT, safe_path)
-        
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            mime_type, _ = mimetypes.guess_type(file_path)
-            with open(file_path, 'rb') as f:
-                content = f.read()
-            self._set_headers(200, mime_type or 'application/octet-stream')
-            self.wfile.write(content)
-        else:
-            self._set_headers(404, 'text/plain')
-            self.wfile.write(b'Not Found')
+        self._send_static(path)
 
     def do_POST(self):
         try:
             content_length_str = self.headers['Content-Length']
             if not content_length_str:
-                self._set_headers(411) # Length Required
+                # Without a length we cannot find the end of the body, so drop the connection
+                self.close_connection = True
+                self._send_json(411, {"error": "Length Required"}, headers={'Connection': 'close'})
+                return
+            try:
+                content_length = int(content_length_str)
+            except ValueError:
+                content_length = -1
+            if content_length < 0:
+                self.close_connection = True
+                self._send_json(400, {"error": "Invalid Content-Length"}, headers={'Connection': 'close'})
+                return
+            parsed_path = urlparse(self.path)
+
+            query_params = parse_qs(parsed_path.query)
+            upload, params = UPLOADS.match('POST', parsed_path.path)
+            when = upload.options.get('when') if upload else None
+            if upload and (when is None or when(query_params)):
+                body = RequestBody(self.rfile, content_length)
+                try:
+                    upload.call(self, query_params, dict(params, body=body))
+                finally:
+                    if body.remaining:
+                        # The rest of the upload is still on the socket; it cannot be reused
+                        self.close_connection = True
                 return
-            content_length = int(content_length_str)
+
             post_data = self.rfile.read(content_length)
             
-            data = json.loads(post_data.decode('utf-8'))
+            # An empty body (e.g. /api/jobs/<id>/cancel) reads as {}
+            data = json.loads(post_data.decode('utf-8')) if post_data else {}
         
-            parsed_path = urlparse(self.path)
             if parsed_path.path.startswith('/api/'):
                 self.handle_api_post(parsed_path.path, data)
             else:
-                self._set_headers(404)
-                self.wfile.write(b'Not Found')
+                self._send(404, b'Not Found', 'text/plain')
         except Exception as e:
              print(f"POST Error: {e}")
-             self._set_headers(500)
-             self.wfile.write(json.dumps({"error": str(e)}).encode())
+             self._send_json(500, {"error": str(e)})
+
+    def _check_data_version(self, path, tables, query_params):
+        # Sets the response ETag of a GET built from tables; True when a 304 was sent
+        user_id = 1
+        with connection() as conn:
+            etag = versions.etag(conn, user_id, tables, path, query_params)
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match and static.etag_matches(if_none_match, etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return True
+        self.response_etag = etag
+        return False
 
     # API Handlers
     def handle_api_get(self, path, query_params):
-        if path == '/api/auth/check':
-             self._set_headers(200)
-             self.wfile.write(json.dumps({"status": "ok"}).encode())
-             
-        elif path == '/api/transactions':
-             # Query params handling
-             query = query_params
-             
-             # Date Range Logic
-             period = query.get('period', [''])[0]
-             start_date_param = query.get('start_date', [None])[0]
-             end_date_param = query.get('end_date', [None])[0]
-             
-             if period:
-                 start_date, end_date = logic.calculate_date_range(period, start_date_param, end_date_param)
-             else:
-                 # Fallback if no period but explicit dates
-                 start_date = start_date_param
-                 end_date = end_date_param
-             
-             category = query.get('category', [None])[0]
-             trans_type = query.get('type', [None])[0]
-             
-             # Sorting Logic
-             sort_by = query.get('sort_by', ['date'])[0]
-             order = query.get('order', ['desc'])[0]
-             
-             # Whitelist sort columns to prevent injection
-             valid_sort_cols = ['date', 'amount', 'category', 'type']
-             if sort_by not in valid_sort_cols:
-                 sort_by = 'date'
-             
-             sql = "SELECT * FROM transactions WHERE 1=1"
-             args = []
-             
-             if start_date:
-                 sql += " AND date >= ?"
-                 args.append(start_date)
-             if end_date:
-                 sql += " AND date <= ?"
-                 args.append(end_date)
-             if category and category != 'all':
-                 sql += " AND category = ?"
-                 args.append(category)
-             if trans_type and trans_type != 'all':
-                 sql += " AND type = ?"
-                 args.append(trans_type)
-                 
-             sql += f" ORDER BY {sort_by} {order.upper()}, id {order.upper()}"
-             
-             rows = query_db(sql, args)
-             
-             result = []
-             for row in rows:
-                 result.append({
-                     "id": row['id'],
-                     "amount": row['amount'],
-                     "type": row['type'],
-                     "category": row['category'],
-                     "description": row['description'],
-                     "date": row['date'],
-                     "currency": row['currency'],
-                     "source": row['source'],
-                     "destination": row['destination'] if 'destination' in row.keys() else None,
-                     "destination_category": row['destination_category'] if 'destination_category' in row.keys() else None,
-                     "fund": row['fund'] if 'fund' in row.keys() else None
-                 })
-                 
-             self._set_headers(200)
-             self.wfile.write(json.dumps(result).encode())
-
-        elif path == '/api/users':
-             rows = query_db('SELECT id, username, role, created_at FROM users')
-             users = []
-             for row in rows:
-                 users.append({
-                     "id": row['id'],
-                     "username": row['username'],
-                     "role": row['role'],
-                     "created_at": row['created_at']
-                 })
-             self._set_headers(200)
-             self.wfile.write(json.dumps(users).encode())
-
-        elif path == '/api/stats':
-             query = query_params
-             
-             # Use the same logic for dates as transactions if period is provided, else fallback
-             period = query.get('period', [''])[0]
-             start_date_param = query.get('start_date', [None])[0]
-             end_date_param = query.get('end_date', [None])[0]
-             
-             if period:
-                 start_date, end_date = logic.calculate_date_range(period, start_date_param, end_date_param)
-             else:
-                 start_date = start_date_param
-                 end_date = end_date_param
-                 
-             currency = query.get('currency', ['VND'])[0]
-             user_id = 1
-             
-             stats = logic.calculate_stats(user_id, start_date, end_date, currency)
-             self._set_headers(200)
-             self.wfile.write(json.dumps(stats).encode())
-             
-        elif path == '/api/export':
-             # Reuse filters? For now keep simple
-             month = query_params.get('month', [None])[0]
-             export_format = query_params.get('format', ['json'])[0]
-             
-             sql = "SELECT * FROM transactions"
-             args = []
-             if month and month != 'all':
-                 sql += " WHERE date LIKE ?"
-                 args.append(f"{month}%")
-             
-             sql += " ORDER BY date DESC"
-             rows = query_db(sql, args)
-             
-             export_data = []
-             for row in rows:
-                  export_data.append({
-                     "id": row['id'],
-                      "amount": row['amount'],
-                      "type": row['type'],
-                      "category": row['category'],
-                      "description": row['description'],
-                      "date": row['date'],
-                      "currency": row['currency'],
-                      "source": row['source'],
-                      "destination": row['destination'] if 'destination' in row.keys() else None,
-                      "destination_category": row['destination_category'] if 'destination_category' in row.keys() else None,
-                      "fund": row['fund'] if 'fund' in row.keys() else None
-                 })
-             
-             if export_format == 'csv':
-                 import csv
-                 import io
-                 
-                 output = io.StringIO()
-                 fieldnames = ['id', 'date', 'type', 'category', 'amount', 'currency', 'source', 'fund', 'description']
-                 writer = csv.DictWriter(output, fieldnames=fieldnames)
-                 
-                 writer.writeheader()
-                 for row in export_data:
-                     # Filter row to only fieldnames
-                     csv_row = {k: row.get(k) for k in fieldnames}
-                     writer.writerow(csv_row)
-                 
-                 csv_content = output.getvalue()
-                 
-                 self.send_response(200)
-                 self.send_header('Content-type', 'text/csv')
-                 self.send_header('Content-Disposition', f'attachment; filename="transactions_{month or "all"}.csv"')
-                 self.end_headers()
-                 self.wfile.write(csv_content.encode('utf-8'))
-                 
-             else:
-                 self.send_response(200)
-                 self.send_header('Content-type', 'application/json')
-                 self.send_header('Content-Disposition', f'attachment; filename="transactions_{month or "all"}.json"')
-                 self.end_headers()
-                 self.wfile.write(json.dumps(export_data, indent=2).encode('utf-8'))
-
-        elif path == '/api/fixed_items':
-             user_id = 1
-             items = query_db('SELECT * FROM fixed_items WHERE user_id = ?', (user_id,))
-             
-             result = []
-             for item in items:
-                 result.append({
-                     "id": item['id'],
-                     "amount": item['amount'],
-                     "type": item['type'],
-                     "category": item['category'],
-                     "description": item['description'],
-                     "source": item['source'],
-                     "destination": item['destination'] if 'destination' in item.keys() else None,
-                     "destination_category": item['destination_category'] if 'destination_category' in item.keys() else None,
-                     "fund": item['fund'] if 'fund' in item.keys() else None
-                 })
-             
-             self._set_headers(200)
-             self.wfile.write(json.dumps(result).encode())
-
-        elif path == '/api/settings':
-             rows = query_db('SELECT * FROM settings')
-             settings = {row['key']: row['value'] for row in rows}
-             self._set_headers(200)
-             self.wfile.write(json.dumps(settings).encode())
-
-        elif path == '/api/investments':
-             user_id = 1
-             # Default sort by date desc
-             rows = query_db('SELECT * FROM investment_transactions WHERE user_id = ? ORDER BY date DESC', (user_id,))
-             
-             result = []
-             for row in rows:
-                 result.append({
-                     "id": row['id'],
-                     "date": row['date'],
-                     "symbol": row['symbol'],
-                     "asset_type": row['asset_type'] if 'asset_type' in row.keys() else 'stock',
-                     "type": row['type'],
-                     "quantity": row['quantity'],
-                     "price": row['price'],
-                     "fee": row['fee'],
-                     "tax": row['tax'],
-                     "notes": row['notes']
-                 })
-             
-             self._set_headers(200)
-             self.wfile.write(json.dumps(result).encode())
-        
-        elif path == '/api/investments/portfolio':
-             user_id = 1
-             currency = query_params.get('currency', ['VND'])[0]
-             
-             portfolio = logic.calculate_portfolio(user_id, currency)
-             self._set_headers(200)
-             self.wfile.write(json.dumps(portfolio).encode())
+        API.dispatch(self, 'GET', path, query_params)
 
+    @API.get('/api/auth/check')
+    def get_auth_check(self, query_params):
+        self._send_json(200, {"status": "ok"})
+
+    @API.get('/api/transactions', middleware=[conditional('transactions')])
+    def get_transactions(self, query_params):
+        user_id = 1
+        try:
+            with connection() as conn:
+                if 'limit' in query_params or 'cursor' in query_params:
+                    # Keyset-paginated: {"items", "next_cursor"[, "total_count"]}
+                    result = transactions.list_page(conn, query_params, user_id)
+                else:
+                    # Without a limit the full list is returned as a plain array
+                    fields, rows = transactions.list_rows(conn, query_params, user_id)
+                    result = [dict(zip(fields, row)) for row in rows]
+        except transactions.QueryError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        self._send_json(200, result)
+
+    @API.get('/api/transactions/search', middleware=[conditional('transactions')])
+    def get_transactions_search(self, query_params):
+        # ?q= plus the /api/transactions filters, fields, limit and cursor
+        user_id = 1
+        try:
+            with connection() as conn:
+                result = transactions.search_page(conn, query_params, user_id)
+        except transactions.QueryError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, result)
+
+    @API.get('/api/users')
+    def get_users(self, query_params):
+        rows = query_db('SELECT id, username, role, created_at FROM users')
+        users = []
+        for row in rows:
+            users.append({
+                "id": row['id'],
+                "username": row['username'],
+                "role": row['role'],
+                "created_at": row['created_at']
+            })
+        self._send_json(200, users)
+
+    @API.get('/api/stats', middleware=[conditional('transactions', 'investment_transactions', 'exchange_rates')])
+    def get_stats(self, query_params):
+        query = query_params
+
+        # Use the same logic for dates as transactions if period is provided, else fallback
+        period = query.get('period', [''])[0]
+        start_date_param = query.get('start_date', [None])[0]
+        end_date_param = query.get('end_date', [None])[0]
+
+        if period:
+            start_date, end_date = logic.calculate_date_range(period, start_date_param, end_date_param)
         else:
-             self._set_headers(404)
-             self.wfile.write(json.dumps({"error": "Endpoint not found"}).encode())
+            start_date = start_date_param
+            end_date = end_date_param
+
+        currency = query.get('currency', ['VND'])[0]
+        user_id = 1
+
+        stats = logic.calculate_stats(user_id, start_date, end_date, currency)
+        self._send_json(200, stats)
+
+    @API.get('/api/export', batch=False)
+    def get_export(self, query_params):
+        # Accepts the /api/transactions filters, plus month=YYYY-MM / YYYY
+        month = query_params.get('month', [None])[0]
+        export_format = query_params.get('format', ['json'])[0]
+        compress = query_params.get('compress', [''])[0] == 'gzip'
+        user_id = 1
+
+        if export_format not in export.FORMATS:
+            self._send_json(400, {"error": f"Unsupported format: {export_format}"})
+            return
+
+        content_type, extension = export.FORMATS[export_format]
+        filename = f"transactions_{month or 'all'}.{extension}"
+        with connection() as conn:
+            chunks = export.stream(conn, query_params, user_id, export_format)
+            if compress:
+                # Downloads as a .gz file; compressed on the fly as rows are read
+                content_type = 'application/gzip'
+                filename += '.gz'
+                chunks = compression.gzip_stream(chunks)
+            self._send_stream(200, chunks, content_type, {
+                'Content-Disposition': f'attachment; filename="{filename}"'
+            })
+
+    @API.get('/api/fixed_items', middleware=[conditional('fixed_items')])
+    def get_fixed_items(self, query_params):
+        user_id = 1
+        items = query_db('SELECT * FROM fixed_items WHERE user_id = ?', (user_id,))
+
+        result = []
+        for item in items:
+            result.append({
+                "id": item['id'],
+                "amount": item['amount'],
+                "type": item['type'],
+                "category": item['category'],
+                "description": item['description'],
+                "source": item['source'],
+                "destination": item['destination'] if 'destination' in item.keys() else None,
+                "destination_category": item['destination_category'] if 'destination_category' in item.keys() else None,
+                "fund": item['fund'] if 'fund' in item.keys() else None
+            })
+
+        self._send_json(200, result)
+
+    @API.get('/api/settings', middleware=[conditional('settings')])
+    def get_settings(self, query_params):
+        rows = query_db('SELECT * FROM settings')
+        settings = {row['key']: row['value'] for row in rows}
+        self._send_json(200, settings)
+
+    @API.get('/api/investments', middleware=[conditional('investment_transactions')])
+    def get_investments(self, query_params):
+        user_id = 1
+        # Default sort by date desc
+        rows = query_db('SELECT * FROM investment_transactions WHERE user_id = ? ORDER BY date DESC', (user_id,))
+
+        result = []
+        for row in rows:
+            result.append({
+                "id": row['id'],
+                "date": row['date'],
+                "symbol": row['symbol'],
+                "asset_type": row['asset_type'] if 'asset_type' in row.keys() else 'stock',
+                "type": row['type'],
+                "quantity": row['quantity'],
+                "price": row['price'],
+                "fee": row['fee'],
+                "tax": row['tax'],
+                "notes": row['notes']
+            })
+
+        self._send_json(200, result)
+
+    @API.get('/api/investments/portfolio', middleware=[conditional('investment_transactions', 'exchange_rates', 'prices')])
+    def get_portfolio(self, query_params):
+        user_id = 1
+        currency = query_params.get('currency', ['VND'])[0]
+
+        portfolio = logic.calculate_portfolio(user_id, currency)
+        self._send_json(200, portfolio)
+
+    @API.get('/api/history', middleware=[conditional('transactions', 'investment_transactions', 'exchange_rates', 'prices')])
+    def get_history(self, query_params):
+        # Net worth over time; the last year by month unless asked otherwise
+        user_id = 1
+        end_date = query_params.get('end_date', [None])[0] or datetime.date.today().isoformat()
+        start_date = query_params.get('start_date', [None])[0]
+        if not start_date:
+            try:
+                start_date = (datetime.date.fromisoformat(end_date) - datetime.timedelta(days=365)).isoformat()
+            except ValueError:
+                start_date = end_date
+        interval = query_params.get('interval', ['month'])[0]
+        currency = query_params.get('currency', ['VND'])[0]
+        try:
+            result = logic.calculate_history(user_id, start_date, end_date, interval, currency)
+        except history.HistoryError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, result)
+
+    @API.get('/api/exchange_rates', middleware=[conditional('exchange_rates')])
+    def get_exchange_rates(self, query_params):
+        with connection() as conn:
+            self._send_json(200, {"items": rates.list_rates(conn)})
+
+    @API.get('/api/prices', middleware=[conditional('prices')])
+    def get_prices(self, query_params):
+        # Latest close on or before date (default today) of each requested symbol
+        symbols = [s.strip() for s in query_params.get('symbols', [''])[0].split(',') if s.strip()]
+        date = query_params.get('date', [None])[0] or datetime.date.today().isoformat()
+        try:
+            datetime.date.fromisoformat(date)
+        except ValueError:
+            self._send_json(400, {"error": "date must be YYYY-MM-DD"})
+            return
+        with connection() as conn:
+            closes = prices.latest(conn, symbols, date)
+        self._send_json(200, {"date": date, "prices": {symbol: {"date": d, "close": close}
+                                                       for symbol, (d, close) in closes.items()}})
+
+    @API.get('/api/debug/db_pool')
+    def get_debug_db_pool(self, query_params):
+        self._send_json(200, pool_stats())
+
+    @API.get('/api/debug/static')
+    def get_debug_static(self, query_params):
+        self._send_json(200, static.get_cache(WEB_ROOT).stats())
+
+    @API.get('/api/debug/compression')
+    def get_debug_compression(self, query_params):
+        self._send_json(200, compression.STATS.snapshot())
+
+    @API.get('/api/debug/result_cache')
+    def get_debug_result_cache(self, query_params):
+        self._send_json(200, logic.RESULT_CACHE.stats())
+
+    @API.get('/api/jobs')
+    def get_jobs(self, query_params):
+        user_id = 1
+        self._send_json(200, {"items": jobs.get_manager().list(user_id)})
+
+    @API.get('/api/jobs/<int:job_id>')
+    def get_job(self, query_params, job_id):
+        user_id = 1
+        job = jobs.get_manager().get(job_id, user_id)
+        if job is None:
+            self._send_json(404, {"error": "Job not found"})
+        else:
+            self._send_json(200, job)
+
+    @API.get('/api/jobs/<int:job_id>/artifact', batch=False)
+    def get_job_artifact(self, query_params, job_id):
+        user_id = 1
+        artifact = jobs.get_manager().artifact(job_id, user_id)
+        if artifact is None:
+            self._send_json(404, {"error": "No artifact for this job"})
+        else:
+            artifact_path, name, content_type = artifact
+            self._send_file(artifact_path, content_type, {
+                'Content-Disposition': f'attachment; filename="{name}"'
+            })
+
+    @API.get('/api/debug/profiles', profile=False)
+    def get_debug_profiles(self, query_params):
+        # Summaries of the kept profiles, newest first; see backend.profiling
+        self._send_json(200, dict(profiling.PROFILER.info(), items=profiling.PROFILER.list()))
+
+    @API.get('/api/debug/profiles/<int:profile_id>', batch=False, profile=False)
+    def get_debug_profile(self, query_params, profile_id):
+        # ?format=text|pstats|collapsed; text takes sort= (a pstats key) and limit=
+        found = profiling.PROFILER.get(profile_id)
+        if found is None:
+            self._send_json(404, {"error": "Profile not found"})
+            return
+        output_format = query_params.get('format', ['text'])[0]
+        try:
+            limit = int(query_params.get('limit', ['40'])[0])
+        except ValueError:
+            limit = None
+        try:
+            body, content_type = profiling.render(found, output_format, query_params.get('sort', ['cumulative'])[0], limit)
+        except profiling.ProfileError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        headers = None
+        if output_format == 'pstats':
+            headers = {'Content-Disposition': f'attachment; filename="profile-{profile_id}.pstats"'}
+        self._send(200, body, content_type, headers)
+
+    @API.get('/api/metrics', batch=False, profile=False)
+    def get_metrics(self, query_params):
+        # Prometheus text format; see backend.metrics
+        self._send(200, metrics.METRICS.render().encode(), metrics.CONTENT_TYPE)
+
+    # Uploads get the body as a RequestBody; do_POST drops the connection when they
+    # leave part of it unread
+    @UPLOADS.post('/api/import', when=lambda query_params: 'format' in query_params)
+    def handle_import_upload(self, query_params, body):
+        # POST /api/import?format=csv|json|ndjson[&dedupe=false] with the file as the body
+        import_format = query_params.get('format', [''])[0]
+        dedupe = query_params.get('dedupe', ['true'])[0].lower() not in ('0', 'false', 'no')
+        if import_format not in importer.PARSERS:
+            self._send_json(400, {"error": f"Unsupported import format: {import_format}"})
+            return
+        # utf-8-sig drops the byte order mark spreadsheet exports start with
+        stream = io.TextIOWrapper(io.BufferedReader(body), encoding='utf-8-sig', newline='')
+        self._run_import(importer.PARSERS[import_format](stream), dedupe)
+
+    @UPLOADS.post('/api/prices/import')
+    def handle_price_upload(self, query_params, body):
+        # POST /api/prices/import[?format=csv|json|ndjson] with symbol,date,close records as the body
+        import_format = query_params.get('format', ['csv'])[0]
+        if import_format not in importer.PARSERS:
+            self._send_json(400, {"error": f"Unsupported import format: {import_format}"})
+            return
+        stream = io.TextIOWrapper(io.BufferedReader(body), encoding='utf-8-sig', newline='')
+        try:
+            with connection() as conn:
+                summary = prices.load_records(conn, importer.PARSERS[import_format](stream))
+        except (importer.UploadError, UnicodeDecodeError) as e:
+            self._send_json(400, {"error": f"Import failed: {e}"})
+            return
+        self._send_json(200, dict(success=True, **summary))
+
+    @UPLOADS.post('/api/jobs/import')
+    def handle_job_upload(self, query_params, body):
+        # POST /api/jobs/import?format=csv|json|ndjson[&dedupe=false]: answers 202 with the job,
+        # the file spooled to disk and imported in the background
+        user_id = 1
+        import_format = query_params.get('format', [''])[0]
+        dedupe = query_params.get('dedupe', ['true'])[0].lower() not in ('0', 'false', 'no')
+        params = {"format": import_format, "dedupe": dedupe}
+        try:
+            jobs.validate('import', params)
+        except jobs.JobError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        manager = jobs.get_manager()
+        upload = manager.save_upload(body)
+        self._send_json(202, manager.submit('import', user_id, params, upload=upload))
+
+    def _send_file(self, path, content_type, headers=None):
+        # Sends a file from disk with a Content-Length; sendfile() copies it to the
+        # socket inside the kernel where the platform supports it
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._set_headers(200, content_type or 'application/octet-stream', size, headers)
+            self.connection.sendfile(f)
+            self.bytes_sent += size
+
+    def _send_static(self, path):
+        asset = static.get_cache(WEB_ROOT).lookup(path)
+        if asset is None:
+            self._send(404, b'Not Found', 'text/plain')
+            return
+
+        # Static files carry their own precompressed variant, so _send must not compress again
+        use_gzip = asset.gzip_body is not None and compression.accepts_gzip(self.headers.get('Accept-Encoding'))
+        etag = asset.gzip_etag if use_gzip else asset.etag
+        headers = {'ETag': etag, 'Last-Modified': asset.last_modified, 'Cache-Control': static.cache_control()}
+        if asset.gzip_body is not None:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if static.not_modified(self.headers, etag, asset):
+            # No body and no Content-Length: the client reuses its copy
+            self.send_response(304)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+        elif use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            self._send(200, asset.gzip_body, asset.content_type, headers, compress=False)
+        elif asset.body is not None:
+            self._send(200, asset.body, asset.content_type, headers, compress=False)
+        else:
+            self._send_file(asset.path, asset.content_type, headers)
+
+    def _run_import(self, records, dedupe=True):
+        # One transaction for the whole file: a fatal parse error imports nothing
+        user_id = 1
+        try:
+            with connection() as conn:
+                summary = importer.import_records(conn, user_id, records, dedupe=dedupe)
+        except (importer.UploadError, UnicodeDecodeError) as e:
+            self._send_json(400, {"error": f"Import failed: {e}"})
+            return
+        self._send_json(200, dict(success=True, **summary))
 
     def handle_api_post(self, path, data):
-        if path == '/api/auth/login':
-            username = data.get('username')
-            password = data.get('password')
-            
+        API.dispatch(self, 'POST', path, data)
+
+    @API.post('/api/auth/login')
+    def post_login(self, data):
+        username = data.get('username')
+        password = data.get('password')
+
+        pw_hash = hashlib.sha256(password.encode()).hexdigest()
+
+        user = query_db('SELECT * FROM users WHERE username = ? AND password_hash = ?', 
+                        (username, pw_hash), one=True)
+
+        if user:
+            self._send_json(200, {
+                "success": True, 
+                "user": {"username": user['username'], "role": user['role']}
+            })
+        else:
+            self._send_json(401, {"success": False, "error": "Invalid credentials"})
+
+    @API.post('/api/users/create')
+    def post_users_create(self, data):
+        username = data.get('username')
+        password = data.get('password')
+        role = data.get('role', 'user')
+
+        try:
             pw_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            user = query_db('SELECT * FROM users WHERE username = ? AND password_hash = ?', 
-                            (username, pw_hash), one=True)
-            
-            if user:
-                self._set_headers(200)
-                self.wfile.write(json.dumps({
-                    "success": True, 
-                    "user": {"username": user['username'], "role": user['role']}
-                }).encode())
-            else:
-                self._set_headers(401)
-                self.wfile.write(json.dumps({"success": False, "error": "Invalid credentials"}).encode())
-                
-        elif path == '/api/users/create':
-            username = data.get('username')
-            password = data.get('password')
-            role = data.get('role', 'user')
-            
-            try:
-                pw_hash = hashlib.sha256(password.encode()).hexdigest()
-                conn = get_db_connection()
+            with connection() as conn:
                 c = conn.cursor()
                 c.execute('INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
                           (username, pw_hash, role))
-                conn.commit()
-                conn.close()
-                self._set_headers(201)
-                self.wfile.write(json.dumps({"success": True}).encode())
-            except Exception as e: # Handle Sqlite error broadly if name unavailable
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": "User likely already exists"}).encode())
-
-        elif path == '/api/users/delete':
-            user_id = data.get('id')
-            if not user_id:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": "User ID required"}).encode())
-                return
-                
-            if user_id == 1: 
-                 self._set_headers(403)
-                 self.wfile.write(json.dumps({"error": "Cannot delete root admin"}).encode())
-                 return
+            self._send_json(201, {"success": True})
+        except Exception as e: # Handle Sqlite error broadly if name unavailable
+            self._send_json(400, {"error": "User likely already exists"})
+
+    @API.post('/api/users/delete')
+    def post_users_delete(self, data):
+        user_id = data.get('id')
+        if not user_id:
+            self._send_json(400, {"error": "User ID required"})
+            return
+
+        if user_id == 1: 
+             self._send_json(403, {"error": "Cannot delete root admin"})
+             return
 
-            conn = get_db_connection()
+        with connection() as conn:
             c = conn.cursor()
             c.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"success": True}).encode())
-        
-        elif path == '/api/transactions/create':
-            user_id = data.get('user_id', 1) 
-            amount = float(data.get('amount'))
-            trans_type = data.get('type')
-            category = data.get('category')
-            description = data.get('description', '')
-            date = data.get('date')
-            currency = data.get('currency', 'VND')
-            
-            source = data.get('source', 'cash')
-            destination = data.get('destination')
-            destination_category = data.get('destination_category')
-            fund = data.get('fund')
-            
-            conn = get_db_connection()
+
+        self._send_json(200, {"success": True})
+
+    @API.post('/api/transactions/create')
+    def post_transactions_create(self, data):
+        user_id = data.get('user_id', 1) 
+        amount = float(data.get('amount'))
+        trans_type = data.get('type')
+        category = data.get('category')
+        description = data.get('description', '')
+        date = data.get('date')
+        currency = data.get('currency', 'VND')
+
+        source = data.get('source', 'cash')
+        destination = data.get('destination')
+        destination_category = data.get('destination_category')
+        fund = data.get('fund')
+
+        with connection() as conn:
             c = conn.cursor()
             c.execute('''
                 INSERT INTO transactions (user_id, amount, currency, type, category, description, source, destination, destination_category, fund, date)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, amount, currency, trans_type, category, description, source, destination, destination_category, fund, date))
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(201)
-            self.wfile.write(json.dumps({"success": True}).encode())
-
-        elif path == '/api/transactions/update':
-            trans_id = data.get('id')
-            amount = float(data.get('amount'))
-            trans_type = data.get('type')
-            category = data.get('category')
-            description = data.get('description', '')
-            source = data.get('source', 'cash')
-            destination = data.get('destination')
-            destination_category = data.get('destination_category')
-            fund = data.get('fund')
-            date = data.get('date')
-            currency = data.get('currency', 'VND')
-            
-            conn = get_db_connection()
+
+        self._send_json(201, {"success": True})
+
+    @API.post('/api/transactions/update')
+    def post_transactions_update(self, data):
+        trans_id = data.get('id')
+        amount = float(data.get('amount'))
+        trans_type = data.get('type')
+        category = data.get('category')
+        description = data.get('description', '')
+        source = data.get('source', 'cash')
+        destination = data.get('destination')
+        destination_category = data.get('destination_category')
+        fund = data.get('fund')
+        date = data.get('date')
+        currency = data.get('currency', 'VND')
+
+        with connection() as conn:
             c = conn.cursor()
             c.execute('''
                 UPDATE transactions 
                 SET amount = ?, currency = ?, type = ?, category = ?, description = ?, source = ?, destination = ?, destination_category = ?, fund = ?, date = ?
                 WHERE id = ?
             ''', (amount, currency, trans_type, category, description, source, destination, destination_category, fund, date, trans_id))
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"success": True}).encode())
 
-        elif path == '/api/transactions/delete':
-            trans_id = data.get('id')
-            
-            conn = get_db_connection()
+        self._send_json(200, {"success": True})
+
+    @API.post('/api/transactions/delete')
+    def post_transactions_delete(self, data):
+        trans_id = data.get('id')
+
+        with connection() as conn:
             c = conn.cursor()
             c.execute('DELETE FROM transactions WHERE id = ?', (trans_id,))
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"success": True}).encode())
 
-        elif path == '/api/import':
-            import_format = data.get('format')
-            import_data = data.get('data')
-            
-            if not import_format or not import_data:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": "Missing format or data"}).encode())
-                return
+        self._send_json(200, {"success": True})
 
-            try:
-                conn = get_db_connection()
-                c = conn.cursor()
-                user_id = 1
-                
-                if import_format == 'json':
-                    transactions = import_data if isinstance(import_data, list) else json.loads(import_data)
-                    for t in transactions:
-                         c.execute('''
-                            INSERT INTO transactions (user_id, amount, type, category, description, source, fund, date)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (user_id, t.get('amount'), t.get('type'), t.get('category'), 
-                              t.get('description', ''), t.get('source', 'cash'), t.get('fund'), t.get('date')))
-                        
-                elif import_format == 'csv':
-                    import csv
-                    import io
-                    f = io.StringIO(import_data)
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        c.execute('''
-                            INSERT INTO transactions (user_id, amount, type, category, description, source, fund, date)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (user_id, row['amount'], row['type'], row['category'], 
-                              row['description'], row.get('source', 'cash'), row.get('fund'), row['date']))
-                
-                conn.commit()
-                conn.close()
-                self._set_headers(200)
-                self.wfile.write(json.dumps({"success": True}).encode())
-                
-            except Exception as e:
-                print(f"Import error: {e}")
-                self._set_headers(500)
-                self.wfile.write(json.dumps({"error": f"Import failed: {str(e)}"}).encode())
-
-        elif path == '/api/fixed_items/create':
-            user_id = data.get('user_id', 1)
-            amount = float(data.get('amount'))
-            item_type = data.get('type')
-            category = data.get('category')
-            description = data.get('description', '')
-            source = data.get('source', 'cash')
-            destination = data.get('destination')
-            destination_category = data.get('destination_category')
-            fund = data.get('fund')
-            
-            conn = get_db_connection()
+    # Bulk changes to many transactions in one transaction
+    @API.post('/api/transactions/bulk_delete', defaults={'operation': transactions.bulk_delete})
+    @API.post('/api/transactions/bulk_update', defaults={'operation': transactions.bulk_update})
+    @API.post('/api/transactions/bulk_recategorize', defaults={'operation': transactions.bulk_recategorize})
+    def post_transactions_bulk(self, data, operation):
+        # {"ids": [...]} or {"filter": {...}}, plus "patch" or "categories"; see transactions.py
+        user_id = 1
+        try:
+            with connection() as conn:
+                result = operation(conn, data, user_id)
+        except transactions.QueryError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, result)
+
+    @API.post('/api/import')
+    def post_import(self, data):
+        # Legacy body: {"format": "json"|"csv", "data": file text or a list of rows}.
+        # Raw uploads to /api/import?format= are handled by handle_import_upload.
+        import_format = data.get('format')
+        import_data = data.get('data')
+
+        if not import_format or not import_data:
+            self._send_json(400, {"error": "Missing format or data"})
+            return
+        if import_format not in importer.PARSERS:
+            self._send_json(400, {"error": f"Unsupported import format: {import_format}"})
+            return
+
+        if isinstance(import_data, list):
+            records = enumerate(import_data, 1)
+        else:
+            records = importer.PARSERS[import_format](io.StringIO(import_data, newline=''))
+        self._run_import(records, data.get('dedupe', True))
+
+    @API.post('/api/fixed_items/create')
+    def post_fixed_items_create(self, data):
+        user_id = data.get('user_id', 1)
+        amount = float(data.get('amount'))
+        item_type = data.get('type')
+        category = data.get('category')
+        description = data.get('description', '')
+        source = data.get('source', 'cash')
+        destination = data.get('destination')
+        destination_category = data.get('destination_category')
+        fund = data.get('fund')
+
+        with connection() as conn:
             c = conn.cursor()
             c.execute('''
                 INSERT INTO fixed_items (user_id, amount, type, category, description, source, destination, destination_category, fund)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, amount, item_type, category, description, source, destination, destination_category, fund))
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(201)
-            self.wfile.write(json.dumps({"success": True}).encode())
-
-        elif path == '/api/fixed_items/update':
-            item_id = data.get('id')
-            amount = float(data.get('amount'))
-            item_type = data.get('type')
-            category = data.get('category')
-            description = data.get('description', '')
-            source = data.get('source', 'cash')
-            destination = data.get('destination')
-            destination_category = data.get('destination_category')
-            fund = data.get('fund')
-            
-            conn = get_db_connection()
+
+        self._send_json(201, {"success": True})
+
+    @API.post('/api/fixed_items/update')
+    def post_fixed_items_update(self, data):
+        item_id = data.get('id')
+        amount = float(data.get('amount'))
+        item_type = data.get('type')
+        category = data.get('category')
+        description = data.get('description', '')
+        source = data.get('source', 'cash')
+        destination = data.get('destination')
+        destination_category = data.get('destination_category')
+        fund = data.get('fund')
+
+        with connection() as conn:
             c = conn.cursor()
             c.execute('''
                 UPDATE fixed_items 
                 SET amount = ?, type = ?, category = ?, description = ?, source = ?, destination = ?, destination_category = ?, fund = ?
                 WHERE id = ?
             ''', (amount, item_type, category, description, source, destination, destination_category, fund, item_id))
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"success": True}).encode())
 
-        elif path == '/api/fixed_items/delete':
-            item_id = data.get('id')
-            conn = get_db_connection()
+        self._send_json(200, {"success": True})
+
+    @API.post('/api/fixed_items/delete')
+    def post_fixed_items_delete(self, data):
+        item_id = data.get('id')
+        with connection() as conn:
             c = conn.cursor()
             c.execute('DELETE FROM fixed_items WHERE id = ?', (item_id,))
-            conn.commit()
-            conn.close()
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"success": True}).encode())
-
-        elif path == '/api/fixed_items/generate':
-            user_id = data.get('user_id', 1)
-            target_date = data.get('date')
-            
-            if not target_date:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": "Date is required"}).encode())
-                return
+        self._send_json(200, {"success": True})
 
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute('SELECT * FROM fixed_items WHERE user_id = ?', (user_id,))
-            items = c.fetchall()
-            
-            count = 0
-            for item in items:
-                c.execute('''
-                    INSERT INTO transactions (user_id, amount, type, category, description, source, destination, destination_category, fund, date)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, item['amount'], item['type'], item['category'], 
-                      item['description'], item['source'], 
-                      item['destination'] if 'destination' in item.keys() else None,
-                      item['destination_category'] if 'destination_category' in item.keys() else None,
-                      item['fund'] if 'fund' in item.keys() else None, target_date))
-                count += 1
-                
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(201)
-            self.wfile.write(json.dumps({"success": True, "count": count}).encode())
+    @API.post('/api/fixed_items/generate')
+    def post_fixed_items_generate(self, data):
+        # {"date"} for one month, or {"start_month", "end_month", "day"} for a range;
+        # months already generated are skipped
+        user_id = data.get('user_id', 1)
+        try:
+            periods = recurring.parse_request(data)
+        except recurring.RecurringError as e:
+            self._send_json(400, {"error": str(e)})
+            return
 
-        elif path == '/api/settings/update':
-            try:
-                conn = get_db_connection()
+        with connection() as conn:
+            count = logic.generate_fixed_transactions(conn, user_id, periods)
+
+        self._send_json(201, {"success": True, "count": count})
+
+    @API.post('/api/settings/update')
+    def post_settings_update(self, data):
+        try:
+            with connection() as conn:
                 c = conn.cursor()
                 for key, value in data.items():
                     c.execute('''
                         INSERT INTO settings (key, value) VALUES (?, ?)
                         ON CONFLICT(key) DO UPDATE SET value=excluded.value
                     ''', (key, str(value)))
-                conn.commit()
-                conn.close()
-                self._set_headers(200)
-                self.wfile.write(json.dumps({"success": True}).encode())
-            except Exception as e:
-                print(f"Settings update error: {e}")
-                self._set_headers(500)
-                self.wfile.write(json.dumps({"error": str(e)}).encode())
-
-        elif path == '/api/investments/create':
-            user_id = data.get('user_id', 1)
-            date = data.get('date')
-            symbol = data.get('symbol')
-            asset_type = data.get('asset_type', 'stock')
-            trans_type = data.get('type')
-            quantity = float(data.get('quantity', 0))
-            price = float(data.get('price', 0))
-            fee = float(data.get('fee', 0))
-            tax = float(data.get('tax', 0))
-            notes = data.get('notes', '')
-            
-            conn = get_db_connection()
+                    if key == 'exchange_rate_usd_vnd':
+                        # The settings rate is today's USD -> VND entry; earlier history keeps its rates
+                        rates.set_rate(conn, 'USD', 'VND', datetime.date.today().isoformat(), value)
+            self._send_json(200, {"success": True})
+        except rates.RateError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            print(f"Settings update error: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    @API.post('/api/exchange_rates/set')
+    def post_exchange_rates_set(self, data):
+        # {"base", "quote", "rate"[, "date"]}; the date defaults to today
+        try:
+            with connection() as conn:
+                rates.set_rate(conn, data.get('base'), data.get('quote'),
+                               data.get('date') or datetime.date.today().isoformat(), data.get('rate'))
+        except rates.RateError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, {"success": True})
+
+    @API.post('/api/exchange_rates/delete')
+    def post_exchange_rates_delete(self, data):
+        try:
+            with connection() as conn:
+                deleted = rates.delete_rate(conn, data.get('base'), data.get('quote'), data.get('date'))
+        except rates.RateError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, {"success": True, "deleted": deleted})
+
+    @API.post('/api/investments/create')
+    def post_investments_create(self, data):
+        user_id = data.get('user_id', 1)
+        date = data.get('date')
+        symbol = data.get('symbol')
+        asset_type = data.get('asset_type', 'stock')
+        trans_type = data.get('type')
+        quantity = float(data.get('quantity', 0))
+        price = float(data.get('price', 0))
+        fee = float(data.get('fee', 0))
+        tax = float(data.get('tax', 0))
+        notes = data.get('notes', '')
+
+        with connection() as conn:
             c = conn.cursor()
             c.execute('''
                 INSERT INTO investment_transactions (user_id, date, symbol, asset_type, type, quantity, price, fee, tax, notes)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, date, symbol, asset_type, trans_type, quantity, price, fee, tax, notes))
-            conn.commit()
-            conn.close()
-            
-            self._set_headers(201)
-            self.wfile.write(json.dumps({"success": True}).encode())
 
-        elif path == '/api/investments/delete':
-            trans_id = data.get('id')
-            conn = get_db_connection()
+        self._send_json(201, {"success": True})
+
+    @API.post('/api/investments/delete')
+    def post_investments_delete(self, data):
+        trans_id = data.get('id')
+        with connection() as conn:
             c = conn.cursor()
             c.execute('DELETE FROM investment_transactions WHERE id = ?', (trans_id,))
-            conn.commit()
-            conn.close()
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"success": True}).encode())
+        self._send_json(200, {"success": True})
+
+    @API.post('/api/investments/bulk_delete')
+    def post_investments_bulk_delete(self, data):
+        user_id = 1
+        try:
+            ids = transactions.parse_ids(data.get('ids'))
+        except transactions.QueryError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        with connection() as conn:
+            cur = conn.executemany('DELETE FROM investment_transactions WHERE id = ? AND user_id = ?',
+                                   [(trans_id, user_id) for trans_id in ids])
+        self._send_json(200, {"matched": len(ids), "deleted": cur.rowcount})
 
+    @API.post('/api/jobs')
+    def post_jobs(self, data):
+        # {"kind": "export"|"generate_fixed"|"rebuild", "params": {...}}; imports
+        # upload their file to /api/jobs/import instead
+        user_id = 1
+        kind = data.get('kind')
+        if kind == 'import':
+            self._send_json(400, {"error": "Upload imports to /api/jobs/import"})
+            return
+        try:
+            job = jobs.get_manager().submit(kind, user_id, data.get('params') or {})
+        except jobs.JobError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(202, job)
+
+    @API.post('/api/jobs/<int:job_id>/cancel')
+    def post_job_cancel(self, data, job_id):
+        user_id = 1
+        job = jobs.get_manager().cancel(job_id, user_id)
+        if job is None:
+            self._send_json(404, {"error": "Job not found"})
+        elif job['status'] in ('succeeded', 'failed'):
+            self._send_json(409, {"error": "Job already finished", "job": job})
         else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Endpoint not found"}).encode())
+            # Still "running" until the job reaches its next cancellation check
+            self._send_json(202, job)
+
+    @API.post('/api/batch', batch=False)
+    def handle_batch(self, data):
+        # POST /api/batch with {"requests": [{"method": "GET"|"POST", "path", "body"?, "if_none_match"?}]}
+        # answers {"results": [{"status", "etag", "body"}]} in the same order. Writes run
+        # one by one on a shared connection, each committed (or rolled back when it
+        # fails) before the next sub-request, so later reads see it.
+        subrequests = data.get('requests') if isinstance(data, dict) else None
+        error = check_batch(subrequests)
+        if error:
+            self._send_json(400, {"error": error})
+            return
+
+        results = []
+        for concurrent, group in batch_groups(subrequests):
+            if concurrent:
+                results.extend(batch_executor().map(self._run_subrequest, group))
+                continue
+            with shared_connection() as conn:
+                for sub in group:
+                    result = self._run_subrequest(sub)
+                    if result[0] < 400:
+                        conn.commit()
+                    else:
+                        conn.rollback()
+                    results.append(result)
+
+        # Sub-responses are already JSON; they are spliced in rather than decoded again
+        entries = [b'{"status": %d, "etag": %s, "body": %s}' % (status, json.dumps(etag).encode(), body or b'null')
+                   for status, etag, body in results]
+        self._send(200, b'{"results": [' + b', '.join(entries) + b']}')
+
+    def _run_subrequest(self, sub):
+        # (status, etag, JSON body or None) of one sub-request, run through the regular handlers
+        parsed = urlparse(sub['path'])
+        handler = BatchedRequest(sub.get('if_none_match'))
+        try:
+            if sub['method'] == 'GET':
+                handler.handle_api_get(parsed.path, parse_qs(parsed.query))
+            else:
+                handler.handle_api_post(parsed.path, sub.get('body') or {})
+        except Exception as e:
+            print(f"Batch Error: {e}")
+            return 500, None, json.dumps({"error": str(e)}).encode()
+        if handler.response_status != 304 and not handler.response_headers.get('Content-type', '').startswith('application/json'):
+            return 500, None, json.dumps({"error": f"{parsed.path} cannot be batched"}).encode()
+        return handler.response_status, handler.response_headers.get('ETag'), handler.wfile.getvalue() or None
+
+class BatchedRequest(ParFinHandler):
+    # One /api/batch sub-request: the response is captured in memory instead of
+    # written to the socket. Sub-responses are never gzipped; the batch as a whole is.
+    def __init__(self, if_none_match=None):
+        self.headers = {'If-None-Match': if_none_match} if if_none_match else {}
+        self.wfile = io.BytesIO()
+        self.request_version = 'HTTP/1.1'
+        self.close_connection = False
+        self.response_etag = None
+        self.response_status = None
+        self.response_headers = {}
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+
+    def send_header(self, keyword, value):
+        self.response_headers[keyword] = value
+
+    def end_headers(self):
+        pass
+
+    def _negotiate_gzip(self, content_type, headers, size=None):
+        return False, headers
+
+def check_batch(subrequests):
+    # Error message for a malformed /api/batch request, or None
+    if not isinstance(subrequests, list) or not subrequests:
+        return "requests must be a non-empty list"
+    if len(subrequests) > BATCH_MAX_REQUESTS:
+        return f"At most {BATCH_MAX_REQUESTS} requests per batch"
+    for i, sub in enumerate(subrequests):
+        if not isinstance(sub, dict) or sub.get('method') not in ('GET', 'POST'):
+            return f"requests[{i}]: method must be GET or POST"
+        path = sub.get('path')
+        if not isinstance(path, str) or not path.startswith('/api/'):
+            return f"requests[{i}]: path must start with /api/"
+        route, _ = API.match(sub['method'], urlparse(path).path)
+        if route is not None and not route.options.get('batch', True):
+            return f"requests[{i}]: {urlparse(path).path} cannot be batched"
+        if not isinstance(sub.get('body') or {}, dict):
+            return f"requests[{i}]: body must be an object"
+    return None
+
+def batch_groups(subrequests, workers=BATCH_WORKERS):
+    # Splits the sub-requests, in order, into (concurrent, [sub-requests]) runs. Two
+    # or more reads in a row run concurrently, each on its own pooled connection;
+    # writes, and single reads between them, run one by one on a shared connection.
+    groups = []
+    for method, run in itertools.groupby(subrequests, key=lambda sub: sub['method']):
+        run = list(run)
+        concurrent = method == 'GET' and len(run) > 1 and workers > 1
+        if not concurrent and groups and not groups[-1][0]:
+            groups[-1][1].extend(run)
+        else:
+            groups.append((concurrent, run))
+    return groups
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def batch_executor():
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='parfin-batch')
+    return _batch_executor
 
 class ReusableTCPServer(socketserver.TCPServer):
     allow_reuse_address = True
 
-def run_server():
+class PooledTCPServer(ReusableTCPServer):
+    """Serves connections from a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue; when it is full the client
+    gets an immediate 503 instead of piling up behind slow requests.
+    """
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, server_address, handler_class, workers=WORKER_THREADS, queue_size=REQUEST_QUEUE_SIZE):
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        super().__init__(server_address, handler_class)
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker_loop, name=f'parfin-worker-{i}', daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            self._reject(request)
+
+    def _worker_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def _reject(self, request):
+        body = json.dumps({"error": "Server busy"}).encode()
+        try:
+            request.sendall(
+                b'HTTP/1.1 503 Service Unavailable\r\n'
+                b'Content-Type: application/json\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                b'Retry-After: 1\r\n'
+                b'Connection: close\r\n\r\n' + body
+            )
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # Drop connections nobody has picked up yet, then stop the workers
+        while True:
+            try:
+                request, _ = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            self.shutdown_request(request)
+        for _ in self.workers:
+            self.pending.put(None)
+
+def run_server(threaded=True, workers=WORKER_THREADS, queue_size=REQUEST_QUEUE_SIZE):
     init_db()
-    with ReusableTCPServer(("", PORT), ParFinHandler) as httpd:
-        print(f"ParFin serving at port {PORT}")
-        httpd.serve_forever()
+    # Resumes jobs left queued by the previous run
+    jobs.get_manager()
+    # Reads the web root into memory before the first page load
+    static.get_cache(WEB_ROOT)
+    if threaded:
+        httpd = PooledTCPServer(("", PORT), ParFinHandler, workers=workers, queue_size=queue_size)
+    else:
+        httpd = ReusableTCPServer(("", PORT), ParFinHandler)
+    with httpd:
+        mode = f"{workers} workers" if threaded else "single-threaded"
+        print(f"ParFin serving at port {PORT} ({mode})")
+        # Generates the current month at once, then at each month's start
+        scheduler = jobs.FixedItemScheduler() if jobs.FIXED_ITEMS_SCHEDULER else None
+        if scheduler:
+            scheduler.start()
+        try:
+            httpd.serve_forever()
+        finally:
+            if scheduler:
+                scheduler.stop(timeout=5)
+            jobs.shutdown()
@@ -0,0 +1,159 @@
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import stat
+import threading
+
+# Static asset cache.
+#
+# Every file under the web root is read into memory once, with a strong ETag (a
+# digest of the content) and, for text assets, a gzip variant compressed up front.
+# Requests are then answered from memory, or with a bodiless 304 when the client's
+# If-None-Match / If-Modified-Since still matches.
+#
+# Files larger than STATIC_CACHE_MAX_FILE keep only their metadata; they are
+# re-checked on each request and sent with sendfile(). With PARFIN_STATIC_WATCH
+# set (for development) every lookup stats its file, so edits, new files and
+# deletions show up without a restart.
+
+STATIC_CACHE_MAX_FILE = int(os.environ.get('PARFIN_STATIC_CACHE_MAX_FILE', 1024 * 1024))
+STATIC_WATCH = os.environ.get('PARFIN_STATIC_WATCH', '').lower() in ('1', 'true', 'yes')
+# 0 means "no-cache": browsers keep the file but revalidate it on every use
+STATIC_MAX_AGE = int(os.environ.get('PARFIN_STATIC_MAX_AGE', 0))
+
+# Smaller files are not worth the gzip header and the extra Vary entry
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 9
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+class Asset:
+    """One file under the web root, with its headers and, when small enough, its body."""
+
+    def __init__(self, path, max_file=STATIC_CACHE_MAX_FILE):
+        st = os.stat(path)
+        self.path = path
+        self.mtime = st.st_mtime_ns
+        self.size = st.st_size
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+        self.content_type = content_type + '; charset=utf-8' if compressible and content_type != 'image/svg+xml' else content_type
+
+        self.body = None
+        self.gzip_body = None
+        self.gzip_etag = None
+        if self.size > max_file:
+            # Served from disk; size and mtime identify the version
+            self.etag = f'"{self.size:x}-{self.mtime:x}"'
+            return
+
+        with open(path, 'rb') as f:
+            self.body = f.read()
+        digest = hashlib.sha1(self.body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        if compressible and len(self.body) >= GZIP_MIN_SIZE:
+            # mtime=0 keeps the compressed bytes identical across restarts
+            compressed = gzip.compress(self.body, GZIP_LEVEL, mtime=0)
+            if len(compressed) < len(self.body):
+                self.gzip_body = compressed
+                self.gzip_etag = f'"{digest}-gz"'
+
+class StaticCache:
+    def __init__(self, root, max_file=STATIC_CACHE_MAX_FILE, watch=STATIC_WATCH):
+        self.source = root
+        self.root = os.path.realpath(root)
+        self.max_file = max_file
+        self.watch = watch
+        self._lock = threading.Lock()
+        self._assets = {}
+        self.load()
+
+    def load(self):
+        assets = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                url_path = '/' + os.path.relpath(path, self.root).replace(os.sep, '/')
+                assets[url_path] = Asset(path, self.max_file)
+        with self._lock:
+            self._assets = assets
+
+    def lookup(self, url_path):
+        # Returns the Asset for a URL path, or None
+        url_path = posixpath.normpath('/' + url_path.lstrip('/'))
+        asset = self._assets.get(url_path)
+        if self.watch or (asset is not None and asset.body is None):
+            asset = self._revalidate(url_path, asset)
+        return asset
+
+    def _revalidate(self, url_path, asset):
+        path = asset.path if asset else self._resolve(url_path)
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            if asset is not None:
+                with self._lock:
+                    self._assets.pop(url_path, None)
+            return None
+        if asset is not None and (st.st_mtime_ns, st.st_size) == (asset.mtime, asset.size):
+            return asset
+        asset = Asset(path, self.max_file)
+        with self._lock:
+            self._assets[url_path] = asset
+        return asset
+
+    def _resolve(self, url_path):
+        # A file added since load(); it must stay inside the web root
+        path = os.path.realpath(os.path.join(self.root, url_path.lstrip('/')))
+        return path if path.startswith(self.root + os.sep) else None
+
+    def stats(self):
+        with self._lock:
+            assets = list(self._assets.values())
+        return {
+            "files": len(assets),
+            "cached_bytes": sum(len(a.body) for a in assets if a.body is not None),
+            "gzip_bytes": sum(len(a.gzip_body) for a in assets if a.gzip_body is not None),
+            "uncached_files": sum(1 for a in assets if a.body is None),
+        }
+
+def cache_control():
+    return f'public, max-age={STATIC_MAX_AGE}' if STATIC_MAX_AGE > 0 else 'no-cache'
+
+def etag_matches(if_none_match, etag):
+    # GET uses the weak comparison, so W/ prefixes on either side are ignored
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+def not_modified(request_headers, etag, asset):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one-second resolution
+        return asset.mtime // 1_000_000_000 <= since
+    return False
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache(root):
+    global _cache
+    if _cache is None or _cache.source != root:
+        with _cache_lock:
+            if _cache is None or _cache.source != root:
+                _cache = StaticCache(root)
+    return _cache
@@ -0,0 +1,350 @@
+import base64
+import datetime
+import json
+import math
+import backend.logic as logic
+from backend import importer
+from backend import search
+
+# Query building for the transaction list endpoints.
+#
+# build_filters() turns the /api/transactions query parameters into a WHERE clause
+# so other endpoints (export, bulk operations) accept exactly the same filters.
+# list_page() adds keyset pagination: the cursor carries the last row's sort value
+# and id, so each page is an index range scan instead of an OFFSET skip.
+# search_page() ranks full-text matches (see backend.search) under the same filters.
+
+# Columns a client may ask for with fields=, in response order
+TRANSACTION_FIELDS = ['id', 'amount', 'type', 'category', 'description', 'date', 'currency',
+                      'source', 'destination', 'destination_category', 'fund']
+
+# Whitelist sort columns to prevent injection
+SORT_COLUMNS = ['date', 'amount', 'category', 'type']
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+class QueryError(ValueError):
+    # Bad client input; the handler answers 400
+    pass
+
+def _param(query_params, name, default=None):
+    return query_params.get(name, [default])[0]
+
+def build_filters(query_params, user_id):
+    # Returns (where_sql, args) for the date range / category / type filters
+    period = _param(query_params, 'period', '')
+    start_date_param = _param(query_params, 'start_date')
+    end_date_param = _param(query_params, 'end_date')
+
+    if period:
+        start_date, end_date = logic.calculate_date_range(period, start_date_param, end_date_param)
+    else:
+        # Fallback if no period but explicit dates
+        start_date = start_date_param
+        end_date = end_date_param
+
+    category = _param(query_params, 'category')
+    trans_type = _param(query_params, 'type')
+
+    where = "user_id = ?"
+    args = [user_id]
+
+    if start_date:
+        where += " AND date >= ?"
+        args.append(start_date)
+    if end_date:
+        where += " AND date <= ?"
+        args.append(end_date)
+    if category and category != 'all':
+        where += " AND category = ?"
+        args.append(category)
+    if trans_type and trans_type != 'all':
+        where += " AND type = ?"
+        args.append(trans_type)
+
+    return where, args
+
+def parse_sort(query_params):
+    sort_by = _param(query_params, 'sort_by', 'date')
+    order = _param(query_params, 'order', 'desc')
+    if sort_by not in SORT_COLUMNS:
+        sort_by = 'date'
+    if order not in ('asc', 'desc'):
+        order = 'desc'
+    return sort_by, order
+
+def parse_fields(query_params):
+    fields = _param(query_params, 'fields')
+    if not fields:
+        return list(TRANSACTION_FIELDS)
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in TRANSACTION_FIELDS]
+    if unknown:
+        raise QueryError(f"Unknown fields: {', '.join(unknown)}")
+    # Keep the canonical column order so responses are stable
+    return [f for f in TRANSACTION_FIELDS if f in requested]
+
+def parse_limit(query_params):
+    try:
+        limit = int(_param(query_params, 'limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise QueryError("limit must be an integer")
+    if limit < 1:
+        raise QueryError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+def encode_cursor(sort_by, order, value, row_id):
+    raw = json.dumps([sort_by, order, value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_by, order):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_order, value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise QueryError("Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort_by, order) or not isinstance(row_id, int):
+        raise QueryError("Cursor does not match the requested sort order")
+    return value, row_id
+
+def list_rows(conn, query_params, user_id, fields=None):
+    # Unpaginated list, in the requested sort order
+    fields = fields or parse_fields(query_params)
+    where, args = build_filters(query_params, user_id)
+    sort_by, order = parse_sort(query_params)
+    sql = f"SELECT {', '.join(fields)} FROM transactions WHERE {where} ORDER BY {sort_by} {order.upper()}, id {order.upper()}"
+    return fields, conn.execute(sql, args)
+
+def list_page(conn, query_params, user_id):
+    # Returns {"items", "next_cursor"[, "total_count"]}
+    fields = parse_fields(query_params)
+    sort_by, order = parse_sort(query_params)
+    limit = parse_limit(query_params)
+
+    where, args = build_filters(query_params, user_id)
+    filter_args = list(args)
+
+    cursor = _param(query_params, 'cursor')
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort_by, order)
+        # Row-value comparison continues right after the last row of the previous page
+        where += f" AND ({sort_by}, id) {'<' if order == 'desc' else '>'} (?, ?)"
+        args += [value, row_id]
+
+    # The sort column and id are always read so the next cursor can be built
+    columns = list(fields)
+    for extra in (sort_by, 'id'):
+        if extra not in columns:
+            columns.append(extra)
+
+    sql = (f"SELECT {', '.join(columns)} FROM transactions WHERE {where} "
+           f"ORDER BY {sort_by} {order.upper()}, id {order.upper()} LIMIT ?")
+    rows = conn.execute(sql, args + [limit + 1]).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    sort_index = columns.index(sort_by)
+    id_index = columns.index('id')
+    n = len(fields)
+
+    result = {
+        "items": [dict(zip(fields, row[:n])) for row in rows],
+        "next_cursor": encode_cursor(sort_by, order, rows[-1][sort_index], rows[-1][id_index]) if has_more else None
+    }
+
+    if _param(query_params, 'include_total', '').lower() in ('1', 'true', 'yes'):
+        result["total_count"] = conn.execute(
+            f"SELECT COUNT(*) FROM transactions WHERE {build_filters(query_params, user_id)[0]}", filter_args
+        ).fetchone()[0]
+
+    return result
+
+def search_page(conn, query_params, user_id):
+    # Transactions matching q, best first, under the list filters:
+    # {"items", "next_cursor"[, "total_count"]}. Items carry an HTML "snippet" of the
+    # description besides the requested fields. The cursor holds the last row's
+    # rank, so pages follow on exactly unless the data changes between them.
+    try:
+        expression = search.match_expression(_param(query_params, 'q'))
+    except search.SearchError as e:
+        raise QueryError(str(e))
+    fields = parse_fields(query_params)
+    limit = parse_limit(query_params)
+    where, args = build_filters(query_params, user_id)
+    # Matching in a CTE keeps the filters' column names, which the index shares,
+    # unambiguous
+    filter_args = [expression] + args
+
+    page_where, page_args = where, list(filter_args)
+    cursor = _param(query_params, 'cursor')
+    if cursor:
+        value, row_id = decode_cursor(cursor, 'rank', 'asc')
+        page_where += " AND (score, id) > (?, ?)"
+        page_args += [value, row_id]
+
+    columns = fields + ['id'] if 'id' not in fields else list(fields)
+    sql = (f"{search.hits()} SELECT {', '.join(columns)}, score FROM hits JOIN transactions ON id = hit_id "
+           f"WHERE {page_where} ORDER BY score, id LIMIT ?")
+    rows = conn.execute(sql, page_args + [limit + 1]).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    id_index = columns.index('id')
+    marked = search.snippets(conn, expression, [row[id_index] for row in rows])
+    n = len(fields)
+    result = {
+        "items": [dict(zip(fields, row[:n]), snippet=marked.get(row[id_index], '')) for row in rows],
+        "next_cursor": encode_cursor('rank', 'asc', rows[-1]['score'], rows[-1][id_index]) if has_more else None
+    }
+
+    if _param(query_params, 'include_total', '').lower() in ('1', 'true', 'yes'):
+        result["total_count"] = conn.execute(
+            f"{search.hits(ranked=False)} SELECT COUNT(*) FROM hits JOIN transactions ON id = hit_id WHERE {where}", filter_args
+        ).fetchone()[0]
+
+    return result
+
+# Bulk operations.
+#
+# A bulk request selects the user's transactions either by {"ids": [...]} or by
+# {"filter": {...}} with the /api/transactions filter parameters, and runs its
+# statements with executemany inside the caller's transaction, so a request
+# changes everything or nothing. The balance, rollup and version triggers fire
+# per row, so derived state stays consistent exactly as with the single-row
+# endpoints.
+
+FILTER_PARAMS = ('period', 'start_date', 'end_date', 'category', 'type')
+
+def _amount(value):
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        raise QueryError("amount must be a number")
+    if not math.isfinite(amount) or amount <= 0:
+        raise QueryError("amount must be positive")
+    return amount
+
+def _choice(name, choices):
+    def check(value):
+        if value not in choices:
+            raise QueryError(f"{name} must be one of {', '.join(choices)}")
+        return value
+    return check
+
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise QueryError("date must be YYYY-MM-DD")
+
+def _currency(value):
+    if not (isinstance(value, str) and len(value) == 3 and value.isalpha()):
+        raise QueryError("currency must be a 3-letter code")
+    return value.upper()
+
+def _text(name, required=False):
+    def check(value):
+        if not isinstance(value, str) or (required and not value.strip()):
+            raise QueryError(f"{name} must be {'a non-empty' if required else 'a'} string")
+        return value.strip()
+    return check
+
+# Columns a bulk update may set: name -> (validator, nullable)
+PATCH_FIELDS = {
+    'amount': (_amount, False),
+    'type': (_choice('type', importer.TYPES), False),
+    'category': (_text('category', required=True), False),
+    'description': (_text('description'), False),
+    'date': (_date, False),
+    'currency': (_currency, False),
+    'source': (_choice('source', importer.SOURCES), False),
+    'destination': (_choice('destination', importer.SOURCES), True),
+    'destination_category': (_text('destination_category'), True),
+    'fund': (_text('fund'), True),
+}
+
+def parse_ids(ids):
+    if not isinstance(ids, list) or not ids or not all(type(i) is int for i in ids):
+        raise QueryError("ids must be a non-empty list of integers")
+    return sorted(set(ids))
+
+def _filter_params(filters, exclude=()):
+    allowed = [p for p in FILTER_PARAMS if p not in exclude]
+    if not isinstance(filters, dict) or not filters:
+        raise QueryError("filter must be a non-empty object")
+    unknown = [k for k in filters if k not in allowed]
+    if unknown:
+        raise QueryError(f"Unknown filter parameters: {', '.join(unknown)}")
+    return {k: [str(v)] for k, v in filters.items() if v is not None}
+
+def select_ids(conn, data, user_id):
+    # The ids selected by the request body's "ids" or "filter", whichever is given
+    if ('ids' in data) == ('filter' in data):
+        raise QueryError("Give exactly one of ids or filter")
+    if 'ids' in data:
+        return parse_ids(data['ids'])
+    where, args = build_filters(_filter_params(data['filter']), user_id)
+    return [row[0] for row in conn.execute(f"SELECT id FROM transactions WHERE {where}", args)]
+
+def parse_patch(patch):
+    # [(column, value)] in TRANSACTION_FIELDS order
+    if not isinstance(patch, dict) or not patch:
+        raise QueryError("patch must be a non-empty object")
+    unknown = [k for k in patch if k not in PATCH_FIELDS]
+    if unknown:
+        raise QueryError(f"Fields cannot be patched: {', '.join(unknown)}")
+    changes = []
+    for column in TRANSACTION_FIELDS:
+        if column not in patch:
+            continue
+        check, nullable = PATCH_FIELDS[column]
+        value = patch[column]
+        changes.append((column, None if value is None and nullable else check(value)))
+    return changes
+
+def bulk_delete(conn, data, user_id):
+    # {"matched", "deleted"}; ids belonging to another user or already gone are skipped
+    ids = select_ids(conn, data, user_id)
+    cur = conn.executemany('DELETE FROM transactions WHERE id = ? AND user_id = ?',
+                           [(row_id, user_id) for row_id in ids])
+    return {"matched": len(ids), "deleted": cur.rowcount}
+
+def bulk_update(conn, data, user_id):
+    # Applies data["patch"] to every selected row: {"matched", "updated"}
+    changes = parse_patch(data.get('patch'))
+    ids = select_ids(conn, data, user_id)
+    assignments = ', '.join(f"{column} = ?" for column, _ in changes)
+    values = [value for _, value in changes]
+    cur = conn.executemany(f'UPDATE transactions SET {assignments} WHERE id = ? AND user_id = ?',
+                           [(*values, row_id, user_id) for row_id in ids])
+    return {"matched": len(ids), "updated": cur.rowcount}
+
+def bulk_recategorize(conn, data, user_id):
+    # Renames categories: data["categories"] maps old names to new ones, optionally
+    # only within data["filter"] (dates and type).
+    # Returns {"updated", "categories": {old name: rows renamed}}
+    categories = data.get('categories')
+    if not isinstance(categories, dict) or not categories:
+        raise QueryError("categories must be a non-empty object of old: new names")
+    check = _text('category', required=True)
+    renames = [(check(old), check(new)) for old, new in categories.items()]
+    renames = [(old, new) for old, new in renames if old != new]
+    if {new for _, new in renames} & {old for old, _ in renames}:
+        # Rows would be renamed twice, depending on the order of the statements
+        raise QueryError("A category cannot be both renamed and a rename target")
+    params = _filter_params(data['filter'], exclude=('category',)) if 'filter' in data else {}
+    where, args = build_filters(params, user_id)
+
+    result = {"updated": 0, "categories": {old: 0 for old, _ in renames}}
+    if not renames:
+        return result
+    # executemany only reports the total, so count per category first
+    result["categories"].update(conn.execute(
+        f"SELECT category, COUNT(*) FROM transactions WHERE {where} "
+        f"AND category IN (SELECT value FROM json_each(?)) GROUP BY category",
+        args + [json.dumps([old for old, _ in renames])]))
+    cur = conn.executemany(f"UPDATE transactions SET category = ? WHERE {where} AND category = ?",
+                           [(new, *args, old) for old, new in renames])
+    result["updated"] = cur.rowcount
+    return result
@@ -0,0 +1,73 @@
+import datetime
+import hashlib
+
+# Data versions.
+#
+# data_versions holds a counter per (user, table) that triggers bump on every
+# insert, update and delete, so any write path (API, import, jobs, scripts) moves
+# it inside the same transaction. Tables without a user_id (settings) count under
+# user 0. A GET handler reads the counters its response depends on, one small
+# indexed query, and derives an ETag from them; a client that still holds that
+# ETag gets a 304 without the ledger being read.
+#
+# Functions here never commit: the caller owns the transaction.
+
+GLOBAL_USER = 0
+
+# table: SQL expression for the owning user of {row}
+VERSIONED_TABLES = {
+    'transactions': '{row}.user_id',
+    'fixed_items': '{row}.user_id',
+    'investment_transactions': '{row}.user_id',
+    'settings': str(GLOBAL_USER),
+    'exchange_rates': str(GLOBAL_USER),
+    'prices': str(GLOBAL_USER),
+}
+
+def _bump(table, owner):
+    return f"""
+        INSERT INTO data_versions (user_id, table_name, version) VALUES ({owner}, '{table}', 1)
+        ON CONFLICT (user_id, table_name) DO UPDATE SET version = version + 1;
+    """
+
+def create_schema(c, tables):
+    # tables: the VERSIONED_TABLES that exist at this point of the migration history
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER NOT NULL, -- 0 for tables shared by all users
+            table_name TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, table_name)
+        ) WITHOUT ROWID
+    ''')
+    for table in tables:
+        create_triggers(c, table)
+
+def create_triggers(c, table):
+    owner = VERSIONED_TABLES[table]
+    new, old = owner.format(row='NEW'), owner.format(row='OLD')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_insert AFTER INSERT ON {table}
+        BEGIN {_bump(table, new)} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_delete AFTER DELETE ON {table}
+        BEGIN {_bump(table, old)} END''')
+    # A row moved to another user changes both users' data
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update AFTER UPDATE ON {table}
+        BEGIN {_bump(table, new)} {_bump(table, old) if new != old else ''} END''')
+
+def _owner(table, user_id):
+    return GLOBAL_USER if VERSIONED_TABLES[table] == str(GLOBAL_USER) else user_id
+
+def get_versions(conn, user_id, tables):
+    # {table: version}; tables never written to are at 0
+    rows = conn.execute('SELECT user_id, table_name, version FROM data_versions WHERE user_id IN (?, ?)',
+                        (user_id, GLOBAL_USER)).fetchall()
+    stored = {(row[0], row[1]): row[2] for row in rows}
+    return {table: stored.get((_owner(table, user_id), table), 0) for table in tables}
+
+def etag(conn, user_id, tables, path, query_params):
+    # Weak ETag: the same data may be sent gzipped or not. Today's date is part of
+    # the key because periods such as this_month resolve against it.
+    versions = get_versions(conn, user_id, tables)
+    key = repr((path, sorted(query_params.items()), user_id, sorted(versions.items()),
+                datetime.date.today().isoformat()))
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
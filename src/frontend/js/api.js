@@ -1,4 +1,89 @@
+// Last response per URL for the conditional GETs below: { etag, data }
+const conditionalCache = new Map();
+const CONDITIONAL_CACHE_SIZE = 100;
+
+// Requests queued by Api.request() in the current tick; sent together to /api/batch
+let pendingBatch = null;
+const BATCH_MAX_REQUESTS = 50;
+
+async function sendOne({ method, path, body, ifNoneMatch }) {
+	const headers = ifNoneMatch ? { 'If-None-Match': ifNoneMatch } : {};
+	const init = { method, headers, cache: 'no-store' };
+	if (method === 'POST') {
+		headers['Content-Type'] = 'application/json';
+		init.body = JSON.stringify(body || {});
+	}
+	const response = await fetch(path, init);
+	const text = response.status === 304 ? '' : await response.text();
+	return { status: response.status, etag: response.headers.get('ETag'), body: text ? JSON.parse(text) : null };
+}
+
+async function flushBatch() {
+	const queued = pendingBatch;
+	pendingBatch = null;
+	for (let i = 0; i < queued.length; i += BATCH_MAX_REQUESTS) {
+		const chunk = queued.slice(i, i + BATCH_MAX_REQUESTS);
+		try {
+			let results;
+			if (chunk.length === 1) {
+				// Nothing to coalesce: a plain request skips the batch envelope
+				results = [await sendOne(chunk[0].request)];
+			} else {
+				const response = await fetch('/api/batch', {
+					method: 'POST',
+					headers: { 'Content-Type': 'application/json' },
+					body: JSON.stringify({
+						requests: chunk.map(({ request }) => ({
+							method: request.method,
+							path: request.path,
+							body: request.body,
+							if_none_match: request.ifNoneMatch
+						}))
+					})
+				});
+				if (!response.ok) throw new Error('Batch request failed');
+				results = (await response.json()).results;
+			}
+			chunk.forEach(({ resolve }, j) => resolve(results[j]));
+		} catch (err) {
+			chunk.forEach(({ reject }) => reject(err));
+		}
+	}
+}
+
 export const Api = {
+	// Queues a request to be sent with every other one made in the same tick, as
+	// one /api/batch call. Resolves to { status, etag, body } with the body parsed.
+	request(method, path, { body, ifNoneMatch } = {}) {
+		if (!pendingBatch) {
+			pendingBatch = [];
+			queueMicrotask(flushBatch);
+		}
+		return new Promise((resolve, reject) => {
+			pendingBatch.push({ request: { method, path, body, ifNoneMatch }, resolve, reject });
+		});
+	},
+
+	// GET with If-None-Match: when the server's data has not changed it answers 304
+	// and the stored response is reused. Returns a copy so callers may mutate it.
+	async getConditional(url, errorMessage) {
+		const cached = conditionalCache.get(url);
+		// no-store (see sendOne): this cache, not the browser's, decides what is reused
+		const response = await this.request('GET', url, { ifNoneMatch: cached ? cached.etag : null });
+		if (response.status === 304 && cached) return structuredClone(cached.data);
+		if (response.status < 200 || response.status >= 300) throw new Error(errorMessage);
+		const data = response.body;
+		const etag = response.etag;
+		if (etag) {
+			conditionalCache.delete(url);
+			conditionalCache.set(url, { etag, data: structuredClone(data) });
+			if (conditionalCache.size > CONDITIONAL_CACHE_SIZE) {
+				conditionalCache.delete(conditionalCache.keys().next().value);
+			}
+		}
+		return data;
+	},
+
 	async login(data) {
 		const response = await fetch('/api/auth/login', {
 			method: 'POST',
@@ -24,13 +109,16 @@ export const Api = {
 		if (params.type && params.type !== 'all') queryParams.push(`type=${params.type}`);
 		if (params.sort_by) queryParams.push(`sort_by=${params.sort_by}`);
 		if (params.order) queryParams.push(`order=${params.order}`);
+		// Pagination: with a limit the response is { items, next_cursor, total_count? }
+		if (params.limit) queryParams.push(`limit=${params.limit}`);
+		if (params.cursor) queryParams.push(`cursor=${encodeURIComponent(params.cursor)}`);
+		if (params.fields) queryParams.push(`fields=${params.fields}`);
+		if (params.include_total) queryParams.push('include_total=true');
 
 		if (queryParams.length > 0) {
 			url += '?' + queryParams.join('&');
 		}
-		const response = await fetch(url);
-		if (!response.ok) throw new Error('Failed to fetch transactions');
-		return await response.json();
+		return await this.getConditional(url, 'Failed to fetch transactions');
 	},
 
 	async getStats(params = {}) {
@@ -44,9 +132,7 @@ export const Api = {
 		if (queryParams.length > 0) {
 			url += '?' + queryParams.join('&');
 		}
-		const response = await fetch(url);
-		if (!response.ok) throw new Error('Failed to fetch stats');
-		return await response.json();
+		return await this.getConditional(url, 'Failed to fetch stats');
 	},
 
 	async saveTransaction(data) {
@@ -70,9 +156,7 @@ export const Api = {
 	},
 
 	async getInvestments() {
-		const response = await fetch('/api/investments');
-		if (!response.ok) throw new Error('Failed to fetch investments');
-		return await response.json();
+		return await this.getConditional('/api/investments', 'Failed to fetch investments');
 	},
 
 	async getInvestmentPortfolio(params = {}) {
@@ -84,9 +168,7 @@ export const Api = {
 			url += '?' + queryParams.join('&');
 		}
 
-		const response = await fetch(url);
-		if (!response.ok) throw new Error('Failed to fetch portfolio');
-		return await response.json();
+		return await this.getConditional(url, 'Failed to fetch portfolio');
 	},
 
 	async saveInvestment(data) {
@@ -108,9 +190,7 @@ export const Api = {
 	},
 
 	async getSettings() {
-		const response = await fetch('/api/settings');
-		if (!response.ok) throw new Error('Failed to fetch settings');
-		return await response.json();
+		return await this.getConditional('/api/settings', 'Failed to fetch settings');
 	},
 
 	async updateSettings(data) {
@@ -123,9 +203,7 @@ export const Api = {
 	},
 
 	async getFixedItems() {
-		const response = await fetch('/api/fixed_items');
-		if (!response.ok) throw new Error('Failed to fetch fixed items');
-		return await response.json();
+		return await this.getConditional('/api/fixed_items', 'Failed to fetch fixed items');
 	},
 
 	async saveFixedItem(data) {
@@ -157,15 +235,56 @@ export const Api = {
 		return { ok: response.ok, data: await response.json() };
 	},
 
-	async importData(data) {
-		const response = await fetch('/api/import', {
+	async importFile(file, format) {
+		// The file is sent as-is and parsed on the server as it streams in
+		const response = await fetch(`/api/import?format=${encodeURIComponent(format)}`, {
+			method: 'POST',
+			headers: { 'Content-Type': file.type || 'application/octet-stream' },
+			body: file
+		});
+		return { ok: response.ok, status: response.status, data: await response.json() };
+	},
+
+	// Background jobs: submit, then poll until finished
+	async submitImportJob(file, format) {
+		const response = await fetch(`/api/jobs/import?format=${encodeURIComponent(format)}`, {
+			method: 'POST',
+			headers: { 'Content-Type': file.type || 'application/octet-stream' },
+			body: file
+		});
+		return { ok: response.ok, status: response.status, data: await response.json() };
+	},
+
+	async submitJob(kind, params = {}) {
+		const response = await fetch('/api/jobs', {
 			method: 'POST',
 			headers: { 'Content-Type': 'application/json' },
-			body: JSON.stringify(data)
+			body: JSON.stringify({ kind, params })
 		});
 		return { ok: response.ok, status: response.status, data: await response.json() };
 	},
 
+	async getJob(id) {
+		const response = await fetch(`/api/jobs/${id}`);
+		if (!response.ok) throw new Error('Failed to fetch job');
+		return await response.json();
+	},
+
+	async cancelJob(id) {
+		const response = await fetch(`/api/jobs/${id}/cancel`, { method: 'POST', body: '' });
+		return { ok: response.ok, status: response.status, data: await response.json() };
+	},
+
+	async waitForJob(id, onProgress = null, interval = 500) {
+		// Resolves with the job once it has succeeded, failed or been cancelled
+		for (;;) {
+			const job = await this.getJob(id);
+			if (['succeeded', 'failed', 'cancelled'].includes(job.status)) return job;
+			if (onProgress) onProgress(job);
+			await new Promise(resolve => setTimeout(resolve, interval));
+		}
+	},
+
 	// Admin / User Management
 	async getUsers() {
 		const response = await fetch('/api/users');
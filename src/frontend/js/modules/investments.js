@@ -36,15 +36,13 @@ export const Investments = {
 		try {
 			// Ensure we have transaction stats for Available Cash (which comes from general balances)
 			// Although now Logic calculates it, but we might rely on global state.balances
-			if (!state.balances) {
-				await Transactions.fetchAndRender(); // This fills state.balances
-			}
-
 			const currency = state.currentLanguage === 'vi' ? 'VND' : 'USD';
 
+			// Requested together, so they go out as one /api/batch call
 			const [history, portfolio] = await Promise.all([
 				Api.getInvestments(),
-				Api.getInvestmentPortfolio({ currency })
+				Api.getInvestmentPortfolio({ currency }),
+				state.balances ? null : Transactions.fetchAndRender() // This fills state.balances
 			]);
 
 			state.investments = history; // Transaction History
@@ -90,26 +90,31 @@ export const Nav = {
 
 		if (!file) return;
 
-		const reader = new FileReader();
-		reader.onload = async (evt) => {
-			try {
-				const content = evt.target.result;
-				const isCsv = file.name.endsWith('.csv');
-				const format = isCsv ? 'csv' : 'json';
-
-				const result = await Api.importData({ format, data: content });
-				if (result.ok) {
-					showToast(t('toast_save_success'), 'success');
-					document.getElementById('import-modal').classList.add('hidden');
-					document.dispatchEvent(new Event('transactions:updated'));
-				} else {
-					showToast(t('toast_error'), 'error');
-				}
-			} catch (err) {
+		const name = file.name.toLowerCase();
+		const format = name.endsWith('.csv') ? 'csv' : name.endsWith('.ndjson') ? 'ndjson' : 'json';
+
+		try {
+			// Imported by a background job; the dashboard stays usable while it runs
+			const submitted = await Api.submitImportJob(file, format);
+			if (!submitted.ok) {
 				showToast(t('toast_error'), 'error');
+				return;
 			}
-		};
-		reader.readAsText(file);
+			document.getElementById('import-modal').classList.add('hidden');
+			const job = await Api.waitForJob(submitted.data.id);
+			if (job.status === 'succeeded') {
+				const { inserted, skipped, rejected } = job.result;
+				showToast(t('toast_import_summary')
+					.replace('{inserted}', inserted)
+					.replace('{skipped}', skipped)
+					.replace('{rejected}', rejected), rejected ? 'error' : 'success');
+				document.dispatchEvent(new Event('transactions:updated'));
+			} else {
+				showToast(t('toast_error'), 'error');
+			}
+		} catch (err) {
+			showToast(t('toast_error'), 'error');
+		}
 	},
 
 	async handleExport(e) {
@@ -3,6 +3,9 @@ import { Api } from '../api.js';
 import { state } from '../state.js';
 import { t, formatCurrency, getCategoryIcon, getCategoryName, showToast, convertAmount } from '../utils.js';
 
+// Rows fetched per request; further pages load on demand
+const TRANSACTIONS_PAGE_SIZE = 200;
+
 export const Transactions = {
 	init() {
 		// Static Header Actions (Always in index.html)
@@ -179,12 +182,13 @@ export const Transactions = {
 		const statsParams = { ...params, currency: state.currentLanguage === 'vi' ? 'VND' : 'USD' };
 
 		try {
-			const [transactions, stats] = await Promise.all([
-				Api.getTransactions(params),
+			const [page, stats] = await Promise.all([
+				Api.getTransactions({ ...params, limit: TRANSACTIONS_PAGE_SIZE }),
 				Api.getStats(statsParams)
 			]);
 
-			state.transactions = transactions;
+			state.transactions = page.items;
+			state.transactionsCursor = page.next_cursor;
 			this.render();
 			this.renderStats(stats);
 		} catch (err) {
@@ -204,6 +208,22 @@ export const Transactions = {
 		return params;
 	},
 
+	async loadMoreTransactions() {
+		if (!state.transactionsCursor) return;
+		try {
+			const page = await Api.getTransactions({
+				...this.computeParams(),
+				limit: TRANSACTIONS_PAGE_SIZE,
+				cursor: state.transactionsCursor
+			});
+			state.transactions = state.transactions.concat(page.items);
+			state.transactionsCursor = page.next_cursor;
+			this.render();
+		} catch (err) {
+			console.error('Error loading more transactions:', err);
+		}
+	},
+
 	// Legacy method support if needed
 	async fetchTransactions() {
 		this.fetchAndRender();
@@ -300,6 +320,14 @@ export const Transactions = {
 
 			tbody.appendChild(tr);
 		});
+
+		// More pages on the server: offer to fetch the next one
+		if (state.transactionsCursor) {
+			const tr = document.createElement('tr');
+			tr.innerHTML = `<td colspan="7" class="text-center p-4"><button class="btn btn-secondary load-more-btn">${t('load_more')}</button></td>`;
+			tr.querySelector('.load-more-btn').addEventListener('click', () => this.loadMoreTransactions());
+			tbody.appendChild(tr);
+		}
 	},
 
 	openAddModal() {
@@ -2,6 +2,7 @@
 export const state = {
 	currentUser: null,
 	transactions: [],
+	transactionsCursor: null, // next_cursor of the last page loaded, null when the list is complete
 	investments: [], // Investment transactions
 	filterParams: { period: 'this_month' },
 	theme: localStorage.getItem('parfin_theme') || 'system',
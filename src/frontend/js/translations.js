@@ -53,6 +53,7 @@ export const translations = {
 		table_action: "Action",
 		loading_transactions: "Loading transactions...",
 		no_transactions: "No transactions found.",
+		load_more: "Load more",
 		modal_add_title: "Add Transaction",
 		modal_edit_title: "Edit Transaction",
 		type_label: "Type",
@@ -144,6 +145,7 @@ export const translations = {
 		close_btn: "Close",
 		toast_save_success: "Saved successfully!",
 		toast_generated_success: "Transactions generated successfully",
+		toast_import_summary: "Imported {inserted}, skipped {skipped} duplicates, rejected {rejected}",
 		exchange_rate_label: "Exchange Rate (1 USD = ? VND)",
 		exchange_rate_help: "Set the exchange rate for currency conversion.",
 		update_rate_btn: "Update Rate",
@@ -280,6 +282,7 @@ export const translations = {
 		table_action: "Hành động",
 		loading_transactions: "Đang tải giao dịch...",
 		no_transactions: "Chưa có giao dịch nào.",
+		load_more: "Tải thêm",
 		modal_add_title: "Thêm giao dịch",
 		modal_edit_title: "Chỉnh sửa giao dịch",
 		type_label: "Loại",
@@ -371,6 +374,7 @@ export const translations = {
 		close_btn: "Đóng",
 		toast_save_success: "Lưu thành công!",
 		toast_generated_success: "Đã tạo các giao dịch thành công",
+		toast_import_summary: "Đã nhập {inserted}, bỏ qua {skipped} trùng lặp, từ chối {rejected}",
 		exchange_rate_label: "Tỷ giá (1 USD = ? VND)",
 		exchange_rate_help: "Thiết lập tỷ giá để quy đổi tiền tệ.",
 		update_rate_btn: "Cập nhật Tỷ giá",
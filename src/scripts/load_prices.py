@@ -0,0 +1,46 @@
+import argparse
+import os
+import sys
+
+# Script is in src/scripts/, backend package is in src/, db is in data/
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(BASE_DIR, 'src'))
+
+from backend import db
+from backend import importer
+from backend import prices
+
+def main():
+    parser = argparse.ArgumentParser(description="Load closing prices (symbol,date,close) from local files.")
+    parser.add_argument('files', nargs='+', help="Price files; .csv, .json or .ndjson")
+    parser.add_argument('--db', default=os.path.join(BASE_DIR, 'data', 'parfin.db'),
+                        help="Path to the SQLite database (default: data/parfin.db)")
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    print(f"Target Database: {db.DB_PATH}")
+    db.init_db()
+
+    failed = False
+    for path in args.files:
+        file_format = os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in importer.PARSERS:
+            print(f"{path}: unsupported format, skipped")
+            failed = True
+            continue
+        # One transaction per file: a file that cannot be parsed loads nothing
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as f, db.connection() as conn:
+                summary = prices.load_records(conn, importer.PARSERS[file_format](f))
+        except (OSError, importer.UploadError, UnicodeDecodeError) as e:
+            print(f"{path}: {e}")
+            failed = True
+            continue
+        print(f"{path}: loaded {summary['loaded']}, rejected {summary['rejected']}")
+        for error in summary['errors']:
+            print(f"  row {error['row']}: {error['error']}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+
+# Script is in src/scripts/, backend package is in src/, db is in data/
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(BASE_DIR, 'src'))
+
+from backend import db
+from backend.migrations import migrate, get_version, pending_migrations, LATEST_VERSION
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply ParFin schema migrations ahead of a deploy.")
+    parser.add_argument('--db', default=os.path.join(BASE_DIR, 'data', 'parfin.db'),
+                        help="Path to the SQLite database (default: data/parfin.db)")
+    parser.add_argument('--status', action='store_true',
+                        help="Only report the current version and pending migrations")
+    parser.add_argument('--target', type=int, default=LATEST_VERSION,
+                        help="Migrate up to this version (default: latest)")
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    print(f"Target Database: {db.DB_PATH}")
+    conn = db.get_db_connection()
+    try:
+        pending = [m for m in pending_migrations(conn) if m[0] <= args.target]
+        print(f"Schema version: {get_version(conn)} (latest: {LATEST_VERSION})")
+
+        if args.status:
+            for version, description, _ in pending:
+                print(f"  pending {version}: {description}")
+            return
+
+        if not pending:
+            print("Database is up to date.")
+            return
+
+        version = migrate(conn, args.target)
+        print(f"Migrated to version {version}.")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+
+# Script is in src/scripts/, backend package is in src/, db is in data/
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(BASE_DIR, 'src'))
+
+from backend import db
+from backend import rollups
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the monthly_rollups table from raw transactions.")
+    parser.add_argument('--db', default=os.path.join(BASE_DIR, 'data', 'parfin.db'),
+                        help="Path to the SQLite database (default: data/parfin.db)")
+    parser.add_argument('--user', type=int, default=None, help="Only rebuild this user ID")
+    parser.add_argument('--verify', action='store_true', help="Only report drift, do not rebuild")
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    print(f"Target Database: {db.DB_PATH}")
+    db.init_db()
+
+    with db.connection() as conn:
+        if args.verify:
+            drift = rollups.verify(conn, args.user)
+            if not drift:
+                print("Rollups OK: no drift found.")
+                return
+            print(f"Found {len(drift)} drifted rollup group(s):")
+            for key, stored, expected in drift:
+                print(f"  {key}: stored {stored}, expected {expected}")
+            sys.exit(1)
+
+        count = rollups.rebuild(conn, args.user)
+        print(f"Rebuilt {count} rollup row(s).")
+
+if __name__ == "__main__":
+    main()
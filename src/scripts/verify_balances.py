@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+
+# Script is in src/scripts/, backend package is in src/, db is in data/
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(BASE_DIR, 'src'))
+
+from backend import db
+from backend import balances
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute fund balances from the full history and report drift.")
+    parser.add_argument('--db', default=os.path.join(BASE_DIR, 'data', 'parfin.db'),
+                        help="Path to the SQLite database (default: data/parfin.db)")
+    parser.add_argument('--user', type=int, default=None, help="Only check this user ID")
+    parser.add_argument('--fix', action='store_true', help="Rebuild the balance table if drift is found")
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    print(f"Target Database: {db.DB_PATH}")
+    db.init_db()
+
+    with db.connection() as conn:
+        drift = balances.verify(conn, args.user)
+        if not drift:
+            print("Balances OK: no drift found.")
+            return
+
+        print(f"Found {len(drift)} drifted balance(s):")
+        for (user_id, fund, source, currency), stored, expected in drift:
+            print(f"  user {user_id} {fund}/{source} {currency}: stored {stored:.2f}, expected {expected:.2f} "
+                  f"(drift {stored - expected:+.2f})")
+
+        if args.fix:
+            count = balances.rebuild(conn, args.user)
+            print(f"Rebuilt {count} balance row(s).")
+
+    if not args.fix:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+
+# Test cases running on a database of their own in a temporary directory.
+# db.DB_PATH points at it for the duration, so db.connection() and the code
+# under test use it; the previous path is restored afterwards.
+
+def open_database(owner, name, init_schema=True):
+    owner.tmp = tempfile.TemporaryDirectory()
+    owner.old_path = db.DB_PATH
+    db.DB_PATH = os.path.join(owner.tmp.name, name)
+    if init_schema:
+        db.init_db()
+
+def close_database(owner):
+    db.get_pool().close()
+    db.DB_PATH = owner.old_path
+    owner.tmp.cleanup()
+
+class DatabaseTestCase(unittest.TestCase):
+    """Each test gets a new database, migrated unless init_schema is False."""
+    db_name = 'test.db'
+    init_schema = True
+
+    def setUp(self):
+        open_database(self, self.db_name, self.init_schema)
+
+    def tearDown(self):
+        close_database(self)
+
+class SharedDatabaseTestCase(unittest.TestCase):
+    """The tests of the class share one database, set up in setUpClass."""
+    db_name = 'test.db'
+
+    @classmethod
+    def setUpClass(cls):
+        open_database(cls, cls.db_name)
+
+    @classmethod
+    def tearDownClass(cls):
+        close_database(cls)
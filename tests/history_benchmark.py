@@ -0,0 +1,127 @@
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Compares /api/history's single-pass net-worth series with recomputing every
+# point from scratch. Runs against a temporary database:
+#     python tests/history_benchmark.py --years 5 --interval day
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import logic
+from backend import balances
+from backend import portfolio
+from backend import rates
+from backend import prices
+
+def seed(conn, start, days, transactions, trades, symbols):
+    rnd = random.Random(1)
+
+    def day():
+        return (start + datetime.timedelta(days=rnd.randrange(days))).isoformat()
+    conn.executemany('''
+        INSERT INTO transactions (user_id, amount, currency, type, category, source, fund, date)
+        VALUES (1, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(rnd.randint(1, 1000) * 1000, rnd.choice(['VND', 'VND', 'VND', 'USD']),
+           rnd.choice(['income', 'expense', 'expense', 'allocation']),
+           rnd.choice(['Food', 'Rent', 'Salary', 'Saving', 'Transport']), rnd.choice(['cash', 'bank']),
+           rnd.choice([None, None, 'Saving']), day()) for _ in range(transactions)])
+    conn.executemany('''
+        INSERT INTO investment_transactions (user_id, date, symbol, type, quantity, price, fee, tax)
+        VALUES (1, ?, ?, ?, ?, ?, ?, 0)
+    ''', [(day(), rnd.choice(symbols), rnd.choice(['buy', 'buy', 'sell', 'dividend']),
+           rnd.randint(1, 100), rnd.randint(10, 90) * 1000, 1000) for _ in range(trades)])
+    # A close for every symbol on every weekday
+    weekdays = [start + datetime.timedelta(days=i) for i in range(days + 1)]
+    weekdays = [d.isoformat() for d in weekdays if d.weekday() < 5]
+    prices.load_records(conn, ((i, {"symbol": symbol, "date": date, "close": rnd.randint(10, 90) * 1000})
+                               for i, (symbol, date) in enumerate((s, d) for s in symbols for d in weekdays)))
+    for month in range(0, days, 30):
+        rates.set_rate(conn, 'USD', 'VND', (start + datetime.timedelta(days=month + 14)).isoformat(),
+                       23000 + rnd.randint(0, 2000))
+
+def naive(conn, dates, currency):
+    # One full recomputation per date: summed balances and a replay of every trade so far
+    matrix = rates.RateMatrix.load(conn)
+    points = []
+    for date in dates:
+        cash = 0.0
+        for row_currency, amount in conn.execute(f'''
+                SELECT COALESCE(currency, ''), SUM({balances.GRAND_TOTAL_DELTA}) FROM transactions
+                WHERE user_id = 1 AND date <= ? GROUP BY 1''', (date,)):
+            cash += amount * matrix.factor(row_currency, currency, date)
+        positions = {}
+        for trade in conn.execute('SELECT * FROM investment_transactions WHERE user_id = 1 AND date <= ? ORDER BY date, id',
+                                  (date,)):
+            cash += sum(amount for _, _, amount in balances._investment_effects(trade)) * matrix.factor('VND', currency, date)
+            position = positions.setdefault(trade['symbol'], {'quantity': 0.0, 'total_cost': 0.0,
+                                                              'realized_pl': 0.0, 'cash_flow': 0.0})
+            portfolio.apply_trade(position, trade, matrix.factor('VND', currency, trade['date']))
+        value = 0.0
+        for symbol, position in positions.items():
+            if position['quantity'] > portfolio.MIN_QUANTITY:
+                close = conn.execute('SELECT close FROM prices WHERE symbol = ? AND date <= ? ORDER BY date DESC LIMIT 1',
+                                     (symbol, date)).fetchone()
+                value += (position['quantity'] * close[0] * matrix.factor('VND', currency, date) if close
+                          else position['total_cost'])
+        points.append((cash, sum(p['total_cost'] for p in positions.values()), value))
+    return points
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--transactions', type=int, default=50000)
+    parser.add_argument('--trades', type=int, default=5000)
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--interval', default='day', choices=['day', 'week', 'month'])
+    parser.add_argument('--currency', default='USD')
+    parser.add_argument('--naive-points', type=int, default=100,
+                        help='points recomputed naively; the total time is extrapolated from them')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'benchmark.db')
+        db.init_db()
+        end = datetime.date.today()
+        start = end - datetime.timedelta(days=365 * args.years)
+        symbols = [f"S{i:03d}" for i in range(args.symbols)]
+        started = time.perf_counter()
+        with db.connection() as conn:
+            seed(conn, start, (end - start).days, args.transactions, args.trades, symbols)
+            closes = conn.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+        print(f"{args.transactions} transactions, {args.trades} trades, {closes} closes of {args.symbols} symbols "
+              f"over {args.years} years, seeded in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        result = logic.calculate_history(1, start.isoformat(), end.isoformat(), args.interval, args.currency)
+        first = time.perf_counter() - started
+        logic.RESULT_CACHE.clear()
+        started = time.perf_counter()
+        result = logic.calculate_history(1, start.isoformat(), end.isoformat(), args.interval, args.currency)
+        batched = time.perf_counter() - started
+        dates = result['dates']
+        print(f"single pass: {len(dates)} points in {batched * 1000:.1f} ms "
+              f"({first * 1000:.1f} ms including the first portfolio checkpoint build)")
+
+        step = max(1, len(dates) // args.naive_points)
+        indexes = list(range(0, len(dates), step))
+        with db.connection() as conn:
+            started = time.perf_counter()
+            points = naive(conn, [dates[i] for i in indexes], args.currency)
+            elapsed = time.perf_counter() - started
+        estimate = elapsed / len(indexes) * len(dates)
+        print(f"per-date recomputation: {len(indexes)} points in {elapsed * 1000:.1f} ms, "
+              f"about {estimate:.1f} s for all {len(dates)} ({estimate / batched:.0f}x slower)")
+
+        worst = max(max(abs(result['cash'][i] - cash), abs(result['cost_basis'][i] - cost),
+                        abs(result['holdings_value'][i] - value))
+                    for i, (cash, cost, value) in zip(indexes, points))
+        print(f"largest difference between the two: {worst:.6f} {args.currency}")
+        db.get_pool().close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import unittest
+import sys
+import os
+import random
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import balances
+import backend.logic as logic
+from db_case import DatabaseTestCase
+
+TYPES = ['income', 'expense', 'allocation']
+CATEGORIES = ['Food', 'Salary', 'Rent', 'Saving', 'Support', 'Investment', 'Together']
+FUNDS = [None, '', 'Saving', 'Support', 'Investment', 'Together', 'Unknown']
+
+def random_transaction(rnd, user_id):
+    return (
+        user_id,
+        round(rnd.uniform(1, 1000000), 2),
+        rnd.choice(['VND', 'VND', 'USD']),
+        rnd.choice(TYPES),
+        rnd.choice(CATEGORIES),
+        rnd.choice(['cash', 'bank', None]),
+        rnd.choice(['cash', 'bank', None]),
+        rnd.choice(CATEGORIES + [None]),
+        rnd.choice(FUNDS),
+        f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+    )
+
+INSERT_TRANSACTION = '''
+    INSERT INTO transactions (user_id, amount, currency, type, category, source, destination, destination_category, fund, date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+class TestFundBalances(DatabaseTestCase):
+    db_name = 'balances.db'
+
+    def setUp(self):
+        super().setUp()
+        self.rnd = random.Random(42)
+
+    def test_01_triggers_match_full_replay(self):
+        with db.connection() as conn:
+            conn.executemany(INSERT_TRANSACTION, [random_transaction(self.rnd, self.rnd.choice([1, 2])) for _ in range(500)])
+            conn.executemany('''
+                INSERT INTO investment_transactions (user_id, date, symbol, type, quantity, price, fee, tax)
+                VALUES (?, '2024-01-01', 'AAA', ?, ?, ?, ?, ?)
+            ''', [(1, self.rnd.choice(['buy', 'sell', 'dividend', 'split']), self.rnd.randint(1, 50),
+                   self.rnd.uniform(1, 1000), self.rnd.uniform(0, 10), self.rnd.uniform(0, 10)) for _ in range(100)])
+
+        with db.connection() as conn:
+            ids = [r[0] for r in conn.execute('SELECT id FROM transactions')]
+            for trans_id in self.rnd.sample(ids, 100):
+                values = random_transaction(self.rnd, 1)
+                conn.execute('''
+                    UPDATE transactions SET user_id = ?, amount = ?, currency = ?, type = ?, category = ?, source = ?,
+                        destination = ?, destination_category = ?, fund = ?, date = ?
+                    WHERE id = ?
+                ''', values + (trans_id,))
+            conn.execute('UPDATE transactions SET description = ? WHERE id = ?', ('only the description', ids[0]))
+            conn.executemany('DELETE FROM transactions WHERE id = ?', [(i,) for i in self.rnd.sample(ids, 100)])
+            conn.execute("DELETE FROM investment_transactions WHERE type = 'sell'")
+            conn.execute("UPDATE investment_transactions SET quantity = quantity * 2 WHERE type = 'buy'")
+
+        with db.connection() as conn:
+            self.assertEqual(balances.verify(conn), [])
+
+    def test_02_rolled_back_write_leaves_balances_untouched(self):
+        with db.connection() as conn:
+            conn.execute(INSERT_TRANSACTION, (1, 100, 'VND', 'income', 'Salary', 'bank', None, None, None, '2024-01-01'))
+        with self.assertRaises(RuntimeError):
+            with db.connection() as conn:
+                conn.execute(INSERT_TRANSACTION, (1, 999, 'VND', 'income', 'Salary', 'bank', None, None, None, '2024-01-02'))
+                raise RuntimeError('abort')
+        with db.connection() as conn:
+            self.assertEqual(balances.stored_balances(conn, 1), {(1, 'total', 'bank', 'VND'): 100.0})
+
+    def test_03_stats_read_balances_in_target_currency(self):
+        with db.connection() as conn:
+            conn.execute(INSERT_TRANSACTION, (1, 1000000, 'VND', 'income', 'Salary', 'bank', None, None, None, '2024-01-01'))
+            conn.execute(INSERT_TRANSACTION, (1, 10, 'USD', 'income', 'Salary', 'bank', None, None, None, '2024-01-02'))
+            conn.execute(INSERT_TRANSACTION, (1, 200000, 'VND', 'allocation', 'Salary', 'bank', 'cash', 'Saving', None, '2024-01-03'))
+            conn.execute(INSERT_TRANSACTION, (1, 50000, 'VND', 'expense', 'Food', 'cash', None, None, 'Saving', '2024-01-04'))
+
+        stats = logic.calculate_stats(1, None, None, 'VND')['balances']
+        self.assertAlmostEqual(stats['total']['bank'], 1000000 + 10 * 25000 - 200000)
+        self.assertAlmostEqual(stats['saving']['cash'], 150000)
+        self.assertAlmostEqual(stats['grand_total'], 1000000 + 10 * 25000 - 50000)
+
+        stats = logic.calculate_stats(1, None, None, 'USD')['balances']
+        self.assertAlmostEqual(stats['saving']['cash'], 6)
+
+    def test_04_verify_reports_and_rebuild_fixes_drift(self):
+        with db.connection() as conn:
+            conn.execute(INSERT_TRANSACTION, (1, 100, 'VND', 'income', 'Salary', 'cash', None, None, None, '2024-01-01'))
+            conn.execute("UPDATE fund_balances SET amount = amount + 5")
+            drift = balances.verify(conn)
+            self.assertEqual(drift, [((1, 'total', 'cash', 'VND'), 105.0, 100.0)])
+            balances.rebuild(conn)
+            self.assertEqual(balances.verify(conn), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import sys
+import os
+import random
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import balances
+from backend import rollups
+from backend import transactions
+from db_case import DatabaseTestCase
+
+INSERT_TRANSACTION = '''
+    INSERT INTO transactions (user_id, amount, currency, type, category, description, source, destination, destination_category, fund, date)
+    VALUES (?, ?, ?, ?, ?, '', ?, ?, ?, ?, ?)
+'''
+
+class TestBulkOperations(DatabaseTestCase):
+    db_name = 'bulk.db'
+
+    def setUp(self):
+        super().setUp()
+        rnd = random.Random(21)
+        with db.connection() as conn:
+            conn.executemany(INSERT_TRANSACTION, [(
+                rnd.choice([1, 1, 1, 2]),
+                rnd.randint(1, 1000) * 1000,
+                rnd.choice(['VND', 'USD']),
+                rnd.choice(['income', 'expense', 'allocation']),
+                rnd.choice(['Food', 'Rent', 'Salary']),
+                rnd.choice(['cash', 'bank']),
+                rnd.choice(['cash', 'bank', None]),
+                rnd.choice(['Saving', None]),
+                rnd.choice(['Saving', 'Support', None]),
+                f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            ) for _ in range(300)])
+
+    def assertConsistent(self):
+        with db.connection() as conn:
+            self.assertEqual(balances.verify(conn), [])
+            self.assertEqual(rollups.verify(conn), [])
+
+    def ids(self, where='1 = 1', args=()):
+        with db.connection() as conn:
+            return [r[0] for r in conn.execute(f'SELECT id FROM transactions WHERE {where} ORDER BY id', args)]
+
+    def test_01_delete_by_ids_skips_other_users(self):
+        mine, theirs = self.ids('user_id = 1')[:20], self.ids('user_id = 2')[:5]
+        with db.connection() as conn:
+            result = transactions.bulk_delete(conn, {"ids": mine + theirs + mine[:3]}, 1)
+        self.assertEqual(result, {"matched": 25, "deleted": 20})
+        self.assertEqual(self.ids('id IN (SELECT value FROM json_each(?))', (str(mine + theirs),)), theirs)
+        self.assertConsistent()
+
+    def test_02_update_by_filter(self):
+        expected = self.ids("user_id = 1 AND category = 'Food' AND date BETWEEN '2024-03-01' AND '2024-05-31'")
+        with db.connection() as conn:
+            result = transactions.bulk_update(conn, {
+                "filter": {"category": "Food", "start_date": "2024-03-01", "end_date": "2024-05-31"},
+                "patch": {"amount": "42000", "currency": "usd", "fund": None, "date": "2024-06-01"},
+            }, 1)
+        self.assertEqual(result, {"matched": len(expected), "updated": len(expected)})
+        with db.connection() as conn:
+            rows = conn.execute('SELECT DISTINCT amount, currency, fund, date FROM transactions '
+                                'WHERE id IN (SELECT value FROM json_each(?))', (str(expected),)).fetchall()
+        self.assertEqual([tuple(r) for r in rows], [(42000.0, 'USD', None, '2024-06-01')])
+        self.assertConsistent()
+
+    def test_03_recategorize(self):
+        with db.connection() as conn:
+            counts = dict(conn.execute('SELECT category, COUNT(*) FROM transactions '
+                                       "WHERE user_id = 1 AND type = 'expense' GROUP BY category"))
+            result = transactions.bulk_recategorize(conn, {
+                "categories": {"Food": "Groceries", "Rent": "Housing", "Salary": "Salary"},
+                "filter": {"type": "expense"},
+            }, 1)
+        self.assertEqual(result, {"updated": counts['Food'] + counts['Rent'],
+                                  "categories": {"Food": counts['Food'], "Rent": counts['Rent']}})
+        self.assertEqual(self.ids("user_id = 1 AND type = 'expense' AND category IN ('Food', 'Rent')"), [])
+        self.assertNotEqual(self.ids("user_id = 2 AND category = 'Food'"), [])
+        self.assertConsistent()
+
+    def test_04_bad_requests_change_nothing(self):
+        before = self.ids()
+        bad = [
+            (transactions.bulk_delete, {}),
+            (transactions.bulk_delete, {"ids": [1], "filter": {"type": "income"}}),
+            (transactions.bulk_delete, {"ids": ["1"]}),
+            (transactions.bulk_delete, {"filter": {}}),
+            (transactions.bulk_delete, {"filter": {"user_id": 2}}),
+            (transactions.bulk_update, {"ids": [1], "patch": {"user_id": 2}}),
+            (transactions.bulk_update, {"ids": [1], "patch": {"amount": -5}}),
+            (transactions.bulk_update, {"ids": [1], "patch": {"type": "gift"}}),
+            (transactions.bulk_update, {"ids": [1], "patch": {"category": None}}),
+            (transactions.bulk_recategorize, {"categories": {"Food": "Rent", "Rent": "Salary"}}),
+            (transactions.bulk_recategorize, {"categories": {"Food": "Rent"}, "filter": {"category": "Food"}}),
+        ]
+        for operation, data in bad:
+            with self.assertRaises(transactions.QueryError, msg=data):
+                with db.connection() as conn:
+                    operation(conn, data, 1)
+        self.assertEqual(self.ids(), before)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import sys
+import os
+import threading
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import migrations
+from db_case import DatabaseTestCase
+
+class TestConnectionPool(DatabaseTestCase):
+    db_name = 'pool.db'
+    init_schema = False
+
+    def setUp(self):
+        super().setUp()
+        self.path = db.DB_PATH
+        self.pool = db.ConnectionPool(self.path, max_size=2, timeout=0.2)
+
+    def tearDown(self):
+        self.pool.close()
+        super().tearDown()
+
+    def test_01_pragmas_applied(self):
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1) # NORMAL
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+
+    def test_02_connections_are_reused(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        stats = self.pool.stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_03_rollback_on_error(self):
+        with self.pool.connection() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+        with self.assertRaises(ValueError):
+            with self.pool.connection() as conn:
+                conn.execute('INSERT INTO t VALUES (1)')
+                raise ValueError('boom')
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+
+    def test_04_exhausted_pool_waits_then_times_out(self):
+        a = self.pool.acquire()
+        b = self.pool.acquire()
+        with self.assertRaises(db.PoolTimeout):
+            self.pool.acquire()
+
+        # A connection returned by another thread wakes up the waiter
+        threading.Timer(0.05, self.pool.release, args=(a,)).start()
+        c = self.pool.acquire()
+        self.assertIs(c, a)
+        self.pool.release(b)
+        self.pool.release(c)
+
+        stats = self.pool.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waits'], 1)
+        self.assertGreater(stats['wait_time_total'], 0)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_05_query_db_uses_module_pool(self):
+        db.query_db('CREATE TABLE t (x INTEGER)')
+        db.query_db('INSERT INTO t VALUES (?)', (7,))
+        row = db.query_db('SELECT x FROM t', one=True)
+        self.assertEqual(row['x'], 7)
+        self.assertEqual(db.get_pool().path, self.path)
+        db.get_pool().close()
+
+class TestMigrations(DatabaseTestCase):
+    db_name = 'migrate.db'
+    # Each test migrates the database itself
+    init_schema = False
+
+    def columns(self, conn, table):
+        return [row[1] for row in conn.execute(f'PRAGMA table_xinfo({table})')]
+
+    def test_01_fresh_database(self):
+        db.init_db()
+        conn = db.get_db_connection()
+        self.assertEqual(migrations.get_version(conn), migrations.LATEST_VERSION)
+        self.assertIn('year_month', self.columns(conn, 'transactions'))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'").fetchone()[0], 1)
+        conn.close()
+
+    def test_02_legacy_database_is_upgraded(self):
+        # Schema from before fund / currency / destination columns existed
+        conn = db.get_db_connection()
+        conn.execute('''
+            CREATE TABLE transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, amount REAL NOT NULL,
+                type TEXT NOT NULL, category TEXT NOT NULL, description TEXT, date TEXT NOT NULL
+            )
+        ''')
+        conn.execute("INSERT INTO transactions (user_id, amount, type, category, date) VALUES (1, 5, 'expense', 'Food', '2024-02-03')")
+        conn.commit()
+
+        self.assertEqual(migrations.migrate(conn), migrations.LATEST_VERSION)
+        cols = self.columns(conn, 'transactions')
+        for col in ('source', 'destination', 'destination_category', 'fund', 'currency', 'year', 'year_month'):
+            self.assertIn(col, cols)
+        row = conn.execute('SELECT currency, year_month FROM transactions').fetchone()
+        self.assertEqual(tuple(row), ('VND', '2024-02'))
+        conn.close()
+
+    def test_03_up_to_date_database_reads_one_pragma(self):
+        db.init_db()
+        conn = db.get_db_connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        migrations.migrate(conn)
+        conn.close()
+        self.assertEqual(statements, ['PRAGMA user_version'])
+
+    def test_04_failed_step_rolls_back(self):
+        conn = db.get_db_connection()
+        def broken(c):
+            c.execute('CREATE TABLE half_done (x INTEGER)')
+            raise RuntimeError('step failed')
+        original = migrations.MIGRATIONS
+        migrations.MIGRATIONS = original + [(migrations.LATEST_VERSION + 1, 'Broken', broken)]
+        try:
+            with self.assertRaises(RuntimeError):
+                migrations.migrate(conn, migrations.LATEST_VERSION + 1)
+        finally:
+            migrations.MIGRATIONS = original
+        self.assertEqual(migrations.get_version(conn), migrations.LATEST_VERSION)
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.assertNotIn('half_done', tables)
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
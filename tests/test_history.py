@@ -0,0 +1,114 @@
+import unittest
+import sys
+import os
+import random
+import datetime
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import logic
+from backend import balances
+from backend import history
+from backend import portfolio
+from backend import rates
+from backend import prices
+from db_case import DatabaseTestCase
+
+def naive_point(conn, user_id, date, currency):
+    # Recomputes one sample from scratch: every row dated on or before date
+    matrix = rates.RateMatrix.load(conn)
+    cash = 0.0
+    for t in conn.execute('SELECT * FROM transactions WHERE user_id = ? AND date <= ?', (user_id, date)):
+        for fund, _, amount in balances._transaction_effects(t):
+            if fund is not None:
+                cash += amount * matrix.factor(t['currency'] or '', currency, date)
+    positions = {}
+    trades = conn.execute('SELECT * FROM investment_transactions WHERE user_id = ? AND date <= ? ORDER BY date, id',
+                          (user_id, date))
+    for trade in trades:
+        for _, _, amount in balances._investment_effects(trade):
+            cash += amount * matrix.factor('VND', currency, date)
+        position = positions.setdefault(trade['symbol'], {'quantity': 0.0, 'total_cost': 0.0,
+                                                          'realized_pl': 0.0, 'cash_flow': 0.0})
+        portfolio.apply_trade(position, trade, matrix.factor('VND', currency, trade['date']))
+    value = 0.0
+    for symbol, position in positions.items():
+        if position['quantity'] > portfolio.MIN_QUANTITY:
+            close = conn.execute('SELECT close FROM prices WHERE symbol = ? AND date <= ? ORDER BY date DESC LIMIT 1',
+                                 (symbol, date)).fetchone()
+            value += (position['quantity'] * close[0] * matrix.factor('VND', currency, date) if close
+                      else position['total_cost'])
+    return cash, sum(p['total_cost'] for p in positions.values()), value
+
+class TestHistory(DatabaseTestCase):
+    db_name = 'history.db'
+
+    def setUp(self):
+        super().setUp()
+        rnd = random.Random(11)
+
+        def day():
+            return (datetime.date(2022, 1, 1) + datetime.timedelta(days=rnd.randint(0, 900))).isoformat()
+        with db.connection() as conn:
+            conn.executemany('''
+                INSERT INTO transactions (user_id, amount, currency, type, category, source, destination,
+                                          destination_category, fund, date)
+                VALUES (1, ?, ?, ?, ?, ?, 'bank', ?, ?, ?)
+            ''', [(rnd.randint(1, 100) * 1000, rnd.choice(['VND', 'VND', 'USD']),
+                   rnd.choice(['income', 'expense', 'allocation']), rnd.choice(['Food', 'Salary', 'Saving']),
+                   rnd.choice(['cash', 'bank']), rnd.choice([None, 'Saving']), rnd.choice([None, '', 'Saving', 'Other']),
+                   day()) for _ in range(400)])
+            conn.executemany('''
+                INSERT INTO investment_transactions (user_id, date, symbol, type, quantity, price, fee, tax)
+                VALUES (1, ?, ?, ?, ?, ?, 100, 0)
+            ''', [(day(), rnd.choice(['AAA', 'BBB']), rnd.choice(['buy', 'buy', 'sell', 'dividend']),
+                   rnd.randint(1, 20), rnd.randint(10, 30) * 1000) for _ in range(100)])
+            rates.set_rate(conn, 'USD', 'VND', '2023-01-10', 24000)
+            rates.set_rate(conn, 'USD', 'VND', '2023-06-01', 23000)
+            # AAA is priced on random days from mid-2022; BBB never, so it stays at cost
+            prices.load_records(conn, [(i, {"symbol": "AAA", "date": day(), "close": rnd.randint(10, 40) * 1000})
+                                       for i in range(150)])
+
+    def test_01_matches_per_date_recomputation(self):
+        for currency in ('VND', 'USD'):
+            result = logic.calculate_history(1, '2022-03-15', '2024-02-10', 'month', currency)
+            self.assertEqual(result['dates'][:2], ['2022-03-31', '2022-04-30'])
+            self.assertEqual(result['dates'][-1], '2024-02-10')
+            with db.connection() as conn:
+                for i in (0, 9, 14, len(result['dates']) - 1):
+                    cash, cost_basis, value = naive_point(conn, 1, result['dates'][i], currency)
+                    self.assertAlmostEqual(result['cash'][i], cash, places=4)
+                    self.assertAlmostEqual(result['cost_basis'][i], cost_basis, places=4)
+                    self.assertAlmostEqual(result['holdings_value'][i], value, places=4)
+                    self.assertAlmostEqual(result['net_worth'][i], cash + result['holdings_value'][i], places=4)
+
+    def test_02_daily_and_weekly_samples_match(self):
+        # Closes are read per period; every sampled date must still see the latest one
+        for interval in ('day', 'week'):
+            result = logic.calculate_history(1, '2022-06-01', '2022-09-30', interval, 'USD')
+            with db.connection() as conn:
+                for i in range(0, len(result['dates']), 3):
+                    _, _, value = naive_point(conn, 1, result['dates'][i], 'USD')
+                    self.assertAlmostEqual(result['holdings_value'][i], value, places=4)
+
+    def test_03_latest_point_matches_current_stats(self):
+        today = datetime.date.today().isoformat()
+        result = logic.calculate_history(1, '2022-01-01', today, 'week', 'USD')
+        stats = logic.calculate_stats(1, None, None, 'USD')
+        self.assertAlmostEqual(result['cash'][-1], stats['balances']['grand_total'], places=6)
+        portfolio_summary = logic.calculate_portfolio(1, 'USD')['summary']
+        self.assertAlmostEqual(result['holdings_value'][-1], portfolio_summary['total_current_value'], places=6)
+        self.assertEqual(datetime.date.fromisoformat(result['dates'][0]).weekday(), 6)
+
+    def test_04_sample_dates(self):
+        self.assertEqual(history.sample_dates('2024-01-30', '2024-02-02', 'day'),
+                         ['2024-01-30', '2024-01-31', '2024-02-01', '2024-02-02'])
+        self.assertEqual(history.sample_dates('2024-02-15', '2024-04-10', 'month'),
+                         ['2024-02-29', '2024-03-31', '2024-04-10'])
+        for args in [('2024-02-01', '2024-01-01', 'day'), ('2024-01-01', '2024-02-01', 'year'),
+                     ('2024-01-01', 'soon', 'day'), ('1900-01-01', '2024-01-01', 'day')]:
+            with self.assertRaises(history.HistoryError):
+                history.sample_dates(*args)
+
+if __name__ == '__main__':
+    unittest.main()
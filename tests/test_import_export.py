@@ -10,6 +10,8 @@ from http.server import HTTPServer
 # Helper to import backend modules
 sys.path.append(os.path.join(os.getcwd(), 'src'))
 from backend.db import get_db_connection, init_db
+from backend import db, jobs, server
+from db_case import DatabaseTestCase
 
 BASE_URL = "http://127.0.0.1:8000/api"
 
@@ -95,5 +97,104 @@ class TestImportExport(unittest.TestCase):
         self.assertTrue(found)
         print("CSV Import Verified")
 
+    def test_05_export_ndjson_streamed(self):
+        print("\nTesting NDJSON Export...")
+        req = urllib.request.Request(f"{BASE_URL}/export?format=ndjson&category=Salary")
+        with urllib.request.urlopen(req) as response:
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+            lines = response.read().decode('utf-8').splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertTrue(rows)
+        self.assertTrue(all(r['category'] == 'Salary' for r in rows))
+        print(f"Exported {len(rows)} Salary transactions as NDJSON")
+
+    def test_06_export_gzip(self):
+        print("\nTesting gzip Export...")
+        import gzip
+        req = urllib.request.Request(f"{BASE_URL}/export?format=csv&month=all&compress=gzip")
+        with urllib.request.urlopen(req) as response:
+            self.assertEqual(response.status, 200)
+            self.assertIn('.csv.gz', response.getheader('Content-Disposition'))
+            body = gzip.decompress(response.read()).decode('utf-8')
+        self.assertTrue(body.startswith('id,date,type,category,amount'))
+        print("gzip Export verified")
+
+    def test_07_import_raw_upload(self):
+        print("\nTesting raw CSV upload...")
+        csv_data = ("date,type,category,amount,currency,source,description\n"
+                    "2023-12-03,expense,Food,42000,VND,cash,Test Raw Upload\n"
+                    "2023-12-03,expense,Food,not-a-number,VND,cash,Test Raw Upload Bad\n")
+        req = urllib.request.Request(f"{BASE_URL}/import?format=csv", data=csv_data.encode('utf-8'),
+                                     headers={'Content-Type': 'text/csv'}, method='POST')
+        with urllib.request.urlopen(req) as response:
+            summary = json.loads(response.read())
+        # The good row is new on the first run and a duplicate afterwards
+        self.assertEqual(summary['inserted'] + summary['skipped'], 1)
+        self.assertEqual(summary['rejected'], 1)
+        self.assertEqual(summary['errors'][0]['row'], 3)
+
+        status, body, _ = self.request('GET', '/export?format=json&month=all')
+        self.assertEqual(sum(t['description'] == "Test Raw Upload" for t in json.loads(body)), 1)
+        print("Raw upload verified")
+
+class TestExportJob(DatabaseTestCase):
+    # Runs its own server on a temporary database, so the job's files land in a
+    # temporary jobs directory instead of the working tree's data/jobs
+    db_name = 'parfin.db'
+
+    def setUp(self):
+        super().setUp()
+        self.old_jobs_dir = jobs.JOBS_DIR
+        jobs.JOBS_DIR = os.path.join(self.tmp.name, 'jobs')
+        with db.connection() as conn:
+            conn.executemany('''
+                INSERT INTO transactions (user_id, amount, type, category, description, source, date)
+                VALUES (1, ?, 'expense', 'Food', 'Export job', 'cash', '2024-01-02')
+            ''', [(i,) for i in range(1, 6)])
+        self.httpd = server.PooledTCPServer(('127.0.0.1', 0), server.ParFinHandler, workers=2)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/api"
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        jobs.shutdown()
+        jobs.JOBS_DIR = self.old_jobs_dir
+        super().tearDown()
+
+    def request(self, method, endpoint, data=None):
+        req = urllib.request.Request(f"{self.base_url}{endpoint}", data=json.dumps(data).encode('utf-8') if data else None,
+                                     headers={'Content-Type': 'application/json'}, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.read().decode('utf-8'), response.getheader('Content-Disposition')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode('utf-8'), None
+
+    def test_export_job(self):
+        print("\nTesting background export job...")
+        status, body, _ = self.request('POST', '/jobs', {"kind": "export", "params": {"format": "csv"}})
+        self.assertEqual(status, 202)
+        job = json.loads(body)
+        for _ in range(100):
+            status, body, _ = self.request('GET', f"/jobs/{job['id']}")
+            job = json.loads(body)
+            if job['status'] not in ('queued', 'running'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(job['status'], 'succeeded')
+
+        status, body, content_disp = self.request('GET', f"/jobs/{job['id']}/artifact")
+        self.assertEqual(status, 200)
+        self.assertIn('transactions_all.csv', content_disp)
+        self.assertEqual(len(body.strip().split('\n')) - 1, job['result']['rows'])
+
+        status, _, _ = self.request('POST', f"/jobs/{job['id']}/cancel")
+        self.assertEqual(status, 409)
+        self.assertEqual(job['result']['rows'], 5)
+        self.assertTrue(os.listdir(jobs.JOBS_DIR))
+        print("Export job verified")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import sys
+import os
+import io
+import json
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import balances
+from backend import rollups
+from backend import importer
+from db_case import DatabaseTestCase
+
+CSV_HEADER = "date,type,category,amount,currency,source,destination,destination_category,fund,description\n"
+
+def csv_rows(n, start=0):
+    return ''.join(
+        f"2024-{(i % 12) + 1:02d}-{(i % 28) + 1:02d},expense,Food,{1000 + i},VND,bank,,,,Row {i}\n"
+        for i in range(start, start + n)
+    )
+
+class TestImporter(DatabaseTestCase):
+    db_name = 'import.db'
+
+    def run_import(self, fmt, text, **kwargs):
+        with db.connection() as conn:
+            records = importer.PARSERS[fmt](io.StringIO(text, newline=''))
+            return importer.import_records(conn, 1, records, **kwargs)
+
+    def count(self):
+        with db.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM transactions WHERE user_id = 1').fetchone()[0]
+
+    def test_01_csv_batches_and_reimport(self):
+        text = CSV_HEADER + csv_rows(2500)
+        summary = self.run_import('csv', text, batch_size=1000)
+        self.assertEqual((summary['inserted'], summary['skipped'], summary['rejected']), (2500, 0, 0))
+
+        # The same file again is entirely duplicates
+        summary = self.run_import('csv', text)
+        self.assertEqual((summary['inserted'], summary['skipped']), (0, 2500))
+        self.assertEqual(self.count(), 2500)
+
+        # Derived tables were maintained by the triggers
+        with db.connection() as conn:
+            self.assertEqual(balances.verify(conn), [])
+            self.assertEqual(rollups.verify(conn), [])
+
+    def test_02_identical_rows_within_a_file(self):
+        row = '{"date": "2024-05-01", "type": "expense", "category": "Coffee", "amount": 30000}\n'
+        self.assertEqual(self.run_import('ndjson', row * 2)['inserted'], 2)
+        # One more copy than before: only the extra one is new
+        summary = self.run_import('ndjson', row * 3)
+        self.assertEqual((summary['inserted'], summary['skipped']), (1, 2))
+        self.assertEqual(self.count(), 3)
+
+    def test_03_rejected_rows_are_reported(self):
+        text = CSV_HEADER + (
+            "2024-01-01,expense,Food,100,VND,cash,,,,ok\n"
+            "2024-13-01,expense,Food,100,VND,cash,,,,bad date\n"
+            "2024-01-02,expense,Food,abc,VND,cash,,,,bad amount\n"
+            "2024-01-03,refund,Food,100,VND,cash,,,,bad type\n"
+            "2024-01-04,expense,,100,VND,cash,,,,no category\n"
+            "2024-01-05,expense,Food,100,VND,wallet,,,,bad source\n"
+        )
+        summary = self.run_import('csv', text)
+        self.assertEqual((summary['inserted'], summary['rejected']), (1, 5))
+        self.assertEqual([e['row'] for e in summary['errors']], [3, 4, 5, 6, 7])
+
+        summary = self.run_import('ndjson', '{"date": "2024-01-01"\n[1]\n')
+        self.assertEqual(summary['rejected'], 2)
+        self.assertIn('invalid JSON', summary['errors'][0]['error'])
+
+    def test_04_all_columns_round_trip(self):
+        row = {"date": "2024-02-03", "type": "allocation", "category": "Saving", "amount": "12.5",
+               "currency": "usd", "source": "cash", "destination": "bank",
+               "destination_category": "Investment", "fund": "", "description": "move"}
+        self.run_import('json', json.dumps([row]))
+        with db.connection() as conn:
+            stored = conn.execute('''
+                SELECT amount, currency, source, destination, destination_category, fund, description
+                FROM transactions
+            ''').fetchone()
+        self.assertEqual(tuple(stored), (12.5, 'USD', 'cash', 'bank', 'Investment', None, 'move'))
+
+    def test_05_json_array_across_chunks(self):
+        rows = [{"date": "2024-03-01", "type": "income", "category": "Salary", "amount": 1000 + i,
+                 "description": "x" * (i % 50)} for i in range(300)]
+        records = list(importer.parse_json_array(io.StringIO(json.dumps(rows, indent=1)), chunk_size=7))
+        self.assertEqual([r for _, r in records], rows)
+        self.assertEqual(list(importer.parse_json_array(io.StringIO(' [ ] '))), [])
+
+        for bad in ('{"a": 1}', '[{"a": 1} {"b": 2}]', '[{"a": 1}', '[{"a": 1}] x'):
+            with self.assertRaises(importer.UploadError):
+                list(importer.parse_json_array(io.StringIO(bad), chunk_size=4))
+
+    def test_06_fatal_error_rolls_back(self):
+        good = json.dumps({"date": "2024-03-01", "type": "income", "category": "Salary", "amount": 1})
+        with self.assertRaises(importer.UploadError):
+            self.run_import('json', f'[{good}, {good}, oops]')
+        self.assertEqual(self.count(), 0)
+
+    def test_07_edited_rows_are_rehashed(self):
+        row = '{"date": "2024-05-01", "type": "expense", "category": "Coffee", "amount": 30000}\n'
+        self.run_import('ndjson', row)
+        with db.connection() as conn:
+            conn.execute("UPDATE transactions SET amount = 45000")
+            self.assertIsNone(conn.execute('SELECT content_hash FROM transactions').fetchone()[0])
+        # The edited row no longer matches the original, so it is imported again
+        self.assertEqual(self.run_import('ndjson', row)['inserted'], 1)
+        self.assertEqual(self.run_import('ndjson', row)['skipped'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import sys
+import os
+import io
+import json
+import time
+import threading
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import jobs
+from db_case import DatabaseTestCase
+
+def wait_for(manager, job_id, user_id=1, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id, user_id)
+        if job['status'] in jobs.FINISHED:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish: {job}")
+
+class TestJobs(DatabaseTestCase):
+    db_name = 'jobs.db'
+
+    def setUp(self):
+        super().setUp()
+        self.manager = jobs.JobManager(db.DB_PATH, os.path.join(self.tmp.name, 'jobs'), workers=1)
+        self.manager.start()
+        self.release = threading.Event()
+
+        def blocking(job):
+            # Waits for the test, checking for cancellation like a real job
+            job.progress(0, 10)
+            while not self.release.wait(0.01):
+                job.check()
+            return {"ok": True}
+        jobs.KINDS['blocking'] = (blocking, 'steps')
+
+    def tearDown(self):
+        self.release.set()
+        self.manager.stop(timeout=5)
+        del jobs.KINDS['blocking']
+        super().tearDown()
+
+    def test_01_import_then_export(self):
+        text = "date,type,category,amount,description\n" + "".join(
+            f"2024-01-{i % 28 + 1:02d},expense,Food,{100 + i},row {i}\n" for i in range(2500))
+        upload = self.manager.save_upload(io.BytesIO(text.encode()))
+        job = self.manager.submit('import', 1, {"format": "csv"}, upload=upload)
+        self.assertIn(job['status'], ('queued', 'running'))
+        job = wait_for(self.manager, job['id'])
+        self.assertEqual(job['status'], 'succeeded', job['error'])
+        self.assertEqual(job['result']['inserted'], 2500)
+        self.assertEqual(job['progress']['done'], job['progress']['total'])
+        # The upload is removed once imported
+        self.assertFalse(os.path.exists(os.path.join(self.manager.job_dir(job['id']), 'upload')))
+
+        job = self.manager.submit('export', 1, {"format": "ndjson", "category": "Food"})
+        job = wait_for(self.manager, job['id'])
+        self.assertEqual(job['status'], 'succeeded', job['error'])
+        self.assertEqual((job['result']['rows'], job['progress']['total']), (2500, 2500))
+        path, name, content_type = self.manager.artifact(job['id'], 1)
+        self.assertEqual((name, content_type), ('transactions_all.ndjson', 'application/x-ndjson'))
+        with open(path) as f:
+            self.assertEqual(len([json.loads(line) for line in f]), 2500)
+        # Other users cannot see the job
+        self.assertIsNone(self.manager.get(job['id'], 2))
+        self.assertIsNone(self.manager.artifact(job['id'], 2))
+
+    def test_02_cancel_running_and_queued(self):
+        running = self.manager.submit('blocking', 1)
+        queued = self.manager.submit('blocking', 1)
+        while self.manager.get(running['id'], 1)['status'] != 'running':
+            time.sleep(0.01)
+        self.assertEqual(self.manager.get(running['id'], 1)['progress']['total'], 10)
+
+        self.assertEqual(self.manager.cancel(queued['id'], 1)['status'], 'cancelled')
+        self.manager.cancel(running['id'], 1)
+        self.assertEqual(wait_for(self.manager, running['id'])['status'], 'cancelled')
+        self.assertEqual(wait_for(self.manager, queued['id'])['status'], 'cancelled')
+
+    def test_03_failures_are_recorded(self):
+        upload = self.manager.save_upload(io.BytesIO(b'[{"date": "2024-01-01"}, oops]'))
+        job = self.manager.submit('import', 1, {"format": "json"}, upload=upload)
+        job = wait_for(self.manager, job['id'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('Element 2', job['error'])
+        with self.assertRaises(jobs.JobError):
+            self.manager.submit('export', 1, {"format": "xml"})
+        with self.assertRaises(jobs.JobError):
+            self.manager.submit('nope', 1)
+
+    def test_04_restart_recovery(self):
+        self.manager.stop(timeout=5)
+        with db.connection() as conn:
+            conn.execute("INSERT INTO jobs (user_id, kind, status) VALUES (1, 'rebuild', 'running')")
+            conn.execute("INSERT INTO jobs (user_id, kind, status) VALUES (1, 'rebuild', 'queued')")
+            conn.execute('''INSERT INTO jobs (user_id, kind, status, finished_at)
+                            VALUES (1, 'rebuild', 'succeeded', datetime('now', '-30 days'))''')
+        self.manager = jobs.JobManager(db.DB_PATH, self.manager.directory, workers=1)
+        self.manager.start()
+
+        interrupted, queued = [j for j in reversed(self.manager.list(1))]
+        self.assertEqual(interrupted['status'], 'failed')
+        self.assertEqual(wait_for(self.manager, queued['id'])['status'], 'succeeded')
+        # The old finished job was purged
+        self.assertEqual(len(self.manager.list(1)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
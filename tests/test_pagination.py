@@ -0,0 +1,82 @@
+import unittest
+import sys
+import os
+import random
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import transactions
+from db_case import SharedDatabaseTestCase
+
+class TestKeysetPagination(SharedDatabaseTestCase):
+    db_name = 'pages.db'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rnd = random.Random(3)
+        with db.connection() as conn:
+            # Few distinct dates and amounts, so pages break inside runs of equal sort values
+            conn.executemany('''
+                INSERT INTO transactions (user_id, amount, type, category, description, source, date)
+                VALUES (1, ?, ?, ?, ?, 'cash', ?)
+            ''', [(rnd.choice([10, 20, 30]), rnd.choice(['income', 'expense']), rnd.choice(['Food', 'Rent']),
+                   f"Row {i}", f"2024-01-{rnd.randint(1, 5):02d}") for i in range(237)])
+
+    def params(self, **kwargs):
+        return {k: [str(v)] for k, v in kwargs.items()}
+
+    def walk(self, limit, **kwargs):
+        items, cursor, pages = [], None, 0
+        while True:
+            query = dict(kwargs, limit=limit)
+            if cursor:
+                query['cursor'] = cursor
+            with db.connection() as conn:
+                page = transactions.list_page(conn, self.params(**query), 1)
+            items += page['items']
+            pages += 1
+            cursor = page['next_cursor']
+            if not cursor:
+                return items, pages
+
+    def test_01_pages_cover_full_list_in_order(self):
+        for sort_by in transactions.SORT_COLUMNS:
+            for order in ('asc', 'desc'):
+                with db.connection() as conn:
+                    fields, rows = transactions.list_rows(conn, self.params(sort_by=sort_by, order=order), 1)
+                    expected = [dict(zip(fields, row)) for row in rows]
+                items, pages = self.walk(50, sort_by=sort_by, order=order)
+                self.assertEqual(items, expected, f"{sort_by} {order}")
+                self.assertEqual(pages, 5)
+
+    def test_02_filters_apply_to_pages(self):
+        items, _ = self.walk(20, category='Food', type='expense', start_date='2024-01-02', end_date='2024-01-04')
+        self.assertTrue(items)
+        for item in items:
+            self.assertEqual((item['category'], item['type']), ('Food', 'expense'))
+            self.assertTrue('2024-01-02' <= item['date'] <= '2024-01-04')
+
+    def test_03_projection_and_total(self):
+        with db.connection() as conn:
+            page = transactions.list_page(conn, self.params(limit=5, fields='amount,date', include_total='true',
+                                                            sort_by='amount'), 1)
+        self.assertEqual(len(page['items']), 5)
+        self.assertEqual(list(page['items'][0].keys()), ['amount', 'date'])
+        self.assertEqual(page['total_count'], 237)
+        with db.connection() as conn:
+            page = transactions.list_page(conn, self.params(limit=5), 1)
+        self.assertNotIn('total_count', page)
+
+    def test_04_bad_input(self):
+        with db.connection() as conn:
+            for query in [dict(limit='x'), dict(limit=0), dict(fields='amount,password_hash'),
+                          dict(limit=5, cursor='not-a-cursor')]:
+                with self.assertRaises(transactions.QueryError):
+                    transactions.list_page(conn, self.params(**query), 1)
+            cursor = transactions.list_page(conn, self.params(limit=5), 1)['next_cursor']
+            with self.assertRaises(transactions.QueryError):
+                transactions.list_page(conn, self.params(limit=5, cursor=cursor, sort_by='amount'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import unittest
+import sys
+import os
+import random
+import threading
+import time
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import logic
+from backend import portfolio
+from backend import rates
+from db_case import DatabaseTestCase
+
+INSERT_TRADE = '''INSERT INTO investment_transactions (user_id, date, symbol, asset_type, type, quantity, price, fee, tax)
+                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+def replay_all(conn, user_id, currency):
+    # Full replay of the history, as calculate_portfolio did before checkpoints
+    matrix = rates.RateMatrix.load(conn)
+    positions = {}
+    rows = conn.execute('SELECT * FROM investment_transactions WHERE user_id = ? ORDER BY date, id', (user_id,))
+    for row in rows:
+        position = positions.setdefault(row['symbol'], {'asset_type': row['asset_type'], 'quantity': 0.0,
+                                                        'total_cost': 0.0, 'realized_pl': 0.0, 'cash_flow': 0.0})
+        portfolio.apply_trade(position, row, matrix.factor('VND', currency, row['date']))
+    return positions
+
+def random_trade(rnd, user_id=1):
+    return (user_id, f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", rnd.choice(['AAA', 'BBB', 'CCC']),
+            'stock', rnd.choice(['buy', 'buy', 'sell', 'dividend']), rnd.randint(1, 100),
+            rnd.randint(10, 50) * 1000, rnd.randint(0, 5) * 100, rnd.randint(0, 3) * 100)
+
+class TestPortfolioCheckpoints(DatabaseTestCase):
+    db_name = 'portfolio.db'
+
+    def setUp(self):
+        super().setUp()
+        self.rnd = random.Random(3)
+        with db.connection() as conn:
+            conn.executemany(INSERT_TRADE, [random_trade(self.rnd) for _ in range(300)])
+            rates.set_rate(conn, 'USD', 'VND', '2024-06-10', 26000)
+
+    def sync(self, currency):
+        with db.connection() as conn:
+            matrix = rates.RateMatrix.load(conn)
+            version = conn.execute("SELECT version FROM data_versions WHERE table_name = 'exchange_rates'").fetchone()[0]
+            return portfolio.sync(conn, 1, currency, matrix, version)
+
+    def assert_matches_full_replay(self, currency):
+        with db.connection() as conn:
+            expected = replay_all(conn, 1, currency)
+            stored = {row['symbol']: dict(row) for row in portfolio.positions(conn, 1, currency)}
+        self.assertEqual(sorted(stored), sorted(expected))
+        for symbol, position in expected.items():
+            for field in ('quantity', 'total_cost', 'realized_pl', 'cash_flow'):
+                self.assertAlmostEqual(stored[symbol][field], position[field], places=6, msg=(symbol, field))
+
+    def test_01_incremental_and_back_dated_writes(self):
+        self.assertEqual(self.sync('VND'), 300)
+        self.assertEqual(self.sync('USD'), 300)
+        self.assertEqual(self.sync('VND'), 0)
+
+        # A trade after the last one replays only itself, in each built currency
+        with db.connection() as conn:
+            conn.execute(INSERT_TRADE, (1, '2024-12-30', 'AAA', 'stock', 'buy', 5, 40000, 0, 0))
+        self.assertEqual(self.sync('VND'), 2)
+
+        # Back-dated inserts, updates and deletes replay from the earliest date touched
+        with db.connection() as conn:
+            conn.executemany(INSERT_TRADE, [random_trade(self.rnd) for _ in range(5)])
+            ids = [row[0] for row in conn.execute('SELECT id FROM investment_transactions')]
+            for trade_id in self.rnd.sample(ids, 10):
+                conn.execute('UPDATE investment_transactions SET quantity = quantity + 1 WHERE id = ?', (trade_id,))
+            conn.executemany('DELETE FROM investment_transactions WHERE id = ?',
+                             [(i,) for i in self.rnd.sample(ids, 20)])
+            conn.execute("UPDATE investment_transactions SET symbol = 'DDD' WHERE id = ?", (ids[0],))
+        replayed = self.sync('VND')
+        self.assertGreater(replayed, 0)
+        self.assertLess(replayed, 2 * 290)
+        self.assert_matches_full_replay('VND')
+        self.assert_matches_full_replay('USD')
+
+    def test_02_rate_changes_rebuild_other_currencies(self):
+        self.sync('VND')
+        self.sync('USD')
+        with db.connection() as conn:
+            rates.set_rate(conn, 'USD', 'VND', '2024-03-01', 24000)
+        self.assertEqual(self.sync('VND'), 0)
+        self.assertEqual(self.sync('USD'), 300)
+        self.assert_matches_full_replay('USD')
+
+    def test_03_calculate_portfolio(self):
+        result = logic.calculate_portfolio(1, 'VND')
+        with db.connection() as conn:
+            expected = replay_all(conn, 1, 'VND')
+        held = [s for s, p in expected.items() if p['quantity'] > portfolio.MIN_QUANTITY]
+        self.assertEqual(sorted(h['symbol'] for h in result['holdings']), sorted(held))
+        self.assertAlmostEqual(result['summary']['net_cash_flow'], sum(p['cash_flow'] for p in expected.values()))
+        self.assertAlmostEqual(result['summary']['total_invested'], sum(expected[s]['total_cost'] for s in held))
+
+        with db.connection() as conn:
+            portfolio.reset(conn, 1)
+        logic.RESULT_CACHE.clear()
+        self.assertEqual(logic.calculate_portfolio(1, 'VND')['summary'], result['summary'])
+
+    def test_04_concurrent_build_and_same_date_write(self):
+        self.sync('VND')
+        with db.connection() as conn:
+            conn.execute(INSERT_TRADE, (1, '2024-12-30', 'AAA', 'stock', 'buy', 5, 40000, 0, 0))
+
+        # The first sync stops in its first replay while another request builds USD
+        # and writes a trade on the date already marked dirty
+        replay = portfolio._replay
+        paused, resume = threading.Event(), threading.Event()
+        first = threading.get_ident()
+        def paused_replay(*args):
+            if threading.get_ident() == first and not paused.is_set():
+                paused.set()
+                resume.wait(5)
+            return replay(*args)
+
+        def build_and_write():
+            self.sync('USD')
+            with db.connection() as conn:
+                conn.execute(INSERT_TRADE, (1, '2024-12-30', 'AAA', 'stock', 'buy', 7, 41000, 0, 0))
+
+        other = threading.Thread(target=build_and_write)
+        def interleave():
+            paused.wait(5)
+            other.start()
+            # Long enough for the other request to finish, unless it waits on the lock
+            time.sleep(0.2)
+            resume.set()
+
+        portfolio._replay = paused_replay
+        try:
+            threading.Thread(target=interleave).start()
+            self.sync('VND')
+            other.join(10)
+        finally:
+            portfolio._replay = replay
+        self.sync('USD')
+        self.assert_matches_full_replay('VND')
+        self.assert_matches_full_replay('USD')
+
+if __name__ == '__main__':
+    unittest.main()
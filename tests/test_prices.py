@@ -0,0 +1,79 @@
+import unittest
+import sys
+import os
+import io
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import importer
+from backend import logic
+from backend import prices
+from backend import rates
+from db_case import DatabaseTestCase
+
+PRICE_CSV = """symbol,date,close
+AAA,2024-01-02,10000
+AAA,2024-01-05,11000
+AAA,2024-02-01,12000
+BBB,2024-01-03,50000
+BBB,2024-01-31,
+CCC,01/02/2024,1
+AAA,2024-01-05,10500
+"""
+
+class TestPrices(DatabaseTestCase):
+    db_name = 'prices.db'
+
+    def setUp(self):
+        super().setUp()
+        with db.connection() as conn:
+            self.summary = prices.load_records(conn, importer.parse_csv(io.StringIO(PRICE_CSV)))
+
+    def test_01_load_csv(self):
+        self.assertEqual(self.summary['loaded'], 5)
+        self.assertEqual(self.summary['rejected'], 2)
+        self.assertEqual([e['row'] for e in self.summary['errors']], [6, 7])
+        with db.connection() as conn:
+            # A second close for the same symbol and date replaces the first
+            self.assertEqual(conn.execute("SELECT close FROM prices WHERE symbol = 'AAA' AND date = '2024-01-05'")
+                             .fetchone()[0], 10500)
+
+    def test_02_as_of_lookups(self):
+        with db.connection() as conn:
+            self.assertEqual(prices.latest(conn, ['AAA', 'BBB', 'ZZZ'], '2024-01-31'),
+                             {'AAA': ('2024-01-05', 10500), 'BBB': ('2024-01-03', 50000)})
+            self.assertEqual(prices.latest(conn, ['AAA', 'BBB'], '2024-01-02'), {'AAA': ('2024-01-02', 10000)})
+            self.assertEqual(prices.latest(conn, [], '2024-01-02'), {})
+            # The close in effect on the start date, then every later one
+            rows = prices.closes(conn, ['AAA', 'BBB'], '2024-01-04', '2024-01-31').fetchall()
+            self.assertEqual(sorted(tuple(r) for r in rows), [('AAA', '2024-01-02', 10000), ('AAA', '2024-01-05', 10500),
+                                                              ('BBB', '2024-01-03', 50000)])
+            rows = prices.as_of(conn, ['AAA', 'BBB'], ['2024-01-02', '2024-01-31', '2024-03-01']).fetchall()
+            self.assertEqual(sorted(tuple(r) for r in rows if r[2] is not None),
+                             [('AAA', '2024-01-02', 10000), ('AAA', '2024-01-31', 10500), ('AAA', '2024-03-01', 12000),
+                              ('BBB', '2024-01-31', 50000), ('BBB', '2024-03-01', 50000)])
+
+    def test_03_portfolio_valuation(self):
+        with db.connection() as conn:
+            conn.executemany('''INSERT INTO investment_transactions (user_id, date, symbol, asset_type, type, quantity, price, fee, tax)
+                                VALUES (1, ?, ?, 'stock', 'buy', ?, ?, 0, 0)''',
+                             [('2024-01-02', 'AAA', 10, 10000), ('2024-01-02', 'DDD', 5, 2000)])
+            rates.set_rate(conn, 'USD', 'VND', '2024-01-01', 25000)
+        result = logic.calculate_portfolio(1, 'VND')
+        holdings = {h['symbol']: h for h in result['holdings']}
+        self.assertEqual(holdings['AAA']['market_price'], 12000)
+        self.assertEqual(holdings['AAA']['price_date'], '2024-02-01')
+        self.assertAlmostEqual(holdings['AAA']['pl_percent'], 20.0)
+        # No close for DDD: valued at cost
+        self.assertEqual(holdings['DDD']['market_price'], 2000)
+        self.assertIsNone(holdings['DDD']['price_date'])
+        self.assertEqual(result['summary']['total_current_value'], 120000 + 10000)
+
+        # A new close changes the prices version, so the cached result is not reused
+        with db.connection() as conn:
+            prices.load_records(conn, [(1, {"symbol": "DDD", "date": "2024-03-01", "close": "3000"})])
+        result = logic.calculate_portfolio(1, 'USD')
+        self.assertAlmostEqual(result['summary']['total_current_value'], (120000 + 15000) / 25000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import sys
+import os
+import io
+import json
+import pstats
+import sqlite3
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import profiling
+from backend import server
+from backend.router import Route
+
+def work():
+    conn = sqlite3.connect(':memory:')
+    rows = conn.execute('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 2000) SELECT i FROM n').fetchall()
+    conn.close()
+    return json.dumps([{"i": i} for (i,) in rows])
+
+class FakeHandler:
+    path = '/api/stats?period=all'
+    response_status = 200
+
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+class TestRequestProfiling(unittest.TestCase):
+
+    def record(self, profiler, reason='sample'):
+        session = profiler.start(reason)
+        work()
+        return profiler.stop(session, method='GET', route='/api/stats', path='/api/stats', status=200)
+
+    def test_01_requests_picked(self):
+        profiler = profiling.RequestProfiler(sample_percent=0, token='s3cret')
+        self.assertTrue(profiler.enabled)
+        self.assertEqual(profiler.wanted('s3cret'), 'header')
+        self.assertIsNone(profiler.wanted('guess'))
+        self.assertIsNone(profiler.wanted(None))
+        self.assertEqual(profiling.RequestProfiler(sample_percent=100, token='').wanted('s3cret'), 'sample')
+        self.assertFalse(profiling.RequestProfiler(sample_percent=0, token='').enabled)
+
+    def test_02_latest_profiles_are_kept(self):
+        profiler = profiling.RequestProfiler(sample_percent=100, token='', keep=2)
+        for _ in range(3):
+            self.record(profiler)
+        self.assertEqual([p['id'] for p in profiler.list()], [3, 2])
+        self.assertNotIn('stats', profiler.list()[0])
+        self.assertIsNone(profiler.get(1))
+        # Only one request is profiled at a time
+        session = profiler.start('sample')
+        self.assertIsNone(profiler.start('sample'))
+        profiler.stop(session, method='GET', route='/', path='/', status=200)
+        session = profiler.start('sample')
+        self.assertIsNotNone(session)
+        profiler.stop(session, method='GET', route='/', path='/', status=200)
+
+    def test_03_formats(self):
+        profiler = profiling.RequestProfiler(sample_percent=100, token='', trace_memory=True)
+        profile = self.record(profiler)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreater(profile['memory']['peak_kb'], 0)
+        self.assertGreater(profile['calls'], 0)
+
+        text, content_type = profiling.render(profile, 'text', 'tottime', 5)
+        self.assertTrue(content_type.startswith('text/plain'))
+        self.assertIn(b'Ordered by: internal time', text)
+        self.assertIn(b'Memory: peak', text)
+
+        data, _ = profiling.render(profile, 'pstats')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'profile.pstats')
+            with open(path, 'wb') as f:
+                f.write(data)
+            stats = pstats.Stats(path, stream=io.StringIO())
+        self.assertIn('work', {name for _, _, name in stats.stats})
+
+        collapsed, _ = profiling.render(profile, 'collapsed')
+        stacks = [line.rsplit(' ', 1)[0].split(';') for line in collapsed.decode().splitlines()]
+        self.assertTrue(any(stack[-2:] == [f"work (test_profiling.py:{work.__code__.co_firstlineno})",
+                                           "<method 'execute' of 'sqlite3.Connection' objects>"] for stack in stacks))
+
+        for args in (('flame',), ('text', 'bogus'), ('text', 'cumulative', 0)):
+            with self.assertRaises(profiling.ProfileError):
+                profiling.render(profile, *args)
+
+    def test_04_collapsed_stacks_split_time_between_callers(self):
+        a, b, c = ('app.py', 1, 'a'), ('app.py', 10, 'b'), ('~', 0, "<method 'execute'>")
+        stats = {
+            a: (1, 1, 0.1, 1.0, {}),
+            b: (1, 1, 0.2, 0.4, {a: (1, 1, 0.2, 0.4)}),
+            c: (2, 2, 0.3, 0.7, {a: (1, 1, 0.2, 0.5), b: (1, 1, 0.1, 0.2)}),
+        }
+        self.assertEqual(profiling.collapsed_stacks(stats).splitlines(), [
+            "a (app.py:1) 100000",
+            "a (app.py:1);<method 'execute'> 214286",
+            "a (app.py:1);b (app.py:10) 200000",
+            "a (app.py:1);b (app.py:10);<method 'execute'> 85714",
+        ])
+
+    def test_05_middleware_is_installed_only_when_profiling(self):
+        old = profiling.PROFILER
+        def endpoint(handler, arg, params):
+            return work()
+        try:
+            profiling.PROFILER = profiling.RequestProfiler(sample_percent=0, token='')
+            self.assertIs(server.profile(Route('GET', '/api/stats', None), endpoint), endpoint)
+
+            profiling.PROFILER = profiling.RequestProfiler(sample_percent=0, token='s3cret')
+            self.assertIs(server.profile(Route('GET', '/api/metrics', None, profile=False), endpoint), endpoint)
+            profiled = server.profile(Route('GET', '/api/stats', None), endpoint)
+            profiled(FakeHandler(), {}, {})
+            self.assertEqual(profiling.PROFILER.list(), [])
+            self.assertEqual(profiled(FakeHandler({profiling.HEADER: 's3cret'}), {}, {}), work())
+            [summary] = profiling.PROFILER.list()
+            self.assertEqual((summary['route'], summary['path'], summary['status'], summary['reason']),
+                             ('/api/stats', '/api/stats?period=all', 200, 'header'))
+        finally:
+            profiling.PROFILER = old
+
+if __name__ == '__main__':
+    unittest.main()
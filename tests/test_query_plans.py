@@ -0,0 +1,139 @@
+import unittest
+import sys
+import os
+import io
+import re
+import sqlite3
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend.server import ParFinHandler
+from db_case import SharedDatabaseTestCase
+
+LEDGER_TABLES = ('transactions', 'fixed_items', 'investment_transactions', 'fund_balances', 'monthly_rollups', 'data_versions',
+                 'portfolio_checkpoints', 'portfolio_positions', 'prices')
+FULL_SCAN = re.compile(r'^SCAN (%s)\b(?! USING (COVERING )?INDEX)' % '|'.join(LEDGER_TABLES))
+
+class CaptureHandler(ParFinHandler):
+    # Runs handle_api_get in-process: no socket, response captured in memory
+    def __init__(self):
+        self.wfile = io.BytesIO()
+        self.headers = {}
+        self.request_version = 'HTTP/1.1'
+        self.response_etag = None
+        self.status = None
+
+    def send_response(self, code, message=None):
+        self.status = code
+
+    def send_header(self, keyword, value):
+        pass
+
+    def end_headers(self):
+        pass
+
+class TestQueryPlans(SharedDatabaseTestCase):
+    """Every ledger query issued by an endpoint must be answered from an index."""
+    db_name = 'plans.db'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.old_connect = db.get_db_connection
+
+        # Record every statement run on pooled connections
+        cls.statements = []
+        def traced_connection():
+            conn = cls.old_connect()
+            conn.set_trace_callback(cls.statements.append)
+            return conn
+        db.get_db_connection = traced_connection
+
+        # Two users, so a user_id filter alone is selective
+        with db.connection() as conn:
+            conn.executemany('''
+                INSERT INTO transactions (user_id, amount, currency, type, category, description, source, date)
+                VALUES (?, ?, 'VND', ?, ?, 'Seed', 'cash', ?)
+            ''', [(i % 2 + 1, 1000 * i, ('income', 'expense')[i % 2], ('Food', 'Salary', 'Rent')[i % 3],
+                   f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}") for i in range(300)])
+            conn.executemany('''
+                INSERT INTO investment_transactions (user_id, date, symbol, type, quantity, price)
+                VALUES (?, ?, ?, 'buy', 1, 100)
+            ''', [(i % 2 + 1, f"2024-{i % 12 + 1:02d}-01", ('AAA', 'BBB')[i % 3 % 2]) for i in range(50)])
+            conn.execute("INSERT INTO fixed_items (user_id, amount, type, category) VALUES (1, 10, 'expense', 'Rent')")
+            conn.executemany('INSERT INTO prices (symbol, date, close) VALUES (?, ?, ?)',
+                             [(symbol, f"2024-{m:02d}-{d:02d}", 100 + d) for symbol in ('AAA', 'BBB', 'CCC', 'DDD')
+                              for m in range(1, 13) for d in range(1, 29)])
+
+    @classmethod
+    def tearDownClass(cls):
+        db.get_db_connection = cls.old_connect
+        super().tearDownClass()
+
+    def run_get(self, path, params):
+        del self.statements[:]
+        handler = CaptureHandler()
+        handler.handle_api_get(path, {k: [v] for k, v in params.items()})
+        self.assertEqual(handler.status, 200, handler.wfile.getvalue())
+        return [s for s in self.statements if s.lstrip().upper().startswith(('SELECT', 'WITH'))]
+
+    def assert_indexed(self, path, params):
+        queries = self.run_get(path, params)
+        checked = 0
+        conn = sqlite3.connect(db.DB_PATH)
+        try:
+            for sql in queries:
+                if not any(re.search(r'\b%s\b' % t, sql) for t in LEDGER_TABLES):
+                    continue
+                plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+                for detail in plan:
+                    self.assertIsNone(FULL_SCAN.match(detail), f"{path} {params}: {sql}\n{plan}")
+                checked += 1
+        finally:
+            conn.close()
+        self.assertGreater(checked, 0, f"{path} issued no ledger queries")
+
+    def test_transactions_list(self):
+        cases = [
+            {},
+            {'period': 'custom', 'start_date': '2024-03-01', 'end_date': '2024-03-31'},
+            {'start_date': '2024-01-01', 'end_date': '2024-12-31', 'category': 'Food'},
+            {'start_date': '2024-01-01', 'end_date': '2024-12-31', 'type': 'expense'},
+            {'start_date': '2024-01-01', 'end_date': '2024-12-31', 'sort_by': 'amount', 'order': 'asc'},
+            {'sort_by': 'amount'},
+            {'category': 'Rent', 'sort_by': 'category'},
+            {'limit': '50', 'include_total': 'true'},
+            {'limit': '50', 'sort_by': 'amount', 'order': 'asc', 'fields': 'id,amount'},
+        ]
+        for params in cases:
+            self.assert_indexed('/api/transactions', params)
+
+    def test_transactions_search(self):
+        # The full-text index drives every search; transactions is only read by id
+        for params in ({'q': 'seed'}, {'q': 'se*', 'category': 'Food', 'limit': '20', 'include_total': '1'},
+                       {'q': '"seed"', 'start_date': '2024-03-01', 'end_date': '2024-03-31', 'type': 'expense'}):
+            self.assert_indexed('/api/transactions/search', params)
+
+    def test_export(self):
+        for month in ('2024-03', '2024', 'all'):
+            self.assert_indexed('/api/export', {'month': month, 'format': 'json'})
+        self.assert_indexed('/api/export', {'format': 'csv', 'category': 'Food', 'start_date': '2024-02-01'})
+
+    def test_stats(self):
+        self.assert_indexed('/api/stats', {'period': 'custom', 'start_date': '2024-01-01', 'end_date': '2024-06-30'})
+        self.assert_indexed('/api/stats', {})
+
+    def test_fixed_items(self):
+        self.assert_indexed('/api/fixed_items', {})
+
+    def test_investments(self):
+        self.assert_indexed('/api/investments', {})
+        self.assert_indexed('/api/investments/portfolio', {'currency': 'USD'})
+
+    def test_history_and_prices(self):
+        for interval in ('day', 'week', 'month'):
+            self.assert_indexed('/api/history', {'start_date': '2024-03-15', 'end_date': '2024-10-01', 'interval': interval})
+        self.assert_indexed('/api/prices', {'symbols': 'AAA,CCC', 'date': '2024-06-15'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import sys
+import os
+import random
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import logic
+from backend import rates
+from db_case import DatabaseTestCase
+
+class TestRateMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.matrix = rates.RateMatrix([
+            ('USD', 'VND', '2024-01-01', 24000),
+            ('USD', 'VND', '2024-03-01', 25000),
+            ('EUR', 'USD', '2024-02-01', 1.1),
+        ])
+
+    def test_01_dated_inverse_and_cross_rates(self):
+        m = self.matrix
+        self.assertEqual(m.factor('USD', 'VND', '2024-02-15'), 24000)
+        self.assertEqual(m.factor('USD', 'VND', '2024-03-01'), 25000)
+        # Before the first entry the earliest rate applies; no date means the latest
+        self.assertEqual(m.factor('USD', 'VND', '2020-01-01'), 24000)
+        self.assertEqual(m.factor('USD', 'VND'), 25000)
+        self.assertAlmostEqual(m.factor('VND', 'USD', '2024-02-15'), 1 / 24000)
+        self.assertAlmostEqual(m.factor('EUR', 'VND', '2024-02-15'), 1.1 * 24000)
+        self.assertAlmostEqual(m.factor('VND', 'EUR', '2024-03-15'), 1 / (1.1 * 25000))
+        # Unknown currencies pass through unchanged
+        self.assertEqual(m.factor('JPY', 'VND', '2024-02-15'), 1.0)
+
+    def test_02_changes_within(self):
+        m = self.matrix
+        self.assertTrue(m.changes_within('USD', 'VND'))
+        self.assertFalse(m.changes_within('USD', 'VND', '2024-01-01', '2024-02-29'))
+        self.assertTrue(m.changes_within('USD', 'VND', '2024-02-01', '2024-03-31'))
+        self.assertFalse(m.changes_within('USD', 'VND', '2024-03-01', None))
+        # A derived pair changes with any of its legs
+        self.assertFalse(m.changes_within('EUR', 'VND', '2024-01-15', '2024-02-15'))
+        self.assertTrue(m.changes_within('EUR', 'VND', '2024-02-15', '2024-03-15'))
+
+    def test_03_validation(self):
+        for args in [('USD', 'USD', '2024-01-01', 1), ('USD', 'VND', '2024-13-01', 1),
+                     ('USD', 'VND', '2024-01-01', 0), ('USD', None, '2024-01-01', 1)]:
+            with self.assertRaises(rates.RateError):
+                rates._validate(*args)
+
+class TestDatedConversion(DatabaseTestCase):
+    db_name = 'rates.db'
+
+    def test_01_migration_seeds_the_settings_rate(self):
+        with db.connection() as conn:
+            self.assertEqual(rates.list_rates(conn),
+                             [{"base": "USD", "quote": "VND", "date": "1970-01-01", "rate": 25000.0}])
+            self.assertEqual(logic.get_exchange_rate(conn), 25000.0)
+
+    def test_02_period_stats_use_the_rate_of_each_day(self):
+        rnd = random.Random(7)
+        rows = [(rnd.choice([10000, 25000, 1000000]), rnd.choice(['VND', 'USD']), rnd.choice(['income', 'expense']),
+                 rnd.choice(['Food', 'Rent', 'Salary']), rnd.choice(['cash', 'bank']),
+                 f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}") for _ in range(500)]
+        with db.connection() as conn:
+            conn.executemany('''INSERT INTO transactions (user_id, amount, currency, type, category, source, date)
+                                VALUES (1, ?, ?, ?, ?, ?, ?)''', rows)
+            # Mid-month changes are converted per day, changes on the 1st per month
+            for month in range(2, 13):
+                day = '01' if month % 3 == 0 else '15'
+                rates.set_rate(conn, 'USD', 'VND', f'2024-{month:02d}-{day}', 25000 + month * 100)
+            matrix = rates.RateMatrix.load(conn)
+
+        for currency in ('VND', 'USD'):
+            for start, end in [('2024-01-01', '2024-12-31'), ('2024-03-10', '2024-06-20'), ('2024-05-01', '2024-05-14')]:
+                expected = {'income': 0.0, 'expense': 0.0}
+                for amount, from_currency, kind, _, _, date in rows:
+                    if start <= date <= end:
+                        expected[kind] += amount * matrix.factor(from_currency, currency, date)
+                stats = logic.calculate_stats(1, start, end, currency)['period_stats']
+                self.assertAlmostEqual(stats['income']['total'], expected['income'], places=4)
+                self.assertAlmostEqual(stats['expense']['total'], expected['expense'], places=4)
+
+        # Balances are valued at the latest rate
+        usd_income = sum(r[0] for r in rows if r[1] == 'USD' and r[2] == 'income')
+        vnd_income = sum(r[0] for r in rows if r[1] == 'VND' and r[2] == 'income')
+        balances = logic.calculate_stats(1, None, None, 'VND')['balances']
+        expense = sum(r[0] * (26200 if r[1] == 'USD' else 1) for r in rows if r[2] == 'expense')
+        self.assertAlmostEqual(balances['grand_total'], vnd_income + usd_income * 26200 - expense, places=2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import sys
+import os
+import datetime
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import balances
+from backend import jobs
+from backend import recurring
+from db_case import DatabaseTestCase
+
+class TestFixedItemMaterialization(DatabaseTestCase):
+    db_name = 'recurring.db'
+
+    def setUp(self):
+        super().setUp()
+        with db.connection() as conn:
+            conn.executemany('''
+                INSERT INTO fixed_items (user_id, amount, type, category, description, source, destination, destination_category, fund)
+                VALUES (?, ?, ?, ?, ?, 'bank', ?, ?, NULL)
+            ''', [(1, 3000, 'income', 'Salary', 'Monthly salary', None, None),
+                  (1, 800, 'expense', 'Rent', 'Flat', None, None),
+                  (1, 500, 'allocation', 'Saving', '', 'cash', 'Saving'),
+                  (2, 100, 'expense', 'Phone', None, None, None)])
+
+    def generated(self, user_id=1):
+        with db.connection() as conn:
+            return [tuple(r) for r in conn.execute('''
+                SELECT fixed_item_id, period, date FROM transactions WHERE user_id = ? ORDER BY period, fixed_item_id
+            ''', (user_id,))]
+
+    def test_01_range_is_generated_once(self):
+        periods = recurring.month_dates('2023-11', '2025-10', day=31)
+        self.assertEqual(len(periods), 24)
+        self.assertEqual(periods[3], ('2024-02', '2024-02-29'))
+        with db.connection() as conn:
+            self.assertEqual(recurring.materialize(conn, periods, 1), 72)
+        with db.connection() as conn:
+            # Repeating the backfill, or an overlapping range, adds only missing months
+            self.assertEqual(recurring.materialize(conn, periods, 1), 0)
+            self.assertEqual(recurring.materialize(conn, recurring.month_dates('2025-09', '2025-12'), 1), 6)
+            self.assertEqual(balances.verify(conn), [])
+        rows = self.generated()
+        self.assertEqual(len(rows), 78)
+        self.assertEqual(len(set((item, period) for item, period, _ in rows)), 78)
+        self.assertEqual(rows[-1][1:], ('2025-12', '2025-12-01'))
+        self.assertEqual(self.generated(2), [])
+
+    def test_02_transactions_generated_before_the_key_are_linked(self):
+        # As the old endpoint did: plain copies without fixed_item_id
+        with db.connection() as conn:
+            conn.execute('''
+                INSERT INTO transactions (user_id, amount, type, category, description, source, destination, destination_category, fund, date)
+                SELECT user_id, amount, type, category, description, source, destination, destination_category, fund, '2024-03-01'
+                FROM fixed_items WHERE user_id = 1
+            ''')
+            conn.execute('''
+                INSERT INTO transactions (user_id, amount, type, category, description, source, date)
+                VALUES (1, 800, 'expense', 'Rent', 'Flat', 'bank', '2024-03-15')
+            ''')
+            self.assertEqual(recurring.link_existing(conn), 3)
+            self.assertEqual(recurring.materialize(conn, recurring.parse_request({"date": "2024-03-20"}), 1), 0)
+            self.assertEqual(recurring.materialize(conn, recurring.parse_request({"start_month": "2024-03",
+                                                                                 "end_month": "2024-04"}), 1), 3)
+
+    def test_03_bad_requests(self):
+        for data in ({}, {"date": "March"}, {"start_month": "2024-13"}, {"start_month": "2024-05", "end_month": "2024-04"},
+                     {"start_month": "2024-01", "day": 0}, {"start_month": "2000-01", "end_month": "2024-01"}):
+            with self.assertRaises(recurring.RecurringError, msg=data):
+                recurring.parse_request(data)
+
+    def test_04_scheduler_generates_each_new_month_for_all_users(self):
+        today = datetime.date(2024, 1, 31)
+        scheduler = jobs.FixedItemScheduler(day=5, today=lambda: today)
+        self.assertEqual(scheduler.run_once(), 4)
+        self.assertEqual(scheduler.run_once(), 0)
+        today = datetime.date(2024, 2, 1)
+        self.assertEqual(scheduler.run_once(), 4)
+        # A restarted scheduler regenerates nothing
+        self.assertEqual(jobs.FixedItemScheduler(day=5, today=lambda: today).run_once(), 0)
+        self.assertEqual([r[2] for r in self.generated(2)], ['2024-01-05', '2024-02-05'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import logic
+from backend import rates
+from backend.result_cache import ResultCache, sizeof
+from db_case import DatabaseTestCase
+
+INSERT_TRANSACTION = '''INSERT INTO transactions (user_id, amount, currency, type, category, source, date)
+                        VALUES (1, ?, 'VND', ?, ?, 'bank', ?)'''
+
+class TestResultCache(unittest.TestCase):
+
+    def test_01_lru_bounds(self):
+        cache = ResultCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        # 'b' was the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        value = {"labels": ["x" * 100] * 10}
+        cache = ResultCache(max_entries=100, max_bytes=sizeof(value) * 2)
+        for key in range(5):
+            cache.put(key, value)
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (2, 3))
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+        # A value larger than the whole cache is not stored
+        cache.put('huge', {"labels": ["x" * 100] * 100})
+        self.assertIsNone(cache.get('huge'))
+
+class TestCachedStats(DatabaseTestCase):
+    db_name = 'cache.db'
+
+    def setUp(self):
+        super().setUp()
+        self.old_cache = logic.RESULT_CACHE
+        logic.RESULT_CACHE = ResultCache()
+        with db.connection() as conn:
+            conn.execute(INSERT_TRANSACTION, (1000000, 'income', 'Salary', '2024-01-05'))
+            conn.execute(INSERT_TRANSACTION, (50000, 'expense', 'Food', '2024-02-05'))
+
+    def tearDown(self):
+        logic.RESULT_CACHE = self.old_cache
+        super().tearDown()
+
+    def test_01_repeated_requests_hit(self):
+        periods = [('2024-01-01', '2024-01-31'), ('2024-02-01', '2024-02-29')]
+        for _ in range(3):
+            for start, end in periods:
+                for currency in ('VND', 'USD'):
+                    logic.calculate_stats(1, start, end, currency)
+            logic.calculate_portfolio(1, 'VND')
+        stats = logic.RESULT_CACHE.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (5, 10))
+        self.assertEqual(logic.calculate_stats(1, *periods[1], 'VND')['period_stats']['expense']['total'], 50000)
+
+    def test_02_writes_and_rate_changes_invalidate(self):
+        before = logic.calculate_stats(1, '2024-02-01', '2024-02-29', 'USD')
+        with db.connection() as conn:
+            conn.execute(INSERT_TRANSACTION, (25000, 'expense', 'Food', '2024-02-06'))
+        after = logic.calculate_stats(1, '2024-02-01', '2024-02-29', 'USD')
+        self.assertAlmostEqual(after['period_stats']['expense']['total'],
+                               before['period_stats']['expense']['total'] + 1)
+
+        with db.connection() as conn:
+            rates.set_rate(conn, 'USD', 'VND', '2024-02-06', 50000)
+        rerated = logic.calculate_stats(1, '2024-02-01', '2024-02-29', 'USD')
+        self.assertAlmostEqual(rerated['period_stats']['expense']['total'], 50000 / 25000 + 25000 / 50000)
+
+        portfolio = logic.calculate_portfolio(1)
+        with db.connection() as conn:
+            conn.execute('''INSERT INTO investment_transactions (user_id, date, symbol, type, quantity, price, fee, tax)
+                            VALUES (1, '2024-02-07', 'AAA', 'buy', 10, 1000, 0, 0)''')
+        self.assertEqual(portfolio['holdings'], [])
+        self.assertEqual(logic.calculate_portfolio(1)['holdings'][0]['symbol'], 'AAA')
+        self.assertEqual(logic.RESULT_CACHE.stats()['hits'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
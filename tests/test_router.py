@@ -0,0 +1,108 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import metrics
+from backend.router import Router, RouteError, UNMATCHED
+
+def endpoint(name):
+    def call(handler, arg, **params):
+        handler.append((name, arg, params))
+    return call
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router(not_found=endpoint('not found'), not_allowed=endpoint('not allowed'))
+        self.router.add('GET', '/api/jobs', endpoint('jobs'))
+        self.router.add('POST', '/api/jobs', endpoint('submit'))
+        self.router.add('GET', '/api/jobs/<int:job_id>', endpoint('job'))
+        self.router.add('GET', '/api/jobs/<int:job_id>/artifact', endpoint('artifact'))
+        self.router.add('POST', '/api/jobs/<int:job_id>/cancel', endpoint('cancel'))
+        self.router.add('GET', '/api/jobs/latest', endpoint('latest'))
+        self.router.add('GET', '/api/users/<name>/<int:job_id>', endpoint('user job'))
+
+    def dispatch(self, method, path, arg=None):
+        calls = []
+        self.router.dispatch(calls, method, path, arg)
+        self.assertEqual(len(calls), 1)
+        return calls[0]
+
+    def test_01_static_and_parameter_routes(self):
+        self.assertEqual(self.dispatch('GET', '/api/jobs', {'q': ['1']}), ('jobs', {'q': ['1']}, {}))
+        self.assertEqual(self.dispatch('POST', '/api/jobs'), ('submit', None, {}))
+        self.assertEqual(self.dispatch('GET', '/api/jobs/12'), ('job', None, {'job_id': 12}))
+        self.assertEqual(self.dispatch('GET', '/api/jobs/12/artifact'), ('artifact', None, {'job_id': 12}))
+        self.assertEqual(self.dispatch('POST', '/api/jobs/7/cancel'), ('cancel', None, {'job_id': 7}))
+        # A literal segment wins over a parameter
+        self.assertEqual(self.dispatch('GET', '/api/jobs/latest'), ('latest', None, {}))
+        self.assertEqual(self.dispatch('GET', '/api/users/an/3'), ('user job', None, {'name': 'an', 'job_id': 3}))
+
+    def test_02_unmatched_requests(self):
+        for path in ('/api/jobs/abc', '/api/jobs/12/cancel/now', '/api/users//3', '/api/nowhere'):
+            self.assertEqual(self.dispatch('GET', path), ('not found', None, {}), path)
+        self.assertEqual(self.dispatch('GET', '/api/jobs/12/cancel'), ('not allowed', None, {'allow': ['POST']}))
+        self.assertEqual(self.dispatch('PUT', '/api/jobs'), ('not allowed', None, {'allow': ['GET', 'POST']}))
+        self.assertEqual(self.router.match('PUT', '/api/nowhere'), (None, []))
+
+    def test_03_middleware_and_defaults(self):
+        order = []
+        def tag(name):
+            def middleware(route, call):
+                def wrapped(handler, arg, params):
+                    order.append((name, route.pattern))
+                    return call(handler, arg, params)
+                return wrapped
+            return middleware
+
+        router = Router(not_found=endpoint('not found'), not_allowed=endpoint('not allowed'), middleware=[tag('outer')])
+        router.add('POST', '/api/bulk_delete', endpoint('bulk'), middleware=[tag('route')], defaults={'operation': 'delete'})
+        router.use(tag('inner'))
+        calls = []
+        router.dispatch(calls, 'POST', '/api/bulk_delete', {})
+        router.dispatch(calls, 'GET', '/api/nowhere', {})
+        self.assertEqual(calls, [('bulk', {}, {'operation': 'delete'}), ('not found', {}, {})])
+        self.assertEqual(order, [('outer', '/api/bulk_delete'), ('inner', '/api/bulk_delete'),
+                                 ('route', '/api/bulk_delete'), ('outer', UNMATCHED), ('inner', UNMATCHED)])
+
+    def test_04_bad_routes(self):
+        with self.assertRaises(RouteError):
+            self.router.add('GET', '/api/jobs', endpoint('again'))
+        with self.assertRaises(RouteError):
+            self.router.add('GET', '/api/jobs/<int:job_id>', endpoint('again'))
+        with self.assertRaises(RouteError):
+            self.router.add('GET', '/api/<float:x>', endpoint('float'))
+
+class TestRequestMetrics(unittest.TestCase):
+
+    def test_render(self):
+        registry = metrics.RequestMetrics()
+        series = registry.series('GET', '/api/jobs/<int:job_id>')
+        self.assertIs(registry.series('GET', '/api/jobs/<int:job_id>'), series)
+        for seconds, status in ((0.003, 200), (0.2, 200), (30, 404)):
+            registry.start(series)
+            registry.finish(series, status, seconds, 100)
+        registry.start(series)
+
+        lines = registry.render().splitlines()
+        labels = 'method="GET",route="/api/jobs/<int:job_id>"'
+        for line in ('# TYPE parfin_http_request_duration_seconds histogram',
+                     'parfin_http_requests_total{%s,status="200"} 2' % labels,
+                     'parfin_http_requests_total{%s,status="404"} 1' % labels,
+                     'parfin_http_request_duration_seconds_bucket{%s,le="0.005"} 1' % labels,
+                     'parfin_http_request_duration_seconds_bucket{%s,le="0.1"} 1' % labels,
+                     'parfin_http_request_duration_seconds_bucket{%s,le="0.25"} 2' % labels,
+                     'parfin_http_request_duration_seconds_bucket{%s,le="10"} 2' % labels,
+                     'parfin_http_request_duration_seconds_bucket{%s,le="+Inf"} 3' % labels,
+                     'parfin_http_request_duration_seconds_count{%s} 3' % labels,
+                     'parfin_http_requests_in_flight{%s} 1' % labels,
+                     'parfin_http_response_bytes_total{%s} 300' % labels):
+            self.assertIn(line, lines)
+
+        registry.reset()
+        self.assertIn('parfin_http_requests_in_flight{%s} 1' % labels, registry.render().splitlines())
+        self.assertNotIn('status="200"', registry.render())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import sys
+import os
+import sqlite3
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import migrations
+from backend import search
+from backend import transactions
+from db_case import DatabaseTestCase
+
+INSERT_TRANSACTION = '''
+    INSERT INTO transactions (user_id, amount, type, category, description, source, fund, date)
+    VALUES (?, 1000, 'expense', ?, ?, 'cash', ?, ?)
+'''
+
+class TestTransactionSearch(DatabaseTestCase):
+    db_name = 'search.db'
+
+    def setUp(self):
+        super().setUp()
+        with db.connection() as conn:
+            conn.executemany(INSERT_TRANSACTION, [
+                (1, 'Transport', 'Grab bike to work', None, '2024-01-02'),
+                (1, 'Food', 'GrabFood lunch', None, '2024-01-03'),
+                (1, 'Bills', 'Tiền điện tháng 1', None, '2024-01-05'),
+                (1, 'Bills', 'ĐIỆN NƯỚC', None, '2024-02-05'),
+                (1, 'Food', 'Dinner <b>with</b> grab driver', 'Together', '2024-02-10'),
+                (1, 'Grab', 'Refund', None, '2024-02-11'),
+                (2, 'Transport', 'Grab bike', None, '2024-01-02'),
+            ])
+
+    def search(self, q, **params):
+        query = {k: [str(v)] for k, v in dict(params, q=q).items()}
+        with db.connection() as conn:
+            return transactions.search_page(conn, query, 1)
+
+    def descriptions(self, q, **params):
+        return [item['description'] for item in self.search(q, **params)['items']]
+
+    def test_01_words_prefixes_and_phrases(self):
+        self.assertEqual(sorted(self.descriptions('grab')),
+                         ['Dinner <b>with</b> grab driver', 'Grab bike to work', 'Refund'])
+        self.assertEqual(len(self.descriptions('grab*')), 4)
+        self.assertEqual(self.descriptions('"bike to"'), ['Grab bike to work'])
+        self.assertEqual(self.descriptions('"to bike"'), [])
+        # Case and diacritics are folded
+        self.assertEqual(sorted(self.descriptions('điện')), ['Tiền điện tháng 1', 'ĐIỆN NƯỚC'])
+        self.assertEqual(self.descriptions('tien'), ['Tiền điện tháng 1'])
+        # Filters of the list endpoint apply
+        self.assertEqual(self.descriptions('grab*', category='Food'), ['GrabFood lunch', 'Dinner <b>with</b> grab driver'])
+        self.assertEqual(self.descriptions('điện', start_date='2024-02-01'), ['ĐIỆN NƯỚC'])
+
+    def test_02_ranking_and_snippets(self):
+        with db.connection() as conn:
+            conn.execute(INSERT_TRANSACTION, (1, 'Food', 'Lunch', 'Grab', '2024-03-01'))
+        items = self.search('grab')['items']
+        # The fund weighs least
+        self.assertEqual(items[-1]['description'], 'Lunch')
+        snippets = {item['description']: item['snippet'] for item in items}
+        self.assertEqual(snippets['Grab bike to work'], '<mark>Grab</mark> bike to work')
+        self.assertEqual(snippets['Dinner <b>with</b> grab driver'],
+                         'Dinner &lt;b&gt;with&lt;/b&gt; <mark>grab</mark> driver')
+        self.assertEqual(snippets['Refund'], 'Refund')
+
+    def test_03_pages_cover_all_matches_in_rank_order(self):
+        full = [item['id'] for item in self.search('grab*', limit=100)['items']]
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 1, 'include_total': 1}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.search('grab*', **params)
+            self.assertEqual(page['total_count'], 4)
+            seen += [item['id'] for item in page['items']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, full)
+
+    def test_04_index_follows_writes(self):
+        with db.connection() as conn:
+            conn.execute("UPDATE transactions SET description = 'Taxi' WHERE description = 'Grab bike to work'")
+            conn.execute("DELETE FROM transactions WHERE description = 'GrabFood lunch'")
+            transactions.bulk_recategorize(conn, {"categories": {"Grab": "Refunds"}}, 1)
+        self.assertEqual(self.descriptions('grab*'), ['Dinner <b>with</b> grab driver'])
+        self.assertEqual(self.descriptions('taxi'), ['Taxi'])
+        self.assertEqual(self.descriptions('refunds'), ['Refund'])
+
+    def test_05_existing_history_is_indexed_by_the_migration(self):
+        path = os.path.join(self.tmp.name, 'legacy.db')
+        conn = sqlite3.connect(path)
+        try:
+            migrations.migrate(conn, target=11)
+            conn.execute(INSERT_TRANSACTION, (1, 'Bills', 'Internet bill', None, '2023-05-01'))
+            conn.commit()
+            migrations.migrate(conn)
+            self.assertEqual(conn.execute("SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH 'internet'")
+                             .fetchall(), [(1,)])
+        finally:
+            conn.close()
+
+    def test_06_queries_are_taken_literally(self):
+        self.assertEqual(search.match_expression('grab OR rent'), '"grab" "OR" "rent"')
+        self.assertEqual(search.match_expression('"tiền điện" gra*'), '"tiền điện" "gra"*')
+        self.assertEqual(search.match_expression('NEAR(a b) "unbalanced'), '"NEAR(a" "b)" "unbalanced"')
+        self.assertEqual(self.descriptions('grab OR bike'), [])
+        for q in ('', '  ', '* - ""'):
+            with self.assertRaises(transactions.QueryError):
+                self.search(q)
+
+if __name__ == '__main__':
+    unittest.main()
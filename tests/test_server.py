@@ -0,0 +1,342 @@
+import unittest
+import http.client
+import json
+import threading
+import time
+import gzip
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import server
+
+HOST = "127.0.0.1"
+PORT = 8000
+
+class TestServer(unittest.TestCase):
+
+    def test_01_keep_alive(self):
+        print("\nTesting HTTP/1.1 keep-alive...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            for path in ['/api/auth/check', '/api/settings', '/', '/missing.js']:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                body = response.read()
+                self.assertEqual(response.version, 11)
+                self.assertEqual(int(response.getheader('Content-Length')), len(body))
+                self.assertFalse(response.will_close)
+            # Every request above went over the same socket
+            self.assertIsNotNone(conn.sock)
+        finally:
+            conn.close()
+        print("Keep-alive verified")
+
+    def test_02_post_keep_alive(self):
+        print("\nTesting POST over a persistent connection...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            for _ in range(3):
+                body = json.dumps({"username": "admin", "password": "admin123"})
+                conn.request('POST', '/api/auth/login', body, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                data = json.loads(response.read())
+                self.assertEqual(response.status, 200)
+                self.assertTrue(data['success'])
+        finally:
+            conn.close()
+
+    def test_02b_invalid_content_length(self):
+        print("\nTesting POST with an invalid Content-Length...")
+        for value in ('abc', '-5'):
+            conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+            try:
+                conn.putrequest('POST', '/api/auth/login')
+                conn.putheader('Content-Length', value)
+                conn.endheaders()
+                response = conn.getresponse()
+                response.read()
+                self.assertEqual(response.status, 400, value)
+                # The end of the body is unknown, so the connection is not reused
+                self.assertTrue(response.will_close)
+            finally:
+                conn.close()
+
+    def test_03_idle_connection_does_not_block(self):
+        print("\nTesting that an idle connection does not block others...")
+        idle = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        idle.request('GET', '/api/auth/check')
+        idle.getresponse().read()
+
+        results = []
+        def worker():
+            conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+            start = time.time()
+            conn.request('GET', '/api/auth/check')
+            response = conn.getresponse()
+            response.read()
+            results.append((response.status, time.time() - start))
+            conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        idle.close()
+
+        self.assertEqual(len(results), 8)
+        for status, duration in results:
+            self.assertEqual(status, 200)
+            self.assertLess(duration, 1.0)
+        print("Concurrent requests served while a connection idled")
+
+    def get(self, conn, path, accept_encoding=None):
+        headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def post(self, conn, path, payload):
+        conn.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        return response, json.loads(response.read())
+
+    def delete_category(self, conn, category):
+        self.post(conn, '/api/transactions/bulk_delete', {"filter": {"category": category}})
+
+    def test_04_negotiated_gzip(self):
+        print("\nTesting negotiated gzip for API responses...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            # Enough rows for /api/transactions to pass COMPRESS_MIN_SIZE, even on an empty database
+            self.delete_category(conn, 'Gzip test')
+            for day in range(1, 21):
+                self.post(conn, '/api/transactions/create', {"amount": 10, "type": "expense", "category": "Gzip test",
+                                                             "description": "gzip", "date": f"2001-01-{day:02d}"})
+            _, before = self.get(conn, '/api/debug/compression')
+            before = json.loads(before)
+
+            response, plain = self.get(conn, '/api/transactions')
+            self.assertIsNone(response.getheader('Content-Encoding'))
+            response, body = self.get(conn, '/api/transactions', 'gzip, deflate')
+            self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+            self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+            self.assertEqual(int(response.getheader('Content-Length')), len(body))
+            self.assertEqual(json.loads(gzip.decompress(body)), json.loads(plain))
+
+            # Under the size threshold
+            response, body = self.get(conn, '/api/auth/check', 'gzip')
+            self.assertIsNone(response.getheader('Content-Encoding'))
+            self.assertEqual(json.loads(body), {"status": "ok"})
+
+            # Streamed responses are compressed chunk by chunk
+            response, body = self.get(conn, '/api/export?format=ndjson', 'gzip')
+            self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+            self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+            rows = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+            self.assertEqual(len(rows), len(json.loads(plain)))
+
+            _, after = self.get(conn, '/api/debug/compression')
+            after = json.loads(after)
+            self.assertGreater(after['responses'], before['responses'])
+            self.assertGreater(after['streams'], before['streams'])
+            self.assertLess(after['ratio'], 1)
+            self.assertGreaterEqual(after['cpu_ms'], before['cpu_ms'])
+        finally:
+            self.delete_category(conn, 'Gzip test')
+            conn.close()
+        print("gzip negotiation verified")
+
+    def test_05_conditional_get(self):
+        print("\nTesting data-version ETags...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            response, body = self.get(conn, '/api/stats?period=all')
+            etag = response.getheader('ETag')
+            self.assertTrue(etag.startswith('W/"'))
+            self.assertEqual(response.getheader('Cache-Control'), 'no-cache')
+
+            conn.request('GET', '/api/stats?period=all', headers={'If-None-Match': etag})
+            response = conn.getresponse()
+            self.assertEqual((response.status, response.read()), (304, b''))
+            self.assertEqual(response.getheader('ETag'), etag)
+
+            # Other query parameters are a different representation
+            response, _ = self.get(conn, '/api/stats?period=this_month')
+            self.assertNotEqual(response.getheader('ETag'), etag)
+
+            # Any write to a table the endpoint reads changes the ETag
+            payload = {"amount": 1, "type": "expense", "category": "ETag test", "date": "2001-01-01"}
+            conn.request('POST', '/api/transactions/create', json.dumps(payload), {'Content-Type': 'application/json'})
+            conn.getresponse().read()
+            conn.request('GET', '/api/stats?period=all', headers={'If-None-Match': etag})
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 200)
+            self.assertNotEqual(response.getheader('ETag'), etag)
+
+            rows = json.loads(self.get(conn, '/api/transactions?category=ETag%20test')[1])
+            for row in rows:
+                conn.request('POST', '/api/transactions/delete', json.dumps({"id": row['id']}),
+                             {'Content-Type': 'application/json'})
+                conn.getresponse().read()
+        finally:
+            conn.close()
+        print("Conditional GET verified")
+
+    def test_06_batch(self):
+        print("\nTesting /api/batch...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            # Rows left by an interrupted run
+            for row in json.loads(self.get(conn, '/api/transactions?category=Batch%20test')[1]):
+                self.post(conn, '/api/transactions/delete', {"id": row['id']})
+            stats = json.loads(self.get(conn, '/api/stats?period=all')[1])
+            etag = self.get(conn, '/api/settings')[0].getheader('ETag')
+            payload = {"amount": 5, "type": "expense", "category": "Batch test", "date": "2001-01-01"}
+            response, data = self.post(conn, '/api/batch', {"requests": [
+                {"method": "GET", "path": "/api/stats?period=all"},
+                {"method": "GET", "path": "/api/settings", "if_none_match": etag},
+                {"method": "POST", "path": "/api/transactions/create", "body": payload},
+                {"method": "POST", "path": "/api/transactions/create", "body": {"amount": 5}},
+                {"method": "GET", "path": "/api/transactions?category=Batch%20test"},
+                {"method": "GET", "path": "/api/nowhere"},
+            ]})
+            self.assertEqual(response.status, 200)
+            results = data['results']
+            self.assertEqual([r['status'] for r in results], [200, 304, 201, 500, 200, 404])
+            self.assertEqual(results[0]['body'], stats)
+            self.assertIsNone(results[1]['body'])
+            self.assertEqual(results[1]['etag'], etag)
+            # The read after the write sees it; the failed write left nothing behind
+            rows = results[4]['body']
+            self.assertEqual([row['amount'] for row in rows], [5])
+
+            response, data = self.post(conn, '/api/batch', {"requests": [
+                {"method": "POST", "path": "/api/transactions/delete", "body": {"id": row['id']}} for row in rows]})
+            self.assertEqual([r['status'] for r in data['results']], [200] * len(rows))
+
+            for payload in ({}, {"requests": []}, {"requests": [{"method": "GET", "path": "/api/export"}]},
+                            {"requests": [{"method": "PUT", "path": "/api/stats"}]}):
+                response, data = self.post(conn, '/api/batch', payload)
+                self.assertEqual(response.status, 400, payload)
+        finally:
+            conn.close()
+        print("Batch verified")
+
+    def test_07_bulk_operations(self):
+        print("\nTesting bulk transaction endpoints...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            selection = {"filter": {"category": "Bulk test"}}
+            self.post(conn, '/api/transactions/bulk_delete', selection)
+            self.post(conn, '/api/transactions/bulk_delete', {"filter": {"category": "Bulk renamed"}})
+            for day in (1, 2, 3):
+                self.post(conn, '/api/transactions/create', {"amount": 5, "type": "expense", "category": "Bulk test",
+                                                             "source": "cash", "date": f"2001-01-0{day}"})
+
+            response, data = self.post(conn, '/api/transactions/bulk_update',
+                                       dict(selection, patch={"amount": 7, "description": "bulk"}))
+            self.assertEqual((response.status, data), (200, {"matched": 3, "updated": 3}))
+            response, data = self.post(conn, '/api/transactions/bulk_recategorize',
+                                       {"categories": {"Bulk test": "Bulk renamed"}})
+            self.assertEqual(data, {"updated": 3, "categories": {"Bulk test": 3}})
+            rows = json.loads(self.get(conn, '/api/transactions?category=Bulk%20renamed')[1])
+            self.assertEqual([(r['amount'], r['description']) for r in rows], [(7, 'bulk')] * 3)
+
+            response, data = self.post(conn, '/api/transactions/bulk_delete', {"ids": [r['id'] for r in rows]})
+            self.assertEqual(data, {"matched": 3, "deleted": 3})
+            response, data = self.post(conn, '/api/transactions/bulk_update', dict(selection, patch={"amount": -1}))
+            self.assertEqual(response.status, 400)
+            response, data = self.post(conn, '/api/investments/bulk_delete', {"ids": []})
+            self.assertEqual(response.status, 400)
+        finally:
+            conn.close()
+        print("Bulk operations verified")
+
+    def test_08_routing_and_metrics(self):
+        print("\nTesting routing and /api/metrics...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            response, _ = self.get(conn, '/api/jobs/999999999')
+            self.assertEqual(response.status, 404)
+            # The path exists, for POST only
+            response, _ = self.get(conn, '/api/transactions/create')
+            self.assertEqual((response.status, response.getheader('Allow')), (405, 'POST'))
+
+            response, body = self.get(conn, '/api/metrics')
+            self.assertEqual(response.status, 200)
+            self.assertTrue(response.getheader('Content-Type').startswith('text/plain; version=0.0.4'))
+            text = body.decode()
+            job = 'method="GET",route="/api/jobs/<int:job_id>"'
+            self.assertIn('parfin_http_requests_total{%s,status="404"}' % job, text)
+            # Raw paths never become labels
+            self.assertIn('parfin_http_requests_total{method="GET",route="<unmatched>",status="405"}', text)
+            self.assertNotIn('999999999', text)
+            self.assertIn('parfin_http_request_duration_seconds_bucket{%s,le="+Inf"}' % job, text)
+            # The scrape itself is in flight while it is rendered
+            self.assertIn('parfin_http_requests_in_flight{method="GET",route="/api/metrics"} 1', text)
+            self.assertIn('# TYPE parfin_http_response_bytes_total counter', text)
+        finally:
+            conn.close()
+        print("Routing and metrics verified")
+
+    def test_09_profiles_endpoint(self):
+        print("\nTesting /api/debug/profiles...")
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+        try:
+            # Profiling is off unless PARFIN_PROFILE_SAMPLE_PERCENT or PARFIN_PROFILE_TOKEN is set
+            response, body = self.get(conn, '/api/debug/profiles')
+            self.assertEqual(response.status, 200)
+            data = json.loads(body)
+            if not data['enabled']:
+                self.assertEqual(data['items'], [])
+            response, _ = self.get(conn, '/api/debug/profiles/999999')
+            self.assertEqual(response.status, 404)
+        finally:
+            conn.close()
+        print("Profiles endpoint verified")
+
+class TestBusyServer(unittest.TestCase):
+    # Runs its own server with a single worker on a free port
+
+    def setUp(self):
+        self.httpd = server.PooledTCPServer(('127.0.0.1', 0), server.ParFinHandler, workers=1)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def connect(self):
+        return http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=5)
+
+    def test_keep_alive_yields_to_waiting_connections(self):
+        held, waiting = self.connect(), self.connect()
+        try:
+            held.request('GET', '/api/auth/check')
+            response = held.getresponse()
+            response.read()
+            self.assertFalse(response.will_close)
+
+            # The only worker is idling on held, so this one waits in the queue
+            waiting.request('GET', '/api/auth/check')
+            deadline = time.time() + 5
+            while self.httpd.pending.empty() and time.time() < deadline:
+                time.sleep(0.01)
+            start = time.time()
+            held.request('GET', '/api/auth/check')
+            response = held.getresponse()
+            response.read()
+            self.assertTrue(response.will_close)
+
+            response = waiting.getresponse()
+            self.assertEqual((response.status, json.loads(response.read())), (200, {"status": "ok"}))
+            self.assertLess(time.time() - start, server.KEEP_ALIVE_TIMEOUT)
+        finally:
+            held.close()
+            waiting.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+import sys
+import os
+import gzip
+import time
+import threading
+import http.client
+import tempfile
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import server
+from backend import static
+from backend import compression
+
+class TestStaticAssets(unittest.TestCase):
+    # Runs its own server on a free port over a temporary web root
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, 'js'))
+        self.write('index.html', '<html>' + 'x' * 2000 + '</html>')
+        self.write('js/app.js', 'console.log("hi");\n' * 200)
+        self.write('tiny.css', 'body{}')
+        self.write('big.bin', 'b' * 5000)
+
+        self.old_root = server.WEB_ROOT
+        server.WEB_ROOT = self.root
+        # big.bin is over the limit, so it is served from disk
+        static._cache = static.StaticCache(self.root, max_file=4096)
+        self.httpd = server.PooledTCPServer(('127.0.0.1', 0), server.ParFinHandler, workers=2)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.conn = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=5)
+
+    def tearDown(self):
+        self.conn.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        server.WEB_ROOT = self.old_root
+        static._cache = None
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write(text)
+
+    def get(self, path, headers=None):
+        self.conn.request('GET', path, headers=headers or {})
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def test_01_etag_and_304(self):
+        response, body = self.get('/js/app.js')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b'console.log("hi");\n' * 200)
+        etag = response.getheader('ETag')
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(response.getheader('Cache-Control'), 'no-cache')
+
+        response, body = self.get('/js/app.js', {'If-None-Match': etag})
+        self.assertEqual((response.status, body), (304, b''))
+        self.assertEqual(response.getheader('ETag'), etag)
+
+        response, _ = self.get('/js/app.js', {'If-None-Match': '"stale"'})
+        self.assertEqual(response.status, 200)
+
+        last_modified = response.getheader('Last-Modified')
+        response, body = self.get('/js/app.js', {'If-Modified-Since': last_modified})
+        self.assertEqual((response.status, body), (304, b''))
+        response, _ = self.get('/js/app.js', {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.assertEqual(response.status, 200)
+
+    def test_02_gzip_variant(self):
+        response, body = self.get('/', {'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        self.assertIn('charset=utf-8', response.getheader('Content-Type'))
+        self.assertTrue(gzip.decompress(body).startswith(b'<html>'))
+        gzip_etag = response.getheader('ETag')
+
+        response, body = self.get('/', {'Accept-Encoding': 'gzip;q=0'})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertTrue(body.startswith(b'<html>'))
+        self.assertNotEqual(response.getheader('ETag'), gzip_etag)
+
+        # Too small to compress
+        response, body = self.get('/tiny.css', {'Accept-Encoding': 'gzip'})
+        self.assertEqual((response.getheader('Content-Encoding'), body), (None, b'body{}'))
+
+    def test_03_large_files_are_sent_from_disk(self):
+        cache = static.get_cache(self.root)
+        self.assertIsNone(cache.lookup('/big.bin').body)
+        response, body = self.get('/big.bin')
+        self.assertEqual((response.status, body), (200, b'b' * 5000))
+
+        # Changes on disk are noticed without watch mode
+        etag = response.getheader('ETag')
+        time.sleep(0.01)
+        self.write('big.bin', 'c' * 6000)
+        response, body = self.get('/big.bin', {'If-None-Match': etag})
+        self.assertEqual((response.status, body), (200, b'c' * 6000))
+        self.assertEqual(cache.stats()['uncached_files'], 1)
+
+    def test_04_watch_mode_and_missing_files(self):
+        response, _ = self.get('/../../etc/passwd')
+        self.assertEqual(response.status, 404)
+        response, _ = self.get('/new.js')
+        self.assertEqual(response.status, 404)
+
+        static._cache = static.StaticCache(self.root, max_file=4096, watch=True)
+        self.write('new.js', 'let a = 1;')
+        response, body = self.get('/new.js')
+        self.assertEqual((response.status, body), (200, b'let a = 1;'))
+        time.sleep(0.01)
+        self.write('new.js', 'let a = 2;')
+        response, body = self.get('/new.js')
+        self.assertEqual(body, b'let a = 2;')
+        os.remove(os.path.join(self.root, 'new.js'))
+        response, _ = self.get('/new.js')
+        self.assertEqual(response.status, 404)
+
+    def test_05_accept_encoding_parsing(self):
+        self.assertTrue(compression.accepts_gzip('br, gzip;q=0.5'))
+        self.assertTrue(compression.accepts_gzip('*'))
+        self.assertFalse(compression.accepts_gzip('gzip; q=0'))
+        self.assertFalse(compression.accepts_gzip('identity'))
+        self.assertFalse(compression.accepts_gzip(None))
+
+if __name__ == '__main__':
+    unittest.main()
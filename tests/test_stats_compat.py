@@ -0,0 +1,156 @@
+import unittest
+import sys
+import os
+import random
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import rollups
+import backend.logic as logic
+from db_case import SharedDatabaseTestCase
+
+def reference_period_stats(conn, user_id, start_date, end_date, target_currency, rate):
+    # The row-by-row implementation that calculate_stats used before aggregation moved
+    # into SQL. Rows are read in idx_transactions_user_date_cover order, which is the
+    # order that implementation saw them in.
+    def get_source(s):
+        return 'bank' if s == 'bank' else 'cash'
+
+    monthly_income = 0.0
+    monthly_income_stats = {'cash': 0.0, 'bank': 0.0}
+    monthly_expense = 0.0
+    monthly_expense_stats = {'cash': 0.0, 'bank': 0.0}
+
+    sql = "SELECT type, category, source, currency, amount FROM transactions WHERE user_id = ?"
+    args = [user_id]
+    if start_date:
+        sql += " AND date >= ?"
+        args.append(start_date)
+    if end_date:
+        sql += " AND date <= ?"
+        args.append(end_date)
+    sql += " ORDER BY date, type, category, source, currency, amount"
+
+    chart_data = {}
+    allocation_categories = ['Saving', 'Support', 'Investment', 'Together']
+
+    for t in conn.execute(sql, args):
+        amount = logic.convert_amount(t['amount'], t['currency'], target_currency, rate)
+        source = get_source(t['source'])
+        cat = t['category']
+        typ = t['type']
+
+        if typ == 'income':
+            monthly_income += amount
+            monthly_income_stats[source] += amount
+        elif typ == 'expense':
+            if cat not in allocation_categories:
+                monthly_expense += amount
+                monthly_expense_stats[source] += amount
+                if cat not in chart_data:
+                    chart_data[cat] = {'cash': 0.0, 'bank': 0.0}
+                chart_data[cat][source] += amount
+
+    chart_cats = list(chart_data.keys())
+    return {
+        "period_stats": {
+            "income": {"total": monthly_income, "cash": monthly_income_stats['cash'], "bank": monthly_income_stats['bank']},
+            "expense": {"total": monthly_expense, "cash": monthly_expense_stats['cash'], "bank": monthly_expense_stats['bank']}
+        },
+        "chart_data": {
+            "labels": chart_cats,
+            "datasets": {
+                "cash": [chart_data[c]['cash'] for c in chart_cats],
+                "bank": [chart_data[c]['bank'] for c in chart_cats]
+            }
+        }
+    }
+
+class TestStatsCompatibility(SharedDatabaseTestCase):
+    """calculate_stats' SQL aggregation must reproduce the row-by-row period_stats and chart_data."""
+    db_name = 'compat.db'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        rnd = random.Random(7)
+        categories = ['Food', 'Rent', 'Transport', 'Salary', 'Saving', 'Support', 'Investment', 'Together', 'Điện']
+        rows = []
+        for _ in range(2000):
+            rows.append((
+                rnd.choice([1, 1, 1, 2]),
+                round(rnd.uniform(1, 5000000), 2),
+                rnd.choice(['VND', 'VND', 'USD', None]),
+                rnd.choice(['income', 'expense', 'expense', 'allocation']),
+                rnd.choice(categories),
+                rnd.choice(['cash', 'bank', None, 'other']),
+                f"{rnd.choice([2023, 2024])}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            ))
+        with db.connection() as conn:
+            conn.executemany('''
+                INSERT INTO transactions (user_id, amount, currency, type, category, source, date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+    def assertStructureEqual(self, expected, actual, path=''):
+        if isinstance(expected, dict):
+            self.assertEqual(list(expected.keys()), list(actual.keys()), path)
+            for key in expected:
+                self.assertStructureEqual(expected[key], actual[key], f"{path}/{key}")
+        elif isinstance(expected, list):
+            self.assertEqual(len(expected), len(actual), path)
+            for i, (e, a) in enumerate(zip(expected, actual)):
+                self.assertStructureEqual(e, a, f"{path}[{i}]")
+        elif isinstance(expected, float):
+            # Converting grouped sums instead of single rows only changes float rounding
+            self.assertAlmostEqual(expected, actual, delta=1e-9 * max(1.0, abs(expected)), msg=path)
+        else:
+            self.assertEqual(expected, actual, path)
+
+    def test_matches_row_by_row_results(self):
+        ranges = [
+            (None, None),
+            ('2024-01-01', '2024-12-31'),
+            ('2023-03-01', '2023-03-31'),
+            ('2023-06-15', None),
+            (None, '2023-02-10'),
+            ('2030-01-01', '2030-01-31'),
+        ]
+        for user_id in (1, 2, 3):
+            for start_date, end_date in ranges:
+                for currency in ('VND', 'USD'):
+                    actual = logic.calculate_stats(user_id, start_date, end_date, currency)
+                    with db.connection() as conn:
+                        expected = reference_period_stats(conn, user_id, start_date, end_date, currency,
+                                                          logic.get_exchange_rate(conn))
+                    label = f"user={user_id} {start_date}..{end_date} {currency}"
+                    self.assertStructureEqual(expected['period_stats'], actual['period_stats'], label)
+                    self.assertStructureEqual(expected['chart_data'], actual['chart_data'], label)
+
+    def test_rollups_follow_updates_and_deletes(self):
+        rnd = random.Random(11)
+        with db.connection() as conn:
+            ids = [r[0] for r in conn.execute('SELECT id FROM transactions')]
+            for trans_id in rnd.sample(ids, 200):
+                conn.execute('''
+                    UPDATE transactions SET amount = ?, category = ?, source = ?, date = ?, currency = ? WHERE id = ?
+                ''', (rnd.uniform(1, 1000), rnd.choice(['Food', 'Rent', 'Saving']), rnd.choice(['cash', 'bank']),
+                      f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", rnd.choice(['VND', 'USD']), trans_id))
+            conn.executemany('DELETE FROM transactions WHERE id = ?', [(i,) for i in rnd.sample(ids, 300)])
+            self.assertEqual(rollups.verify(conn), [])
+        self.test_matches_row_by_row_results()
+
+    def test_split_range(self):
+        self.assertEqual(rollups.split_range('2024-01-01', '2024-12-31'), ('2024-01', '2024-12', []))
+        self.assertEqual(rollups.split_range(None, None), (None, None, []))
+        self.assertEqual(rollups.split_range('2024-01-15', '2024-03-10'),
+                         ('2024-02', '2024-02', [('2024-01-15', '2024-01-31'), ('2024-03-01', '2024-03-10')]))
+        self.assertEqual(rollups.split_range('2024-02-01', '2024-02-29'), ('2024-02', '2024-02', []))
+        self.assertEqual(rollups.split_range('2024-02-03', '2024-02-20'), (False, False, [('2024-02-03', '2024-02-20')]))
+        self.assertEqual(rollups.split_range('2024-01-20', '2024-02-10'), (False, False, [('2024-01-20', '2024-02-10')]))
+        self.assertEqual(rollups.split_range(None, '2023-02-10'), (None, '2023-01', [('2023-02-01', '2023-02-10')]))
+        self.assertEqual(rollups.split_range('yesterday', None), (False, False, [('yesterday', None)]))
+
+if __name__ == '__main__':
+    unittest.main()
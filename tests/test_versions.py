@@ -0,0 +1,46 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from backend import db
+from backend import versions
+from db_case import DatabaseTestCase
+
+class TestDataVersions(DatabaseTestCase):
+    db_name = 'versions.db'
+
+    def test_01_writes_bump_versions(self):
+        tables = ('transactions', 'settings')
+        with db.connection() as conn:
+            before = versions.get_versions(conn, 1, tables)
+            etag = versions.etag(conn, 1, tables, '/api/stats', {})
+            conn.execute('''INSERT INTO transactions (user_id, amount, type, category, date)
+                            VALUES (1, 10, 'expense', 'Food', '2024-01-01')''')
+            after_insert = versions.get_versions(conn, 1, tables)
+            conn.execute('UPDATE transactions SET amount = 20 WHERE user_id = 1')
+            conn.execute('DELETE FROM transactions WHERE user_id = 1')
+            after_delete = versions.get_versions(conn, 1, tables)
+            self.assertEqual(versions.get_versions(conn, 2, tables)['transactions'], 0)
+            self.assertNotEqual(versions.etag(conn, 1, tables, '/api/stats', {}), etag)
+
+        self.assertEqual(after_insert['transactions'], before['transactions'] + 1)
+        # Only growth matters: other triggers' updates may bump it again
+        self.assertGreater(after_delete['transactions'], after_insert['transactions'])
+        self.assertEqual(after_delete['settings'], before['settings'])
+
+    def test_02_shared_tables_and_moved_rows(self):
+        with db.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('etag_test', '1')")
+            # settings belong to everyone
+            self.assertEqual(versions.get_versions(conn, 1, ('settings',)),
+                             versions.get_versions(conn, 2, ('settings',)))
+
+            conn.execute('''INSERT INTO transactions (user_id, amount, type, category, date)
+                            VALUES (1, 10, 'expense', 'Food', '2024-01-01')''')
+            before = versions.get_versions(conn, 2, ('transactions',))['transactions']
+            conn.execute('UPDATE transactions SET user_id = 2 WHERE user_id = 1')
+            self.assertEqual(versions.get_versions(conn, 2, ('transactions',))['transactions'], before + 1)
+
+if __name__ == '__main__':
+    unittest.main()